@@ -1,5 +1,6 @@
 import asyncio
 from toio import *
+from toio_control.connection import ConnectionManager
 
 # --- 1. 通知を受け取る「受付係」の関数（ハンドラ） ---
 def position_handler(id_info):
@@ -37,8 +38,10 @@ def notification_handler(payload: bytearray):
 # --- 2. メイン処理 ---
 async def main():
     print("toioに接続します...")
-    async with ToioCoreCube() as cube:
+    async with ConnectionManager() as cubes:
+        cube = cubes[0]
         print("接続完了！toioをマットの上に置いてください。")
+        print(cubes.report())
         print("手で動かすと、座標がリアルタイムで表示されます。")
         print("(Ctrl+C で終了します)")
 
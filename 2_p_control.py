@@ -1,6 +1,12 @@
 import asyncio
 import math
 from toio import *
+from toio_control.adaptive import AdaptiveRate
+from toio_control.clock import REAL_CLOCK
+from toio_control.connection import ConnectionManager
+from toio_control.estimator import PoseEstimator
+from toio_control.loop import run_control_loop
+from toio_control.state import CubeState
 
 # --- 設定 ---
 # 目標地点の座標（マットの中央付近）
@@ -9,27 +15,18 @@ TARGET_Y = 250
 # ゴールとみなす範囲（半径）
 GOAL_RADIUS = 20
 
-# 現在地を保持する変数（グローバル変数として扱う）
-current_x = 0
-current_y = 0
-current_angle = 0
-is_position_received = False # 座標を一度でも受信したかフラグ
-
-# --- 1. 座標を受け取るハンドラ ---
-def position_handler(id_info):
-    global current_x, current_y, current_angle, is_position_received
-    if id_info and isinstance(id_info, PositionId):
-        # 最新の座標を変数に更新
-        current_x = id_info.center.point.x
-        current_y = id_info.center.point.y
-        current_angle = id_info.center.angle
-        is_position_received = True
-
-def notification_handler(payload: bytearray):
-    id_info = IdInformation.is_my_data(payload)
-    position_handler(id_info)
-
-# --- 2. 角度の差分を計算する便利関数 ---
+# 制御ループの方式
+# "poll": 50msごとに最新の座標で制御 / "notify": 座標の通知が届くたびに制御
+CONTROL_MODE = "poll"
+CONTROL_PERIOD = 0.05      # poll のときの制御周期 [s]
+MIN_CONTROL_PERIOD = 0.02  # notify のときの最短制御周期 [s]
+# True にすると、通知の遅れを補正した予測位置で制御し、座標が読めない間は推測航法で進む
+POSE_ESTIMATOR = True
+# True にすると、遠くをまっすぐ走る間は周期を延ばし（100ms）、ゴールの近くや大きく曲がるときは縮める（40ms）。
+# そのほかは CONTROL_PERIOD と同じ 50ms
+ADAPTIVE_RATE = True
+
+# --- 1. 角度の差分を計算する便利関数 ---
 # -180度〜+180度の範囲で、どちらにどれだけ回ればいいかを計算
 def get_angle_diff(target_deg, current_deg):
     diff = target_deg - current_deg
@@ -37,68 +34,81 @@ def get_angle_diff(target_deg, current_deg):
     while diff > 180: diff -= 360
     return diff
 
+# --- 2. 制御ループ（実機でもシミュレーターでも同じものを動かす） ---
+async def run(cube, clock=REAL_CLOCK):
+    # キューブの状態（座標の通知が来るたびに上書きされる）
+    state = CubeState(clock)
+    await cube.api.id_information.register_notification_handler(state)
+
+    print("マットに置いてください。目標に向かって走り出します！")
+    # 最初の座標を受信するまで待つ（届いた瞬間に次へ進む）
+    await state.first_pose()
+
+    estimator = PoseEstimator() if POSE_ESTIMATOR else None
+    rate = AdaptiveRate() if ADAPTIVE_RATE else None
+
+    # --- 1回分の制御計算（座標を受け取って左右のモーター速度を返す。ゴールなら None） ---
+    def step(x, y, angle, now):
+        # A. ゴールまでの差分を計算（距離と角度）
+        dx = TARGET_X - x
+        dy = TARGET_Y - y
+        distance = math.sqrt(dx*dx + dy*dy) # 三平方の定理で距離を計算
+
+        # B. ゴール判定（x, y は推定器の予測で少し先の位置なので、実際に届いた座標で判定する）
+        if math.hypot(TARGET_X - state.x, TARGET_Y - state.y) < GOAL_RADIUS:
+            print("ゴールに到達しました！")
+            return None # ループを抜ける
+
+        # C. 目標角度の計算 (atan2を使用)
+        # math.atan2の結果はラジアンなので、度に変換する
+        target_rad = math.atan2(dy, dx)
+        target_deg = math.degrees(target_rad)
+
+        # 現在の向きとの差分を計算
+        angle_diff = get_angle_diff(target_deg, angle)
+        # 次の制御までの周期を、距離と角度のズレで決める
+        if rate is not None:
+            rate.update([distance], [angle_diff], now=now)
+
+        # D. モーター速度の決定（シンプルなP制御）
+        # 基本速度（距離が遠いほど速く、最大80）
+        base_speed = min(int(distance * 0.5), 80)
+        # 旋回成分（角度のズレが大きいほど強く曲がる）
+        turn_speed = int(angle_diff * 0.8) # 係数1.5は調整が必要
+
+        # 左右のモーター速度を計算
+        left_speed = base_speed + turn_speed
+        right_speed = base_speed - turn_speed
+
+        # 速度制限（toioの仕様上 -100〜100の範囲に収める）
+        left_speed = max(min(left_speed, 100), -100)
+        right_speed = max(min(right_speed, 100), -100)
+
+        print(f"Dist:{distance:.1f}, AngleDiff:{angle_diff:.1f}, L:{left_speed}, R:{right_speed}")
+        return left_speed, right_speed
+
+    # --- 制御ループ ---
+    try:
+        # 制御周期（CONTROL_PERIOD を短くすると滑らかになるが負荷が増える）
+        stats = await run_control_loop(cube, step, CONTROL_MODE, clock,
+                                       period=CONTROL_PERIOD, min_period=MIN_CONTROL_PERIOD,
+                                       estimator=estimator, rate=rate, state=state)
+        print(stats.report())
+    except KeyboardInterrupt:
+        print("\n停止します。")
+    finally:
+        await cube.api.motor.motor_control(0, 0) # 安全のため最後に必ず停止
+        await cube.api.id_information.unregister_notification_handler(state)
+        print("切断しました。")
+
 # --- 3. メイン処理 ---
 async def main():
     print("toioに接続します...")
-    async with ToioCoreCube() as cube:
+    async with ConnectionManager() as cubes:
+        cube = cubes[0]
         print("接続完了！")
-        await cube.api.id_information.register_notification_handler(notification_handler)
-        
-        print("マットに置いてください。目標に向かって走り出します！")
-        # 最初の座標を受信するまで待つ
-        while not is_position_received:
-            await asyncio.sleep(0.1)
-
-        # --- 制御ループ ---
-        try:
-            while True:
-                # A. ゴールまでの差分を計算（距離と角度）
-                dx = TARGET_X - current_x
-                dy = TARGET_Y - current_y
-                distance = math.sqrt(dx*dx + dy*dy) # 三平方の定理で距離を計算
-
-                # B. ゴール判定
-                if distance < GOAL_RADIUS:
-                    print("ゴールに到達しました！")
-                    await cube.api.motor.motor_control(0, 0) # 停止
-                    break # ループを抜ける
-
-                # C. 目標角度の計算 (atan2を使用)
-                # math.atan2の結果はラジアンなので、度に変換する
-                target_rad = math.atan2(dy, dx)
-                target_deg = math.degrees(target_rad)
-                
-                # 現在の向きとの差分を計算
-                angle_diff = get_angle_diff(target_deg, current_angle)
-
-                # D. モーター速度の決定（シンプルなP制御）
-                # 基本速度（距離が遠いほど速く、最大80）
-                base_speed = min(int(distance * 0.5), 80)
-                # 旋回成分（角度のズレが大きいほど強く曲がる）
-                turn_speed = int(angle_diff * 0.8) # 係数1.5は調整が必要
-
-                # 左右のモーター速度を計算
-                left_speed = base_speed + turn_speed
-                right_speed = base_speed - turn_speed
-
-                # 速度制限（toioの仕様上 -100〜100の範囲に収める）
-                left_speed = max(min(left_speed, 100), -100)
-                right_speed = max(min(right_speed, 100), -100)
-
-                # モーター指令を送信
-                await cube.api.motor.motor_control(left_speed, right_speed)
-                
-                print(f"Dist:{distance:.1f}, AngleDiff:{angle_diff:.1f}, L:{left_speed}, R:{right_speed}")
-
-                # 制御周期（この時間を短くすると滑らかになるが負荷が増える）
-                await asyncio.sleep(0.05) # 50msごとに計算
-
-        except KeyboardInterrupt:
-            print("\n停止します。")
-        finally:
-            await cube.api.motor.motor_control(0, 0) # 安全のため最後に必ず停止
-            await cube.api.id_information.unregister_notification_handler(notification_handler)
-            print("切断しました。")
+        print(cubes.report())
+        await run(cube)
 
 if __name__ == '__main__':
     try:
@@ -1,7 +1,14 @@
 import asyncio
 import math
-import time
 from toio import *
+from toio_control import PIDBank, get_angle_diff, mix_wheels
+from toio_control.adaptive import AdaptiveRate
+from toio_control.clock import REAL_CLOCK
+from toio_control.connection import ConnectionManager
+from toio_control.estimator import PoseEstimator
+from toio_control.gains import apply_gains
+from toio_control.loop import run_control_loop
+from toio_control.state import CubeState
 
 # --- 設定パラメータ (チューニングの肝！) ---
 # 距離制御用のPIDゲイン
@@ -14,132 +21,98 @@ ANGLE_KP = 0.6 # 向き直りの強さ
 ANGLE_KI = 0.0
 ANGLE_KD = 0.01 # 首振りの抑制
 
+# PIDの出力制限 (前進, 旋回)（tune.py もこの値でゲインを探す）
+OUT_LIMIT = (80, 50)
+
+# tune.py で求めたゲイン（pid_gains.json）を使うなら True（simulate.py --tuned-gains でも切り替えられる）
+USE_TUNED_GAINS = False
+if USE_TUNED_GAINS:
+    apply_gains(globals())
+
 TARGET_X = 250
 TARGET_Y = 250
 GOAL_RADIUS = 10
 
-# --- PIDコントローラークラス ---
-class PIDController:
-    def __init__(self, kp, ki, kd):
-        self.kp = kp
-        self.ki = ki
-        self.kd = kd
-        self.prev_error = 0.0
-        self.integral = 0.0
-        self.last_time = None
-
-    def update(self, error):
-        current_time = time.time()
-        
-        # 初回呼び出し時の処理
-        if self.last_time is None:
-            self.last_time = current_time
-            return error * self.kp
-
-        # 経過時間(dt)の計算
-        dt = current_time - self.last_time
-        self.last_time = current_time
-        
-        if dt <= 0: return 0
-
-        # P項
-        p_term = error * self.kp
-        
-        # I項（積分の計算）
-        self.integral += error * dt
-        i_term = self.integral * self.ki
-        
-        # D項（微分の計算：前回の偏差との差）
-        derivative = (error - self.prev_error) / dt
-        d_term = derivative * self.kd
-        
-        # 次回のために保存
-        self.prev_error = error
-
-        return p_term + i_term + d_term
-
-# --- グローバル変数 ---
-current_x = 0
-current_y = 0
-current_angle = 0
-is_position_received = False 
-
-# --- ハンドラ ---
-def position_handler(id_info):
-    global current_x, current_y, current_angle, is_position_received
-    if id_info and isinstance(id_info, PositionId):
-        current_x = id_info.center.point.x
-        current_y = id_info.center.point.y
-        current_angle = id_info.center.angle
-        is_position_received = True
-
-def notification_handler(payload: bytearray):
-    id_info = IdInformation.is_my_data(payload)
-    position_handler(id_info)
-
-def get_angle_diff(target_deg, current_deg):
-    diff = target_deg - current_deg
-    while diff <= -180: diff += 360
-    while diff > 180: diff -= 360
-    return diff
+# 制御ループの方式
+# "poll": 50msごとに最新の座標で制御 / "notify": 座標の通知が届くたびに制御
+CONTROL_MODE = "poll"
+CONTROL_PERIOD = 0.05      # poll のときの制御周期 [s]
+MIN_CONTROL_PERIOD = 0.02  # notify のときの最短制御周期 [s]
+# True にすると、通知の遅れを補正した予測位置で制御し、座標が読めない間は推測航法で進む
+POSE_ESTIMATOR = True
+# True にすると、遠くをまっすぐ走る間は周期を延ばし（100ms）、ゴールの近くや大きく曲がるときは縮める（40ms）。
+# そのほかは CONTROL_PERIOD と同じ 50ms
+ADAPTIVE_RATE = True
+
+# --- 制御ループ（実機でもシミュレーターでも同じものを動かす） ---
+async def run(cube, clock=REAL_CLOCK):
+    # キューブの状態（座標の通知が来るたびに上書きされる）
+    state = CubeState(clock)
+    await cube.api.id_information.register_notification_handler(state)
+
+    # PIDコントローラーの作成（距離と角度をまとめて1台分）
+    # 出力制限は OUT_LIMIT（前進は最大80、旋回は最大50）
+    pid = PIDBank(1,
+                  kp=(DIST_KP, ANGLE_KP),
+                  ki=(DIST_KI, ANGLE_KI),
+                  kd=(DIST_KD, ANGLE_KD),
+                  out_limit=OUT_LIMIT)
+
+    print("目標に向かってスタート！")
+    await state.first_pose()
+
+    estimator = PoseEstimator() if POSE_ESTIMATOR else None
+    rate = AdaptiveRate() if ADAPTIVE_RATE else None
+    last_time = clock.now()
+
+    # 1回分の制御計算（座標を受け取って左右のモーター速度を返す。ゴールなら None）
+    def step(x, y, angle, now):
+        nonlocal last_time
+        # 1. 偏差の計算
+        dx = TARGET_X - x
+        dy = TARGET_Y - y
+        distance = math.sqrt(dx*dx + dy*dy)
+
+        # ゴール判定は実際に届いた座標で行う（x, y は推定器の予測で少し先の位置なので、手前で止まってしまう）
+        if math.hypot(TARGET_X - state.x, TARGET_Y - state.y) < GOAL_RADIUS:
+            print("ゴール！！")
+            return None
+
+        target_rad = math.atan2(dy, dx)
+        target_deg = math.degrees(target_rad)
+        angle_diff = get_angle_diff(target_deg, angle)
+        if rate is not None:
+            rate.update([distance], [angle_diff], now=now)
+
+        # 2. PID計算（距離と角度を1回でまとめて計算、出力制限込み）
+        # 推定器があれば、D項は差分ではなく推定した速度から計算する
+        rates = [estimator.error_rates(TARGET_X, TARGET_Y)] if estimator is not None else None
+        outputs = pid.update([[distance, angle_diff]], now - last_time, rates=rates)
+        last_time = now
+
+        # 3. 左右配分（toioの入力限界 -100〜100 に収める）
+        left, right = (int(v) for v in mix_wheels(outputs)[0])
+        return left, right
+
+    try:
+        stats = await run_control_loop(cube, step, CONTROL_MODE, clock,
+                                       period=CONTROL_PERIOD, min_period=MIN_CONTROL_PERIOD,
+                                       estimator=estimator, rate=rate, state=state)
+        print(stats.report())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        await cube.api.motor.motor_control(0, 0)
+        await cube.api.id_information.unregister_notification_handler(state)
 
 # --- メイン処理 ---
 async def main():
     print("toioに接続します...")
-    async with ToioCoreCube() as cube:
+    async with ConnectionManager() as cubes:
+        cube = cubes[0]
         print("接続完了！")
-        await cube.api.id_information.register_notification_handler(notification_handler)
-        
-        # PIDコントローラーのインスタンス作成
-        pid_dist = PIDController(DIST_KP, DIST_KI, DIST_KD)
-        pid_angle = PIDController(ANGLE_KP, ANGLE_KI, ANGLE_KD)
-
-        print("目標に向かってスタート！")
-        while not is_position_received:
-            await asyncio.sleep(0.1)
-
-        try:
-            while True:
-                # 1. 偏差の計算
-                dx = TARGET_X - current_x
-                dy = TARGET_Y - current_y
-                distance = math.sqrt(dx*dx + dy*dy)
-                
-                if distance < GOAL_RADIUS:
-                    print("ゴール！！")
-                    await cube.api.motor.motor_control(0, 0)
-                    break 
-
-                target_rad = math.atan2(dy, dx)
-                target_deg = math.degrees(target_rad)
-                angle_diff = get_angle_diff(target_deg, current_angle)
-
-                # 2. PID計算（ここがスッキリ！）
-                # 距離に対するPID操作量
-                speed_output = pid_dist.update(distance)
-                
-                # 角度に対するPID操作量
-                turn_output = pid_angle.update(angle_diff)
-
-                # 3. リミッターと左右配分
-                base_speed = max(min(speed_output, 80), -80) # 最大速度制限
-                turn_speed = max(min(turn_output, 50), -50)  # 旋回速度制限
-
-                left = int(base_speed + turn_speed)
-                right = int(base_speed - turn_speed)
-
-                # toioの入力限界(-100〜100)に収める
-                left = max(min(left, 100), -100)
-                right = max(min(right, 100), -100)
-
-                await cube.api.motor.motor_control(left, right)
-                await asyncio.sleep(0.05) 
-
-        except KeyboardInterrupt:
-            pass
-        finally:
-            await cube.api.motor.motor_control(0, 0)
-            await cube.api.id_information.unregister_notification_handler(notification_handler)
+        print(cubes.report())
+        await run(cube)
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
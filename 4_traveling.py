@@ -1,13 +1,57 @@
 import asyncio
 import math
-import time
-import pandas as pd
-import matplotlib.pyplot as plt
 from toio import *
+from toio_control import PIDBank, get_angle_diff, mix_wheels
+from toio_control.adaptive import AdaptiveRate
+from toio_control.capture import CaptureRecorder
+from toio_control.clock import REAL_CLOCK
+from toio_control.connection import ConnectionManager
+from toio_control.estimator import PoseEstimator
+from toio_control.gains import apply_gains
+from toio_control.loop import run_control_loop
+from toio_control.plotting import LiveDashboard, plot_log
+from toio_control.state import CubeState
+from toio_control.target import TARGET, run_target_tour
+from toio_control.telemetry import TelemetryRecorder, make_run_dir
+from toio_control.trajectory import PURSUIT, PurePursuit, Trajectory
 
 # --- 設定パラメータ ---
 WAYPOINTS = [(150, 150), (350, 150), (350, 350), (150, 350), (150, 150)]
 REACH_THRESHOLD = 20 
+
+# 巡回の進め方
+# "target": キューブ内蔵の目標指定制御に経由点をまとめて渡す（書き込みは数回だけ）
+# "host": ホストのPIDで制御する（target が失敗したときもここから引き継ぐ）
+TOUR_MODE = "target"
+TARGET_MAX_SPEED = 70  # 目標指定制御の最高速度
+TARGET_TIMEOUT = 10    # 目標指定制御の1回あたりの制限時間 [s]
+
+# ホストで制御するときの進み方
+# "pursuit": 経由点を滑らかな曲線でつなぎ、速度を落とさずに曲がりながらたどる
+# "waypoint": 経由点ごとにPIDで近づき、着いてから次の経由点へ向きを変える
+HOST_FOLLOWER = "pursuit"
+
+# 制御ループの方式（ホストで制御するとき）
+# "poll": 50msごとに最新の座標で制御 / "notify": 座標の通知が届くたびに制御
+CONTROL_MODE = "poll"
+CONTROL_PERIOD = 0.05      # poll のときの制御周期 [s]
+MIN_CONTROL_PERIOD = 0.02  # notify のときの最短制御周期 [s]
+# True にすると、通知の遅れを補正した予測位置で制御し、座標が読めない間は推測航法で進む
+POSE_ESTIMATOR = True
+# True にすると、遠くをまっすぐ走る間は周期を延ばし（100ms）、ゴールの近くや大きく曲がるときは縮める（40ms）。
+# そのほかは CONTROL_PERIOD と同じ 50ms
+ADAPTIVE_RATE = True
+
+# 走行ログの保存先（実行ごとにサブフォルダを作り、チャンク単位で .npy を書き出す）
+LOG_DIR = "logs"
+# True にすると、ID通知とモーター指令をそのフォルダの capture.bin に記録する
+# （simulate.py 4_traveling.py --replay logs/<日時>/capture.bin で流し直せる）
+CAPTURE = True
+# 終了後のグラフで1系列あたりに描く最大の点数（これを超える分は最小値・最大値を残して間引く）
+PLOT_MAX_POINTS = 4000
+# True にすると走行中にグラフをリアルタイム表示する（別プロセスで描画）
+LIVE_DASHBOARD = False
+
 # 距離制御用のPIDゲイン
 DIST_KP = 0.8
 DIST_KI = 0.0
@@ -18,154 +62,159 @@ ANGLE_KP = 0.5
 ANGLE_KI = 0.0
 ANGLE_KD = 0.01
 
-# --- PIDクラス (省略なし) ---
-class PIDController:
-    def __init__(self, kp, ki, kd):
-        self.kp = kp; self.ki = ki; self.kd = kd
-        self.prev_error = 0.0; self.integral = 0.0; self.last_time = None
-    def update(self, error):
-        current_time = time.time()
-        if self.last_time is None:
-            self.last_time = current_time; return error * self.kp
-        dt = current_time - self.last_time
-        self.last_time = current_time
-        if dt <= 0: return 0
-        p_term = error * self.kp
-        self.integral += error * dt
-        i_term = self.integral * self.ki
-        derivative = (error - self.prev_error) / dt
-        d_term = derivative * self.kd
-        self.prev_error = error
-        return p_term + i_term + d_term
-
-# --- グローバル変数 ---
-current_x, current_y, current_angle = 0, 0, 0
-is_position_received = False 
-log_data = [] # ★データ記録用リスト
-
-# --- ハンドラ ---
-def position_handler(id_info):
-    global current_x, current_y, current_angle, is_position_received
-    if id_info and isinstance(id_info, PositionId):
-        current_x = id_info.center.point.x
-        current_y = id_info.center.point.y
-        current_angle = id_info.center.angle
-        is_position_received = True
-
-def notification_handler(payload: bytearray):
-    id_info = IdInformation.is_my_data(payload)
-    position_handler(id_info)
-
-def get_angle_diff(target_deg, current_deg):
-    diff = target_deg - current_deg
-    while diff <= -180: diff += 360
-    while diff > 180: diff -= 360
-    return diff
+# PIDの出力制限 (前進, 旋回)（tune.py もこの値でゲインを探す）
+OUT_LIMIT = (70, 50)
+
+# tune.py で求めたゲイン（pid_gains.json）を使うなら True（simulate.py --tuned-gains でも切り替えられる）
+USE_TUNED_GAINS = False
+if USE_TUNED_GAINS:
+    apply_gains(globals())
 
 # --- グラフ描画関数 ---
-def plot_data():
-    if not log_data:
-        print("データがありません")
-        return
-    
-    df = pd.DataFrame(log_data)
-    # 時間を0スタートに補正
-    df['time'] = df['time'] - df['time'][0]
-
-    fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(10, 12), sharex=True)
-
-    # 1. 距離
-    ax1.plot(df['time'], df['distance'], label='Target Distance', color='blue')
-    ax1.set_ylabel('Distance (mm)')
-    ax1.grid(True); ax1.legend()
-
-    # 2. 角度
-    ax2.plot(df['time'], df['target_angle'], label='Target Angle', color='green', linestyle='--')
-    ax2.plot(df['time'], df['current_angle'], label='Current Angle', color='orange')
-    ax2.set_ylabel('Angle (deg)')
-    ax2.grid(True); ax2.legend()
-
-    # 3. モーター出力
-    ax3.plot(df['time'], df['left_speed'], label='Left', color='red', alpha=0.7)
-    ax3.plot(df['time'], df['right_speed'], label='Right', color='blue', alpha=0.7)
-    ax3.set_ylabel('Speed')
-    ax3.set_xlabel('Time (s)')
-    ax3.grid(True); ax3.legend()
-
-    plt.tight_layout()
-    plt.savefig('log_graph.png') # 画像保存
-    print("グラフを 'log_graph.png' に保存しました。")
-    # plt.show() # 画面表示する場合はコメントアウトを外す
+def plot_data(log_dir):
+    # 保存したチャンクを1つずつ読みながら間引いて描く（走行時間が長くても描画時間はほぼ一定）
+    plot_log(log_dir, 'log_graph.png', max_points=PLOT_MAX_POINTS)
+    # 画面表示する場合は plot_log(..., show=True) にする
+
+# --- 制御ループ（実機でもシミュレーターでも同じものを動かす） ---
+async def run(cube, clock=REAL_CLOCK, log_dir=None):
+    # キューブの状態（座標の通知が来るたびに上書きされる）
+    state = CubeState(clock)
+    await cube.api.id_information.register_notification_handler(state)
+
+    # 距離と角度のPIDをまとめて1台分作成（出力制限は OUT_LIMIT）
+    pid = PIDBank(1,
+                  kp=(DIST_KP, ANGLE_KP),
+                  ki=(DIST_KI, ANGLE_KI),
+                  kd=(DIST_KD, ANGLE_KD),
+                  out_limit=OUT_LIMIT)
+    current_wp_index = 0
+
+    await state.first_pose()
+
+    # 目標指定制御の間の記録（モーターはキューブが動かすので、左右の速度は 0 として残す）
+    def record_target(pose, passed, now):
+        target_x, target_y = WAYPOINTS[min(passed, len(WAYPOINTS) - 1)]
+        target_deg = math.degrees(math.atan2(target_y - pose.y, target_x - pose.x))
+        telemetry.append(now, 0, math.hypot(target_x - pose.x, target_y - pose.y), pose.angle, target_deg, 0, 0)
+
+    estimator = PoseEstimator() if POSE_ESTIMATOR else None
+    rate = AdaptiveRate() if ADAPTIVE_RATE else None
+    follower = None
+    last_time = None
+
+    # 1回分の制御計算（pure pursuit で軌道をたどる。たどり終えたら None）
+    def follow(x, y, angle, now):
+        # 終点に着いたかどうかは、予測ではなく実際に届いた座標で判定する
+        command = follower.command(x, y, angle, measured=(state.x, state.y))
+        for k in follower.passed_waypoints():
+            print(f"ポイント[{current_wp_index + k - 1}]到達")
+        if command is None:
+            return None
+        left, right = command
+        tx, ty = follower.lookahead
+        target_deg = math.degrees(math.atan2(ty - y, tx - x))
+        # 周期は軌道の終わりまでの道のりと、軌道の向きとのズレで決める（経由点では止まらないので）
+        if rate is not None:
+            heading = follower.trajectory.heading[follower.index]
+            rate.update([follower.remaining], [get_angle_diff(heading, angle)], now=now)
+        # ログの distance（グラフの Target Distance）には、軌道の終点までの残りの道のりを残す
+        telemetry.append(now, 0, follower.remaining, angle, target_deg, left, right)
+        return left, right
+
+    # 1回分の制御計算（座標を受け取って左右のモーター速度を返す。巡回し終えたら None）
+    def step(x, y, angle, now):
+        nonlocal current_wp_index, last_time
+        while True:
+            target_x, target_y = WAYPOINTS[current_wp_index]
+
+            # 計算
+            dx = target_x - x
+            dy = target_y - y
+            distance = math.sqrt(dx*dx + dy*dy)
+            target_rad = math.atan2(dy, dx)
+            target_deg = math.degrees(target_rad)
+            angle_diff = get_angle_diff(target_deg, angle)
+
+            # 終了判定（x, y は推定器の予測で少し先の位置なので、実際に届いた座標で判定する）
+            if math.hypot(target_x - state.x, target_y - state.y) < REACH_THRESHOLD:
+                print(f"ポイント[{current_wp_index}]到達")
+                current_wp_index += 1
+                if current_wp_index >= len(WAYPOINTS):
+                    return None
+                # PIDリセットして次のポイントで計算し直す
+                pid.reset()
+                continue
+            break
+        if rate is not None:
+            rate.update([distance], [angle_diff], now=now)
+
+        # PID制御（出力制限と左右配分込み）
+        # 推定器があれば、D項は差分ではなく推定した速度から計算する
+        rates = [estimator.error_rates(target_x, target_y)] if estimator is not None else None
+        outputs = pid.update([[distance, angle_diff]], now - last_time, rates=rates)
+        last_time = now
+        left, right = (int(v) for v in mix_wheels(outputs)[0])
+
+        # ★データを記録（チャンクがいっぱいになると裏でディスクに書き出される）
+        telemetry.append(now, 0, distance, angle, target_deg, left, right)
+        return left, right
+
+    dashboard = LiveDashboard() if LIVE_DASHBOARD else None
+    try:
+        async with TelemetryRecorder(log_dir) as telemetry:
+            if dashboard is not None:
+                dashboard.start()
+                telemetry.add_listener(dashboard.push)
+
+            # キューブ内蔵の制御で巡回する（失敗したら、着いた所の次からホストで引き継ぐ）
+            if TOUR_MODE == TARGET:
+                result = await run_target_tour(cube, WAYPOINTS, clock,
+                                               max_speed=TARGET_MAX_SPEED, timeout_s=TARGET_TIMEOUT,
+                                               reach=REACH_THRESHOLD, on_pose=record_target, state=state)
+                print(result.report(len(WAYPOINTS)))
+                if result.reached >= len(WAYPOINTS):
+                    return
+                print(f"ポイント[{result.reached}]からホストの制御に切り替えます")
+                current_wp_index = result.reached
+
+            # 今いる所から残りの経由点を通る軌道を最初に1回だけ作る（走行中は表を引くだけ）
+            if HOST_FOLLOWER == PURSUIT:
+                pose = state.snapshot()
+                remaining = WAYPOINTS[current_wp_index:]
+                follower = PurePursuit(Trajectory.fit([(pose.x, pose.y)] + remaining),
+                                       reach=REACH_THRESHOLD)
+            last_time = clock.now()
+            stats = await run_control_loop(cube, follow if follower is not None else step, CONTROL_MODE, clock,
+                                           period=CONTROL_PERIOD, min_period=MIN_CONTROL_PERIOD,
+                                           estimator=estimator, rate=rate, state=state)
+        print(stats.report())
+    finally:
+        await cube.api.motor.motor_control(0, 0)
+        await cube.api.id_information.unregister_notification_handler(state)
+        if dashboard is not None:
+            dashboard.close()
 
 # --- メイン処理 ---
 async def main():
     print("toioに接続します...")
-    async with ToioCoreCube() as cube:
+    async with ConnectionManager() as cubes:
+        cube = cubes[0]
         print("接続完了！")
-        await cube.api.id_information.register_notification_handler(notification_handler)
-        
-        pid_dist = PIDController(DIST_KP, DIST_KI, DIST_KD)
-        pid_angle = PIDController(ANGLE_KP, ANGLE_KI, ANGLE_KD)
-        current_wp_index = 0
-        
-        while not is_position_received:
-            await asyncio.sleep(0.1)
-        
-        start_time = time.time()
-
+        print(cubes.report())
+        log_dir = make_run_dir(LOG_DIR)
+        recorder = CaptureRecorder(log_dir / "capture.bin") if CAPTURE else None
+        if recorder is not None:
+            await recorder.attach(cube)
         try:
-            while True:
-                target_x, target_y = WAYPOINTS[current_wp_index]
-                
-                # 計算
-                dx = target_x - current_x
-                dy = target_y - current_y
-                distance = math.sqrt(dx*dx + dy*dy)
-                target_rad = math.atan2(dy, dx)
-                target_deg = math.degrees(target_rad)
-                angle_diff = get_angle_diff(target_deg, current_angle)
-
-                # 終了判定
-                if distance < REACH_THRESHOLD:
-                    print(f"ポイント[{current_wp_index}]到達")
-                    current_wp_index += 1
-                    if current_wp_index >= len(WAYPOINTS):
-                        break
-                    # PIDリセット
-                    pid_dist = PIDController(DIST_KP, DIST_KI, DIST_KD)
-                    pid_angle = PIDController(ANGLE_KP, ANGLE_KI, ANGLE_KD)
-                    continue
-
-                # PID制御
-                speed_output = pid_dist.update(distance)
-                turn_output = pid_angle.update(angle_diff)
-
-                base_speed = max(min(speed_output, 70), -70)
-                turn_speed = max(min(turn_output, 50), -50)
-                left = max(min(int(base_speed + turn_speed), 100), -100)
-                right = max(min(int(base_speed - turn_speed), 100), -100)
-
-                await cube.api.motor.motor_control(left, right)
-
-                # ★データを記録
-                log_data.append({
-                    'time': time.time(),
-                    'distance': distance,
-                    'current_angle': current_angle,
-                    'target_angle': target_deg,
-                    'left_speed': left,
-                    'right_speed': right
-                })
-
-                await asyncio.sleep(0.05)
-
+            await run(cube, log_dir=log_dir)
         except KeyboardInterrupt:
             pass
         finally:
-            await cube.api.motor.motor_control(0, 0)
-            await cube.api.id_information.unregister_notification_handler(notification_handler)
+            if recorder is not None:
+                await recorder.detach()
             print("終了しました。グラフを描画します...")
-            plot_data() # ★グラフ描画実行
+            plot_data(log_dir) # ★グラフ描画実行
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
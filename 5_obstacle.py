@@ -1,7 +1,20 @@
 import asyncio
 import math
-import time
+from pathlib import Path
+from time import perf_counter_ns
 from toio import *
+from toio_control import DIST, PIDBank, get_angle_diff, mix_wheels
+from toio_control.adaptive import AdaptiveRate
+from toio_control.clock import REAL_CLOCK
+from toio_control.connection import ConnectionManager
+from toio_control.costmap import CostMap
+from toio_control.estimator import PoseEstimator
+from toio_control.gains import apply_gains
+from toio_control.loop import run_control_loop
+from toio_control.metrics import PLAN, Metrics
+from toio_control.obstacles import ObstacleSet
+from toio_control.planner import PathPlanner
+from toio_control.state import CubeState
 
 # --- 1. 設定パラメータ ---
 # ★ START_POS の設定は削除しました（自動取得します） ★
@@ -9,9 +22,30 @@ from toio import *
 GOAL_POS = (350, 350)  # ゴール地点
 REACH_THRESHOLD = 20   # 到達判定の半径
 
-# 仮想障害物の設定
-OBSTACLE_POS = (250, 250) # 障害物の中心
-OBSTACLE_RADIUS = 30      # 障害物の半径(mm)
+# 仮想障害物の設定（中心と半径のリストをJSONファイルから読み込む）
+OBSTACLES_FILE = "obstacles.json"
+OBSTACLES_CHECK_PERIOD = 1.0  # 障害物ファイルの更新を確かめる間隔 [s]
+# 障害物からの距離の表（距離場）の保存先。同じ配置なら次からは読み込むだけで済む（None で保存しない）
+COSTMAP_DIR = "costmaps"
+
+# 経路計画の設定
+PATH_CLEARANCE = 30      # 障害物の半径に足す余白（この距離より近くは通らない）
+WAYPOINT_THRESHOLD = 30  # 途中の経由点はこの距離まで近づいたら次へ進む
+
+# 制御ループの方式
+# "poll": 50msごとに最新の座標で制御 / "notify": 座標の通知が届くたびに制御
+CONTROL_MODE = "poll"
+CONTROL_PERIOD = 0.05      # poll のときの制御周期 [s]
+MIN_CONTROL_PERIOD = 0.02  # notify のときの最短制御周期 [s]
+# True にすると、通知の遅れを補正した予測位置で制御し、座標が読めない間は推測航法で進む
+POSE_ESTIMATOR = True
+# True にすると、遠くをまっすぐ走る間は周期を延ばし（100ms）、ゴールの近くや大きく曲がるときは縮める（40ms）。
+# そのほかは CONTROL_PERIOD と同じ 50ms
+ADAPTIVE_RATE = True
+
+# 段階ごとの処理時間（通知・解析・推定・経路計画・制御・書き込み）の記録
+METRICS_FILE = None  # 例: "metrics.json"（終了時に JSON で書き出す）
+METRICS_PORT = None  # 例: 9100（走行中 http://127.0.0.1:9100/metrics で Prometheus の形式で返す）
 
 # 距離制御用のPIDゲイン
 DIST_KP = 0.8
@@ -23,210 +57,167 @@ ANGLE_KP = 0.5
 ANGLE_KI = 0.0
 ANGLE_KD = 0.01
 
+# PIDの出力制限 (前進, 旋回)（tune.py もこの値でゲインを探す）
+OUT_LIMIT = (70, 50)
+
+# tune.py で求めたゲイン（pid_gains.json）を使うなら True（simulate.py --tuned-gains でも切り替えられる）
+USE_TUNED_GAINS = False
+if USE_TUNED_GAINS:
+    apply_gains(globals())
+
 # --- 2. グローバル変数 ---
-current_x = 0
-current_y = 0
-current_angle = 0
-is_position_received = False 
-
-# 回避制御の状態管理
-avoid_state = {
-    "is_active": False,
-    "target_x": 0,
-    "target_y": 0
-}
+# 障害物の距離場と、その更新を確かめた時刻（run() の始めに読み込む。import しただけではファイルを読まない）
+obstacles_path = Path(__file__).with_name(OBSTACLES_FILE)
+costmap_dir = Path(__file__).with_name(COSTMAP_DIR) if COSTMAP_DIR else None
+obstacles = None
+obstacles_mtime = None
 
-# --- 3. クラス・関数定義 ---
+# 経路計画（一度作った経路は覚えておき、障害物が変わったら変わった所だけ直す）
+planner = PathPlanner(clearance=PATH_CLEARANCE)
 
-class PIDController:
-    def __init__(self, kp, ki, kd):
-        self.kp = kp; self.ki = ki; self.kd = kd
-        self.prev_error = 0.0; self.integral = 0.0; self.last_time = None
-
-    def update(self, error):
-        current_time = time.time()
-        if self.last_time is None:
-            self.last_time = current_time; return error * self.kp
-        dt = current_time - self.last_time
-        self.last_time = current_time
-        if dt <= 0: return 0
-        p_term = error * self.kp
-        self.integral += error * dt
-        i_term = self.integral * self.ki
-        derivative = (error - self.prev_error) / dt
-        d_term = derivative * self.kd
-        self.prev_error = error
-        return p_term + i_term + d_term
-
-def get_angle_diff(target, current):
-    diff = target - current
-    while diff <= -180: diff += 360
-    while diff > 180: diff -= 360
-    return diff
-
-def is_path_blocked(curr_x, curr_y, goal_x, goal_y, obs_x, obs_y, safe_radius):
-    ax, ay = curr_x, curr_y
-    bx, by = goal_x, goal_y
-    cx, cy = obs_x, obs_y
-    ab_x, ab_y = bx - ax, by - ay
-    ac_x, ac_y = cx - ax, cy - ay
-    ab_len2 = ab_x**2 + ab_y**2
-    if ab_len2 == 0: return False
-    t = (ac_x * ab_x + ac_y * ab_y) / ab_len2
-    if t < 0: nearest_dist = math.sqrt(ac_x**2 + ac_y**2)
-    elif t > 1: nearest_dist = math.sqrt((cx - bx)**2 + (cy - by)**2)
-    else:
-        nearest_x = ax + t * ab_x
-        nearest_y = ay + t * ab_y
-        nearest_dist = math.sqrt((cx - nearest_x)**2 + (cy - nearest_y)**2)
-    return nearest_dist < safe_radius
-
-def calculate_target(curr_x, curr_y, goal_x, goal_y):
-    global avoid_state
-    
-    # --- ★修正ポイント：攻めた設定に変更 ---
-    
-    # 1. 危険判定（Entry）: +20mm (80mm) → +15mm (75mm)
-    # 本当にギリギリまで反応しないようにします
-    DETECT_RADIUS = OBSTACLE_RADIUS + 15
-
-    # 2. 経由地（Waypoint）: +90mm (150mm) → +45mm (105mm)
-    # 障害物のスレスレ（半径+4.5cm）を狙って通過させます
-    # これが「コンパクトさ」の決め手です
-    WAYPOINT_RADIUS = OBSTACLE_RADIUS + 45
-    
-    # 3. 安全確認（Clear）: +40mm (100mm) → +30mm (90mm)
-    # 経由地(105mm)より少し内側。このラインを越えていればOKとします
-    CLEAR_RADIUS = OBSTACLE_RADIUS + 30
-
-    # （以下、ロジック部分は変更なし）
-    if not avoid_state["is_active"]:
-        # ゴールへの道が塞がれているかチェック
-        is_blocked = is_path_blocked(curr_x, curr_y, goal_x, goal_y, 
-                                     OBSTACLE_POS[0], OBSTACLE_POS[1], DETECT_RADIUS)
-        
-        dist_to_obs = math.sqrt((curr_x - OBSTACLE_POS[0])**2 + (curr_y - OBSTACLE_POS[1])**2)
-        
-        if is_blocked and dist_to_obs < (DETECT_RADIUS + 100):
-            print(">>> 障害物検知！コンパクトに回避します。")
-            avoid_state["is_active"] = True
-            
-            vx = goal_x - OBSTACLE_POS[0]
-            vy = goal_y - OBSTACLE_POS[1]
-            v_len = math.sqrt(vx**2 + vy**2)
-            if v_len == 0: v_len = 1
-            ux, uy = vx/v_len, vy/v_len
-            
-            # 左右の候補点（WAYPOINT_RADIUS を使用）
-            p1_x = OBSTACLE_POS[0] - uy * WAYPOINT_RADIUS
-            p1_y = OBSTACLE_POS[1] + ux * WAYPOINT_RADIUS
-            p2_x = OBSTACLE_POS[0] + uy * WAYPOINT_RADIUS
-            p2_y = OBSTACLE_POS[1] - ux * WAYPOINT_RADIUS
-            
-            d1 = (p1_x - curr_x)**2 + (p1_y - curr_y)**2
-            d2 = (p2_x - curr_x)**2 + (p2_y - curr_y)**2
-            
-            if d1 < d2:
-                avoid_state["target_x"], avoid_state["target_y"] = p1_x, p1_y
-                print(f"-> 左ルート: ({int(p1_x)}, {int(p1_y)})へ")
-            else:
-                avoid_state["target_x"], avoid_state["target_y"] = p2_x, p2_y
-                print(f"-> 右ルート: ({int(p2_x)}, {int(p2_y)})へ")
-            return avoid_state["target_x"], avoid_state["target_y"], True
-        else:
-            return goal_x, goal_y, False
-
-    else:
-        tx = avoid_state["target_x"]
-        ty = avoid_state["target_y"]
-        d_to_wp = math.sqrt((tx - curr_x)**2 + (ty - curr_y)**2)
-        
-        # 安全確認（CLEAR_RADIUS を使用）
-        path_clear = not is_path_blocked(curr_x, curr_y, goal_x, goal_y, 
-                                         OBSTACLE_POS[0], OBSTACLE_POS[1], CLEAR_RADIUS)
-        
-        if d_to_wp < 30 or path_clear:
-            print("<<< 回避完了！")
-            avoid_state["is_active"] = False
-            return goal_x, goal_y, False
-        return tx, ty, True
-
-# --- 4. toioハンドラ ---
-def position_handler(id_info):
-    global current_x, current_y, current_angle, is_position_received
-    if id_info and isinstance(id_info, PositionId):
-        current_x = id_info.center.point.x
-        current_y = id_info.center.point.y
-        current_angle = id_info.center.angle
-        is_position_received = True
-
-def notification_handler(payload):
-    id_info = IdInformation.is_my_data(payload)
-    position_handler(id_info)
+# 処理時間の記録係（METRICS_FILE / METRICS_PORT を指定したときだけ作る）
+metrics = None
+
+# --- 3. クラス・関数定義 ---
 
+def reload_obstacles():
+    """ obstacles.json を初めて読むか書き換えられていたら読み直し、距離場を作り直す（変わったら True） """
+    global obstacles, obstacles_mtime
+    mtime = obstacles_path.stat().st_mtime
+    if obstacles is not None and mtime == obstacles_mtime:
+        return False
+    obstacles_mtime = mtime
+    obstacles = CostMap.load_or_build(ObstacleSet.load(obstacles_path), costmap_dir)
+    return True
+
+def plan_path(curr_x, curr_y):
+    """ 現在地からゴールまでの経由点のリスト（最後がゴール）。行けなければ None """
+    started = perf_counter_ns()
+    path = planner.plan((curr_x, curr_y), GOAL_POS, obstacles)
+    if metrics is not None:
+        metrics.record(PLAN, started)
+    if path is not None:
+        route = " -> ".join(f"({int(x)}, {int(y)})" for x, y in path[1:])
+        print(f"経路: {route}")
+    return path
+
+# --- 4. 制御ループ（実機でもシミュレーターでも同じものを動かす） ---
+async def run(cube, clock=REAL_CLOCK):
+    global metrics
+    # 障害物を読み込み、距離場を用意する（ない配置なら作ってキャッシュに保存する）
+    reload_obstacles()
+    # キューブの状態（座標の通知が来るたびに上書きされる）
+    state = CubeState(clock)
+    await cube.api.id_information.register_notification_handler(state)
+    metrics = Metrics() if METRICS_FILE or METRICS_PORT else None
+    server = await metrics.serve(METRICS_PORT) if METRICS_PORT else None
+
+    # 距離と角度のPIDをまとめて1台分作成（前進の上限は回避中に切り替える）
+    pid = PIDBank(1,
+                  kp=(DIST_KP, ANGLE_KP),
+                  ki=(DIST_KI, ANGLE_KI),
+                  kd=(DIST_KD, ANGLE_KD),
+                  out_limit=OUT_LIMIT)
+
+    # ★ここを変更しました★
+    print("toioの現在地を取得しています... 好きな場所に置いてください")
+    pose = await state.first_pose()
+
+    # 現在地を表示してスタート
+    print(f"現在地 ({pose.x}, {pose.y}) からスタートします！")
+    path = plan_path(pose.x, pose.y)
+    if path is None:
+        print("ゴールまでの経路が見つかりません")
+        await cube.api.id_information.unregister_notification_handler(state)
+        if server is not None:
+            server.close()
+        return
+    wp_index = 1
+
+    # 準備のためのウェイト
+    await clock.sleep(1)
+    print("Go!")
+
+    estimator = PoseEstimator() if POSE_ESTIMATOR else None
+    rate = AdaptiveRate() if ADAPTIVE_RATE else None
+    last_time = clock.now()
+    last_check = last_time
+
+    # 1回分の制御計算（座標を受け取って左右のモーター速度を返す。ゴールなら None）
+    def step(x, y, angle, now):
+        nonlocal last_time, last_check, path, wp_index
+        # 障害物が変わっていたら、今いる所から経路を直す
+        if now - last_check >= OBSTACLES_CHECK_PERIOD:
+            last_check = now
+            if reload_obstacles():
+                print(">>> 障害物が変わりました。経路を直します。")
+                path = plan_path(x, y)
+                if path is None:
+                    print("ゴールまでの経路が見つかりません")
+                    return None
+                wp_index = 1
+
+        # 途中の経由点に近づいたら次の経由点へ（最後はゴール）
+        while wp_index < len(path) - 1 and \
+                math.hypot(path[wp_index][0] - x, path[wp_index][1] - y) < WAYPOINT_THRESHOLD:
+            wp_index += 1
+        target_x, target_y = path[wp_index]
+        is_avoiding = wp_index < len(path) - 1
+
+        dx = target_x - x
+        dy = target_y - y
+        distance = math.sqrt(dx*dx + dy*dy)
+
+        target_rad = math.atan2(dy, dx)
+        target_deg = math.degrees(target_rad)
+        angle_diff = get_angle_diff(target_deg, angle)
+
+        real_dist = math.sqrt((GOAL_POS[0]-x)**2 + (GOAL_POS[1]-y)**2)
+        # ゴール判定は実際に届いた座標で行う（x, y は推定器の予測で少し先の位置なので、手前で止まってしまう）
+        if math.hypot(GOAL_POS[0] - state.x, GOAL_POS[1] - state.y) < REACH_THRESHOLD:
+            print("🏆 ゴールに到達しました！")
+            return None
+        # 障害物を避けて経由点に向かっている間は周期を縮める（距離はゴールまで）
+        if rate is not None:
+            rate.update([real_dist], [angle_diff], [is_avoiding], now)
+
+        # 経由点に向かっている間は前進速度の上限を下げる
+        forward_limit = 50 if is_avoiding else OUT_LIMIT[0]
+        if pid.out_limit[0, DIST] != forward_limit:
+            pid.out_limit = (forward_limit, OUT_LIMIT[1])
+        # 推定器があれば、D項は差分ではなく推定した速度から計算する
+        rates = [estimator.error_rates(target_x, target_y)] if estimator is not None else None
+        outputs = pid.update([[distance, angle_diff]], now - last_time, rates=rates)
+        last_time = now
+        left, right = (int(v) for v in mix_wheels(outputs)[0])
+        return left, right
+
+    try:
+        stats = await run_control_loop(cube, step, CONTROL_MODE, clock,
+                                       period=CONTROL_PERIOD, min_period=MIN_CONTROL_PERIOD,
+                                       estimator=estimator, metrics=metrics, rate=rate, state=state)
+        print(stats.report())
+        print(f"経路計画 {planner.plans}回 (うち修正 {planner.repairs}回), キャッシュ利用 {planner.cache_hits}回")
+    except KeyboardInterrupt:
+        print("停止します")
+    finally:
+        await cube.api.motor.motor_control(0, 0)
+        await cube.api.id_information.unregister_notification_handler(state)
+        if metrics is not None:
+            print(metrics.report())
+            if METRICS_FILE:
+                metrics.dump(Path(__file__).parent / METRICS_FILE)
+        if server is not None:
+            server.close()
 
 # --- 5. メイン処理 ---
 async def main():
     print("toioに接続します...")
-    async with ToioCoreCube() as cube:
+    async with ConnectionManager() as cubes:
+        cube = cubes[0]
         print("接続完了！")
-        await cube.api.id_information.register_notification_handler(notification_handler)
-        
-        pid_dist = PIDController(DIST_KP, DIST_KI, DIST_KD)
-        pid_angle = PIDController(ANGLE_KP, ANGLE_KI, ANGLE_KD)
-        
-        # ★ここを変更しました★
-        print("toioの現在地を取得しています... 好きな場所に置いてください")
-        while not is_position_received:
-            await asyncio.sleep(0.1)
-        
-        # 現在地を表示してスタート
-        print(f"現在地 ({current_x}, {current_y}) からスタートします！")
-        
-        # 準備のためのウェイト
-        await asyncio.sleep(1)
-        print("Go!")
-
-        try:
-            while True:
-                target_x, target_y, is_avoiding = calculate_target(
-                    current_x, current_y, GOAL_POS[0], GOAL_POS[1]
-                )
-
-                dx = target_x - current_x
-                dy = target_y - current_y
-                distance = math.sqrt(dx*dx + dy*dy)
-                
-                target_rad = math.atan2(dy, dx)
-                target_deg = math.degrees(target_rad)
-                angle_diff = get_angle_diff(target_deg, current_angle)
-
-                real_dist = math.sqrt((GOAL_POS[0]-current_x)**2 + (GOAL_POS[1]-current_y)**2)
-                if real_dist < REACH_THRESHOLD:
-                    print("🏆 ゴールに到達しました！")
-                    await cube.api.motor.motor_control(0, 0)
-                    break
-
-                speed_out = pid_dist.update(distance)
-                turn_out = pid_angle.update(angle_diff)
-
-                max_spd = 50 if is_avoiding else 70
-                base_speed = max(min(speed_out, max_spd), -max_spd)
-                turn_speed = max(min(turn_out, 50), -50)
-
-                left = int(base_speed + turn_speed)
-                right = int(base_speed - turn_speed)
-                left = max(min(left, 100), -100)
-                right = max(min(right, 100), -100)
-                
-                await cube.api.motor.motor_control(left, right)
-                await asyncio.sleep(0.05)
-
-        except KeyboardInterrupt:
-            print("停止します")
-        finally:
-            await cube.api.motor.motor_control(0, 0)
-            await cube.api.id_information.unregister_notification_handler(notification_handler)
+        print(cubes.report())
+        await run(cube)
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
@@ -1,5 +1,6 @@
 import asyncio
 from toio import *
+from toio_control.connection import ConnectionManager
 
 # --- 個々のtoioの動きを定義する関数 ---
 async def spin_task(cube, name, color):
@@ -30,10 +31,12 @@ async def main():
     print("2台のtoioを探して接続します...(電源を入れて待機してください)")
 
     # ★ここがポイント！
-    # cubes=2 を指定することで、2台見つかるまでスキャン・接続を自動で行います。
+    # 2 を指定することで、2台そろうまで接続を自動で行います（2台同時に接続します）。
+    # 前回接続したtoioはアドレスを覚えているので、スキャンせずに直接つなぎます。
     # 接続されたキューブはリスト形式 (cubes[0], cubes[1]) で受け取れます。
-    async with MultipleToioCoreCubes(cubes=2) as cubes:
+    async with ConnectionManager(2) as cubes:
         print("2台接続完了！")
+        print(cubes.report())
         
         # asyncio.gather を使って、2つのタスクを「同時に」実行します
         # これを使わないと、1台目が終わってから2台目が動くことになってしまいます
@@ -0,0 +1,142 @@
+import asyncio
+import math
+import numpy as np
+from toio import *
+from toio_control import ANGLE, DIST, PIDBank, heading_errors, mix_wheels
+from toio_control.adaptive import AdaptiveRate
+from toio_control.avoidance import CollisionAvoidance
+from toio_control.clock import REAL_CLOCK
+from toio_control.connection import ConnectionManager
+from toio_control.fleet import Fleet
+
+# --- 設定パラメータ ---
+FLEET_SIZE = 2          # 接続するキューブの台数
+FORMATION_CENTER = (250, 250)
+FORMATION_RADIUS = 120  # この半径の円周上に等間隔で並ぶ
+# 隣の目標との間隔の最小値 [単位]。台数が多くて詰まるときは半径を広げる（MAX_FORMATION_RADIUS まで）。
+# 着いたキューブは目標から REACH_THRESHOLD ほどずれて止まるので、間隔が狭いと隣がぶつからずには着けない
+MIN_SLOT_SPACING = 60
+MAX_FORMATION_RADIUS = 160  # マットの端で詰まらない半径（この半径で間隔を保てるのは 16 台まで）
+REACH_THRESHOLD = 20
+
+CONTROL_PERIOD = 0.05      # 制御周期 [s]（全台まとめて1回計算する）
+MIN_WRITE_INTERVAL = 0.05  # 1台あたりの書き込みの最短間隔 [s]（BLEの混雑対策）
+# True にすると、キューブ同士がぶつからないように全台まとめて避ける（ORCA）
+AVOID_COLLISIONS = True
+# True にすると、台ごとに周期を切り替える（遠くをまっすぐ走る台・着いた台は書き込みを減らし、
+# 着く直前・大きく曲がる・避けている台は細かく直す）。隊列ではまだ効果がはっきりしないので既定は False
+ADAPTIVE_RATE = False
+
+# 距離制御用のPIDゲイン
+DIST_KP = 0.8
+DIST_KI = 0.0
+DIST_KD = 0.05
+
+# 角度制御用のPIDゲイン
+ANGLE_KP = 0.5
+ANGLE_KI = 0.0
+ANGLE_KD = 0.01
+
+
+def formation_radius(n):
+    """ n台が並ぶ円の半径（隣との間隔が MIN_SLOT_SPACING より狭ければ、MAX_FORMATION_RADIUS まで広げる） """
+    return min(max(FORMATION_RADIUS, n * MIN_SLOT_SPACING / (2 * math.pi)), MAX_FORMATION_RADIUS)
+
+
+def formation_targets(n):
+    """ n台分の目標座標 (n, 2)。円周上に等間隔に並べる """
+    theta = np.arange(n) * (2 * math.pi / n)
+    radius = formation_radius(n)
+    cx, cy = FORMATION_CENTER
+    return np.column_stack((cx + radius * np.cos(theta),
+                            cy + radius * np.sin(theta)))
+
+
+
+def assign_slots(poses, slots):
+    """
+    円周上の目標 slots (n, 2) を、各キューブに隊列の中心から見た角度の順に割り当てる
+    （走る道が交差しにくい。回す量は移動距離の合計が一番短くなるものを選ぶ）
+    """
+    cx, cy = FORMATION_CENTER
+    n = len(slots)
+    order = np.argsort(np.arctan2(poses[:, 1] - cy, poses[:, 0] - cx))
+    best = None
+    for shift in range(n):
+        assigned = np.empty_like(slots)
+        assigned[order] = np.roll(slots, -shift, axis=0)
+        cost = np.hypot(*(assigned - poses[:, :2]).T).sum()
+        if best is None or cost < best[0]:
+            best = (cost, assigned)
+    return best[1]
+
+
+# --- 制御ループ（実機でもシミュレーターでも同じものを動かす） ---
+async def run(cubes, clock=REAL_CLOCK):
+    n = len(cubes)
+    targets = formation_targets(n)
+    spacing = 2 * math.pi * formation_radius(n) / n
+    if AVOID_COLLISIONS and spacing < MIN_SLOT_SPACING:
+        print(f"⚠️ {n}台では目標の間隔が {spacing:.0f} しかありません（{MIN_SLOT_SPACING} 未満）。"
+              f"ぶつからないように止まったまま、着けない台が出ることがあります")
+    # 全台分の距離・角度PIDを1つの配列にまとめる
+    pid = PIDBank(n,
+                  kp=(DIST_KP, ANGLE_KP),
+                  ki=(DIST_KI, ANGLE_KI),
+                  kd=(DIST_KD, ANGLE_KD),
+                  out_limit=(70, 50))
+    reached = np.zeros(n, dtype=bool)
+    avoidance = CollisionAvoidance(n) if AVOID_COLLISIONS else None
+    rate = AdaptiveRate(n) if ADAPTIVE_RATE else None
+    last_time = None
+
+    # 全台分の制御を1回で計算する（全員そろったら None）
+    def step(poses, now):
+        nonlocal last_time, targets
+        if last_time is None:
+            targets = assign_slots(poses, targets)
+        errors = heading_errors(targets, poses)
+        newly = ~reached & (errors[:, DIST] < REACH_THRESHOLD)
+        for i in np.flatnonzero(newly):
+            print(f"[{i}] 到着")
+        reached[:] |= newly
+        if reached.all():
+            return None
+        distance, angle_diff = errors[:, DIST], errors[:, ANGLE]
+        avoiding = False
+        if avoidance is not None:
+            # ぶつかりそうなキューブは、避けるための速度に向きを合わせる（着いたキューブは動かない障害物）
+            errors = avoidance.heading_errors(poses, targets, now, fixed=reached)
+            avoiding = avoidance.avoiding
+        if rate is not None:
+            rate.update(distance, angle_diff, avoiding, now, idle=reached)
+
+        outputs = pid.update(errors, 0.0 if last_time is None else now - last_time)
+        last_time = now
+        commands = mix_wheels(outputs)
+        commands[reached] = 0  # 着いたキューブは止めておく
+        if avoidance is not None:
+            # 最後の確認：前後に動くと相手にぶつかる台は、その場での旋回だけにする
+            avoidance.guard_commands(poses, commands)
+        return commands
+
+    async with Fleet(cubes, clock, min_write_interval=MIN_WRITE_INTERVAL) as fleet:
+        print("全台の座標を待っています...")
+        await fleet.run(step, period=CONTROL_PERIOD, rate=rate)
+        print("全台そろいました！")
+        print(fleet.report())
+        if avoidance is not None:
+            print(avoidance.report())
+    return fleet
+
+# --- メイン処理 ---
+async def main():
+    print(f"{FLEET_SIZE}台のtoioを探して接続します...(電源を入れて待機してください)")
+    async with ConnectionManager(FLEET_SIZE) as cubes:
+        print(f"{FLEET_SIZE}台接続完了！")
+        print(cubes.report())
+        await run(cubes)
+    print("切断しました")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,442 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import platform
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+from simulate import START_POSES, simulate
+from toio_control import PIDBank, get_angle_diff, heading_errors
+from toio_control.adaptive import AdaptiveRate
+from toio_control.avoidance import CollisionAvoidance
+from toio_control.cli import COMMANDS, IMPORT_BUDGET_MS
+from toio_control.costmap import CostMap
+from toio_control.decode import POSITION_ID, PoseRecord, decode_id
+from toio_control.estimator import PoseEstimator
+from toio_control.obstacles import ObstacleSet
+from toio_control.planner import PathPlanner
+from toio_control.state import CubeState
+from toio_control.target import HOST, TARGET
+from toio_control.trajectory import PURSUIT, WAYPOINT, PurePursuit, Trajectory
+
+# --- 設定 ---
+# 基準値の保存先（--save で書き換える）
+# シミュレーターの仮想時間と書き込み回数はどのマシンでも同じなので、リポジトリに入れて CI でも比べる
+SIMULATION_BASELINE_FILE = Path(__file__).with_name("benchmark_simulation.json")
+# 実時間の計測値はマシンごとに違うので、リポジトリには入れず自分のマシンに置く
+BASELINE_FILE = Path(__file__).with_name("benchmark_baseline.json")
+# SIMULATION_BASELINE_FILE に入れる計測値（マシンによらず毎回同じになるもの）
+SIMULATION_METRICS = ("virtual_s", "writes")
+# 実時間の計測が基準値よりこの割合以上遅くなったら失敗（計測のばらつきを見込んで緩め）
+DEFAULT_THRESHOLD = 0.30
+# 仮想時間での走行時間・書き込み回数は毎回同じになるので厳しめ
+SIMULATION_THRESHOLD = 0.05
+# 最短時間を取るための繰り返し回数
+REPEAT = 5
+# シミュレーターでの走行の繰り返し回数（1回が数ミリ秒と短くばらつくので、多めに走らせて中央値を取る）
+MACRO_REPEAT = 9
+
+# 計測値の種類（名前の末尾）ごとの許容幅
+TOLERANCES = {
+    "_us": None,         # 1回あたりの実時間 [µs]（None は --threshold を使う）
+    "wall_ms": math.inf, # 1回の走行にかかった実時間 [ms]（短すぎてばらつくので表示だけ。失敗にはしない）
+    "_ms": None,         # 起動にかかった実時間 [ms]
+    "virtual_s": SIMULATION_THRESHOLD,
+    "writes": SIMULATION_THRESHOLD,
+}
+
+BENCHMARKS = {}
+
+
+def benchmark(name, macro=False):
+    """ ベンチマーク関数を登録する（関数は {計測値の名前: 値} を返す） """
+    def register(func):
+        BENCHMARKS[name] = (func, macro)
+        return func
+    return register
+
+
+def per_call_us(func, calls_per_run, number):
+    """ func を number 回実行して最短の1回を取り、呼び出し1回あたりの時間 [µs] にする """
+    best = min(timeit.Timer(func).repeat(REPEAT, number)) / number
+    return best / calls_per_run * 1e6
+
+
+# --- マイクロベンチマーク（1周期に呼ばれる回数を想定した量で計る） ---
+# 乱数はベンチマークごとに決まった種から作る（--only や実行順で入力が変わらないように）
+@benchmark("geometry.get_angle_diff")
+def bench_angle_diff():
+    rng = np.random.default_rng(0)
+    angles = [(float(t), float(c)) for t, c in rng.uniform(-720, 720, (1000, 2))]
+
+    def run():
+        for target, current in angles:
+            get_angle_diff(target, current)
+    return {"time_us": per_call_us(run, len(angles), 20)}
+
+
+@benchmark("geometry.heading_errors[64]")
+def bench_heading_errors():
+    rng = np.random.default_rng(3)
+    targets = rng.uniform(0, 500, (64, 2))
+    poses = np.column_stack([rng.uniform(0, 500, (64, 2)), rng.uniform(0, 360, 64)])
+    return {"time_us": per_call_us(lambda: heading_errors(targets, poses), 1, 2000)}
+
+
+def _random_obstacles(rng, n):
+    centers = rng.uniform(50, 450, (n, 2))
+    radii = rng.uniform(10, 30, n)
+    return ObstacleSet(centers, radii)
+
+
+@benchmark("obstacles.is_path_blocked[200]")
+def bench_path_blocked():
+    rng = np.random.default_rng(4)
+    obstacles = _random_obstacles(rng, 200)
+    segments = rng.uniform(50, 450, (200, 4)).tolist()
+
+    def run():
+        for ax, ay, bx, by in segments:
+            obstacles.is_path_blocked(ax, ay, bx, by, 30)
+    return {"time_us": per_call_us(run, len(segments), 10)}
+
+
+@benchmark("costmap.is_path_blocked[200]")
+def bench_costmap_path_blocked():
+    # obstacles.is_path_blocked[200] と同じ量の判定を距離場のレイマーチで行う
+    rng = np.random.default_rng(1)
+    costmap = CostMap.build(ObstacleSet(rng.uniform(50, 450, (200, 2)), rng.uniform(10, 30, 200)))
+    segments = rng.uniform(50, 450, (200, 4)).tolist()
+
+    def run():
+        for ax, ay, bx, by in segments:
+            costmap.is_path_blocked(ax, ay, bx, by, 30)
+    return {"time_us": per_call_us(run, len(segments), 10)}
+
+
+@benchmark("costmap.clearance")
+def bench_costmap_clearance():
+    costmap = CostMap.build(ObstacleSet.load(Path(__file__).with_name("obstacles.json")))
+    return {"time_us": per_call_us(lambda: costmap.clearance(180.5, 210.25), 1, 20000)}
+
+
+@benchmark("costmap.load_or_build (作成 / 読み込み)")
+def bench_costmap_load():
+    rng = np.random.default_rng(2)
+    obstacles = ObstacleSet(rng.uniform(50, 450, (30, 2)), rng.uniform(10, 30, 30))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        build_us = per_call_us(lambda: CostMap.build(obstacles), 1, 5)
+        CostMap.load_or_build(obstacles, cache_dir)
+        load_us = per_call_us(lambda: CostMap.load_or_build(obstacles, cache_dir), 1, 20)
+    return {"build_us": build_us, "load_us": load_us}
+
+
+@benchmark("planner.plan (キャッシュあり)")
+def bench_plan_cached():
+    obstacles = ObstacleSet.load(Path(__file__).with_name("obstacles.json"))
+    planner = PathPlanner()
+    planner.plan((150, 150), (350, 350), obstacles)
+    return {"time_us": per_call_us(lambda: planner.plan((152, 151), (350, 350), obstacles), 1, 2000)}
+
+
+@benchmark("planner.plan (初回)")
+def bench_plan_cold():
+    obstacles = _random_obstacles(np.random.default_rng(5), 30)
+
+    def run():
+        PathPlanner().plan((60, 60), (440, 440), obstacles)
+    return {"time_us": per_call_us(run, 1, 3)}
+
+
+@benchmark("pid.PIDBank.update[1]")
+def bench_pid_1():
+    pid = PIDBank(1, kp=(1.2, 0.6), ki=(0.05, 0.0), kd=(0.04, 0.01), out_limit=(80, 50))
+    errors = [[100.0, 30.0]]
+    return {"time_us": per_call_us(lambda: pid.update(errors, 0.05), 1, 5000)}
+
+
+@benchmark("pid.PIDBank.update[64]")
+def bench_pid_64():
+    pid = PIDBank(64, kp=(1.2, 0.6), ki=(0.05, 0.0), kd=(0.04, 0.01), out_limit=(80, 50))
+    errors = np.random.default_rng(6).uniform(-100, 100, (64, 2))
+    return {"time_us": per_call_us(lambda: pid.update(errors, 0.05), 1, 5000)}
+
+
+@benchmark("adaptive.AdaptiveRate.update[1]")
+def bench_adaptive_rate():
+    rate = AdaptiveRate(1)
+    state = {"t": 0.0}
+
+    def run():
+        t = state["t"] = state["t"] + 0.05
+        rate.update([120.0], [5.0], now=t)
+    return {"time_us": per_call_us(run, 1, 5000)}
+
+
+def _avoidance_scene(n):
+    # 1台あたりの広さを同じにして台数だけ増やす（近くにいる台数はほぼ一定）
+    rng = np.random.default_rng(n)
+    side = math.sqrt(n) * 60
+    poses = np.column_stack([rng.uniform(0, side, (n, 2)), rng.uniform(0, 360, n)])
+    targets = rng.uniform(0, side, (n, 2))
+    avoidance = CollisionAvoidance(n)
+    avoidance.heading_errors(poses, targets, 0.0)
+    return avoidance, poses, targets
+
+
+@benchmark("avoidance.heading_errors[16]")
+def bench_avoidance_16():
+    avoidance, poses, targets = _avoidance_scene(16)
+    return {"time_us": per_call_us(lambda: avoidance.heading_errors(poses, targets, 0.05), 1, 500)}
+
+
+@benchmark("avoidance.heading_errors[256]")
+def bench_avoidance_256():
+    avoidance, poses, targets = _avoidance_scene(256)
+    return {"time_us": per_call_us(lambda: avoidance.heading_errors(poses, targets, 0.05), 1, 100)}
+
+
+@benchmark("decode.decode_id")
+def bench_decode():
+    payload = bytearray(struct.pack("<BHHHHHH", POSITION_ID, 250, 250, 90, 250, 250, 90))
+    pose = PoseRecord()
+    return {"time_us": per_call_us(lambda: decode_id(payload, pose, 0.0), 1, 20000)}
+
+
+@benchmark("state.CubeState.receive")
+def bench_state_receive():
+    payload = bytearray(struct.pack("<BHHHHHH", POSITION_ID, 250, 250, 90, 250, 250, 90))
+    state = CubeState()
+    return {"time_us": per_call_us(lambda: state.receive(payload, 0.0), 1, 20000)}
+
+
+@benchmark("estimator.PoseEstimator (1周期)")
+def bench_estimator():
+    estimator = PoseEstimator()
+    state = {"t": 0.0}
+
+    def run():
+        t = state["t"] = state["t"] + 0.05
+        estimator.measure(250, 250, 90, t)
+        estimator.predict(t)
+        estimator.command(30, 20, t)
+    return {"time_us": per_call_us(run, 1, 2000)}
+
+
+@benchmark("trajectory.Trajectory.fit (巡回路)")
+def bench_trajectory_fit():
+    points = [(100, 100), (150, 150), (350, 150), (350, 350), (150, 350), (150, 150)]
+    return {"time_us": per_call_us(lambda: Trajectory.fit(points), 1, 50)}
+
+
+@benchmark("trajectory.PurePursuit (1周期)")
+def bench_pure_pursuit():
+    trajectory = Trajectory.fit([(100, 100), (150, 150), (350, 150), (350, 350), (150, 350), (150, 150)])
+    follower = PurePursuit(trajectory)
+    state = {"k": 0}
+
+    def run():
+        # 軌道の上を少しずつ進みながら指令を作る（端まで来たら始めに戻す）
+        k = state["k"] = (state["k"] + 1) % (len(trajectory) - 20)
+        if k == 0:
+            follower.index = 0
+        follower.command(trajectory.x[k] + 3, trajectory.y[k], trajectory.heading[k])
+    return {"time_us": per_call_us(run, 1, 5000)}
+
+
+# --- マクロベンチマーク（シミュレーター上で1回走らせる） ---
+def _simulate(script, **kwargs):
+    x, y, angle = START_POSES[script]
+    runs = []
+    for _ in range(MACRO_REPEAT):
+        with contextlib.redirect_stdout(io.StringIO()):
+            runs.append(asyncio.run(simulate(script, x, y, angle, **kwargs)))
+    # 仮想時間と書き込み回数は毎回同じ。実時間は中央値
+    return {"wall_ms": statistics.median(r["wall_s"] for r in runs) * 1000,
+            "virtual_s": round(runs[0]["virtual_s"], 4), "writes": runs[0]["motor_writes"]}
+
+
+@benchmark("4_traveling.py (ホストで巡回・pure pursuit)", macro=True)
+def bench_tour_host():
+    return _simulate("4_traveling.py", tour=HOST, follower=PURSUIT)
+
+
+@benchmark("4_traveling.py (ホストで巡回・経由点ごとにPID)", macro=True)
+def bench_tour_host_waypoint():
+    return _simulate("4_traveling.py", tour=HOST, follower=WAYPOINT)
+
+
+@benchmark("4_traveling.py (目標指定制御)", macro=True)
+def bench_tour_target():
+    return _simulate("4_traveling.py", tour=TARGET)
+
+
+@benchmark("5_obstacle.py", macro=True)
+def bench_obstacle():
+    return _simulate("5_obstacle.py")
+
+
+# --- 起動時間（新しい Python でサブコマンドのスクリプトを読み込むまで） ---
+_IMPORT_SNIPPET = ("import time; t = time.perf_counter(); "
+                   "from toio_control.cli import load_command; load_command({name!r}); "
+                   "print((time.perf_counter() - t) * 1000)")
+
+
+def _startup(name):
+    best = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", _IMPORT_SNIPPET.format(name=name)],
+                             cwd=Path(__file__).parent, capture_output=True, text=True, check=True).stdout
+        result = {"import_ms": float(out.split()[-1]), "process_ms": (time.perf_counter() - started) * 1000}
+        if best is None or result["process_ms"] < best["process_ms"]:
+            best = result
+    return best
+
+
+def _register_startup(name):
+    @benchmark(f"cli.{name} (起動)", macro=True)
+    def bench():
+        return _startup(name)
+
+
+for _name in COMMANDS:
+    _register_startup(_name)
+
+
+# --- 基準値との比較 ---
+def tolerance_of(metric, threshold):
+    for suffix, tolerance in TOLERANCES.items():
+        if metric.endswith(suffix):
+            return threshold if tolerance is None else tolerance
+    return threshold
+
+
+def compare(results, baseline, threshold):
+    """ 基準値より許容幅以上悪くなった計測値の一覧 [(ベンチマーク, 計測値, 基準値, 今回)] """
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name, {})
+        for metric, value in metrics.items():
+            if metric not in base:
+                continue
+            if value > base[metric] * (1 + tolerance_of(metric, threshold)):
+                regressions.append((name, metric, base[metric], value))
+    return regressions
+
+
+def missing_baselines(results, baseline):
+    """ シミュレーターの計測値のうち、基準値がないもの [(ベンチマーク, 計測値)] """
+    return [(name, metric) for name, metrics in results.items() for metric in metrics
+            if metric in SIMULATION_METRICS and metric not in baseline.get(name, {})]
+
+
+def split_results(results):
+    """ 計測値を (シミュレーターの値, 実時間の値) に分ける（どちらも {ベンチマーク: {計測値: 値}}） """
+    shared, local = {}, {}
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            target = shared if metric in SIMULATION_METRICS else local
+            target.setdefault(name, {})[metric] = value
+    return shared, local
+
+
+def load_results(path):
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8")).get("results", {})
+
+
+def save_results(path, results, machine=None):
+    """ path の基準値に results を上書きして保存する（今回実行しなかったベンチマークの分は残す） """
+    saved = load_results(path)
+    for name, metrics in results.items():
+        saved.setdefault(name, {}).update(metrics)
+    data = {"machine": machine, "results": saved} if machine is not None else {"results": saved}
+    path.write_text(json.dumps(data, indent=2, ensure_ascii=False, sort_keys=True) + "\n", encoding="utf-8")
+
+
+def format_metrics(metrics, base):
+    parts = []
+    for metric, value in metrics.items():
+        text = f"{metric}={value:.3g}" if isinstance(value, float) else f"{metric}={value}"
+        if metric in base and base[metric]:
+            text += f" ({(value / base[metric] - 1) * 100:+.0f}%)"
+        parts.append(text)
+    return ", ".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="制御・幾何・シミュレーター走行のベンチマーク")
+    parser.add_argument("--only", help="名前にこの文字列を含むベンチマークだけ実行する")
+    parser.add_argument("--micro", action="store_true", help="マイクロベンチマークだけ実行する")
+    parser.add_argument("--macro", action="store_true", help="マクロベンチマークだけ実行する")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"実時間の許容幅（既定 {DEFAULT_THRESHOLD:.0%}%）")
+    parser.add_argument("--save", action="store_true",
+                        help=f"今回の結果を基準値として保存する（仮想時間と書き込み回数は {SIMULATION_BASELINE_FILE.name}）")
+    parser.add_argument("--check", action="store_true",
+                        help="CI 用。シミュレーターの基準値がない計測値があれば失敗にする")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE, help="実時間の基準値のファイル")
+    args = parser.parse_args()
+
+    # 実時間の基準値は自分のマシンのもの、シミュレーターの値はリポジトリのものを使う
+    baseline = load_results(args.baseline)
+    for name, metrics in load_results(SIMULATION_BASELINE_FILE).items():
+        baseline.setdefault(name, {}).update(metrics)
+
+    results = {}
+    for name, (func, macro) in BENCHMARKS.items():
+        if args.only and args.only not in name:
+            continue
+        if (args.micro and macro) or (args.macro and not macro):
+            continue
+        results[name] = func()
+        print(f"{name}: {format_metrics(results[name], baseline.get(name, {}))}")
+
+    if args.save:
+        shared, local = split_results(results)
+        machine = (f"{platform.machine()} / {platform.python_implementation()} "
+                   f"{platform.python_version()} / numpy {np.__version__}")
+        save_results(args.baseline, local, machine)
+        print(f"実時間の基準値を {args.baseline} に保存しました")
+        if shared:
+            save_results(SIMULATION_BASELINE_FILE, shared)
+            print(f"シミュレーターの基準値を {SIMULATION_BASELINE_FILE} に保存しました（リポジトリに入れてください）")
+        return
+
+    regressions = compare(results, baseline, args.threshold)
+    # 読み込み時間は基準値とは別に、CLI の予算も超えないこと
+    regressions += [(name, "import_ms", IMPORT_BUDGET_MS, metrics["import_ms"])
+                    for name, metrics in results.items()
+                    if metrics.get("import_ms", 0) > IMPORT_BUDGET_MS]
+    missing = missing_baselines(results, baseline) if args.check else []
+    if regressions:
+        print("\n基準値より遅くなりました:")
+        for name, metric, base, value in regressions:
+            print(f"  {name} {metric}: {base:.3g} -> {value:.3g} ({(value / base - 1) * 100:+.0f}%)")
+    if missing:
+        print(f"\n{SIMULATION_BASELINE_FILE.name} に基準値がありません（--save で作ってリポジトリに入れてください）:")
+        for name, metric in missing:
+            print(f"  {name} {metric}")
+    if regressions or missing:
+        sys.exit(1)
+    if not args.baseline.exists():
+        print(f"\n実時間の基準値がありません（--save で {args.baseline.name} を作ると、次から比べます）")
+    if baseline:
+        print("\n基準値からの悪化はありません")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,18 @@
 import asyncio
 from toio import *
+from toio_control.connection import ConnectionManager
 
 # 接続したいtoioのBluetoothアドレスを指定します。
-# 未指定の場合、最初に見つかったtoioに接続します。
+# 未指定の場合、前回接続したtoio（cube_addresses.json に記録）か、最初に見つかったtoioに接続します。
 TOIO_ADDRESS = None 
 
 async def main():
     print("toioコアキューブをスキャン中...")
     try:
-        # toioを探して接続します
-        async with ToioCoreCube() as cube:
+        # toioを探して接続します（覚えているアドレスがあればスキャンせずに直接つなぎます）
+        async with ConnectionManager(addresses=[TOIO_ADDRESS]) as cubes:
+            cube = cubes[0]
+            print(cubes.report())
 
             # 接続が成功したら、LEDを赤く点灯させます
             await cube.api.indicator.turn_on(
@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import math
+import time
+from pathlib import Path
+
+import numpy as np
+
+from toio_control.avoidance import neighbor_pairs
+from toio_control.capture import CaptureRecorder, ReplayCube, compare_commands, load_capture, motor_commands
+from toio_control.cli import load_script
+from toio_control.clock import REAL_CLOCK, VirtualClock
+from toio_control.gains import apply_gains
+from toio_control.loop import NOTIFY, POLL
+from toio_control.sim import SimulatedCube
+from toio_control.target import HOST, TARGET
+from toio_control.trajectory import PURSUIT, WAYPOINT
+
+# --- 設定 ---
+# スクリプトごとのスタート地点（x, y, 角度）
+START_POSES = {
+    "2_p_control.py": (100, 100, 0),
+    "3_pid_control.py": (100, 100, 0),
+    "4_traveling.py": (100, 100, 0),
+    "5_obstacle.py": (150, 150, 45),
+}
+# 複数台で動かすスクリプト（スタート地点は FLEET_START から格子状に並べる）
+FLEET_SCRIPTS = ("7_fleet.py",)
+FLEET_START = (100, 100)
+FLEET_SPACING = 50  # 台数が多いときはマットに収まるように詰める
+FLEET_AREA = 300
+# この仮想時間を超えたら打ち切る（暴走対策）
+TIMEOUT_S = 120
+
+
+async def simulate(path, x, y, angle, mode=None, tour=None, estimator=None,
+                   write_latency=0.0, notify_latency=0.0, record=None, follower=None, adaptive=None,
+                   tuned_gains=False):
+    script = load_script(path)
+    if tuned_gains:
+        apply_gains(vars(script))
+    if adaptive is not None:
+        script.ADAPTIVE_RATE = adaptive
+    if mode is not None:
+        script.CONTROL_MODE = mode
+    if tour is not None:
+        script.TOUR_MODE = tour
+    if follower is not None:
+        script.HOST_FOLLOWER = follower
+    if estimator is not None:
+        script.POSE_ESTIMATOR = estimator
+    clock = VirtualClock()
+    async with SimulatedCube(clock, x=x, y=y, angle=angle,
+                             write_latency=write_latency, notify_latency=notify_latency) as cube:
+        recorder = CaptureRecorder(record, clock) if record is not None else None
+        if recorder is not None:
+            await recorder.attach(cube)
+        wall_start = time.perf_counter()
+        try:
+            await _run_with_timeout(script.run(cube, clock), clock)
+        finally:
+            if recorder is not None:
+                await recorder.detach()
+        wall = time.perf_counter() - wall_start
+        virtual = clock.now()
+    return {
+        "virtual_s": virtual,
+        "wall_s": wall,
+        "steps": clock.steps,
+        "motor_writes": cube.motor_writes,
+        "notifications": cube.notifications,
+        "final_pose": (round(cube.x), round(cube.y), round(cube.angle)),
+    }
+
+
+async def replay(path, capture_path, mode=None, realtime=False):
+    """
+    記録した通知をスクリプトに流し直し、送られた指令を記録のときの指令と比べる。
+    realtime=False なら仮想時計で待ち時間なしに流す（何度やっても同じ結果になる）。
+    """
+    script = load_script(path)
+    if mode is not None:
+        script.CONTROL_MODE = mode
+    if hasattr(script, "TOUR_MODE"):
+        script.TOUR_MODE = HOST  # 目標指定制御は流し直せない
+    capture = load_capture(capture_path)
+    cube = ReplayCube(capture, REAL_CLOCK if realtime else None)
+    async with cube:
+        wall_start = time.perf_counter()
+        task = asyncio.ensure_future(script.run(cube, cube.clock))
+        await asyncio.wait((task, cube.finished), return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            # 記録が先に終わった（開ループなのでゴールに着かないこともある）
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        else:
+            task.result()
+        wall = time.perf_counter() - wall_start
+    result = compare_commands(motor_commands(capture), cube.commands)
+    result.update(wall_s=wall, notifications=cube.notifications,
+                  duration_s=float(capture["time"][-1] - capture["time"][0]) if len(capture) else 0.0)
+    return result
+
+
+def fleet_start_poses(n):
+    """ n台分のスタート地点（x, y, 角度）を格子状に並べる """
+    columns = max(1, math.ceil(math.sqrt(n)))
+    spacing = min(FLEET_SPACING, FLEET_AREA / max(columns - 1, 1))
+    return [(FLEET_START[0] + (i % columns) * spacing,
+             FLEET_START[1] + (i // columns) * spacing, 0) for i in range(n)]
+
+
+class ClosestApproach:
+    """ 仮想時計に attach して、tick ごとにキューブ同士の中心間の最短距離を記録する """
+
+    def __init__(self, cubes, radius=FLEET_SPACING):
+        self.cubes = cubes
+        self.radius = radius  # これより離れている組は数えない
+        self.distance = math.inf
+
+    def advance(self, dt):
+        positions = np.array([(cube.x, cube.y) for cube in self.cubes])
+        i, j = neighbor_pairs(positions, self.radius)
+        if len(i):
+            d = positions[j] - positions[i]
+            self.distance = min(self.distance, float(np.hypot(d[:, 0], d[:, 1]).min()))
+
+
+async def simulate_fleet(path, n_cubes, write_latency=0.0, avoid=None, adaptive=None):
+    script = load_script(path)
+    if avoid is not None:
+        script.AVOID_COLLISIONS = avoid
+    if adaptive is not None:
+        script.ADAPTIVE_RATE = adaptive
+    clock = VirtualClock()
+    cubes = [SimulatedCube(clock, x=x, y=y, angle=angle, name=f"cube{i}", write_latency=write_latency)
+             for i, (x, y, angle) in enumerate(fleet_start_poses(n_cubes))]
+    for cube in cubes:
+        await cube.connect()
+    closest = ClosestApproach(cubes)
+    clock.attach(closest)
+    try:
+        wall_start = time.perf_counter()
+        fleet = await _run_with_timeout(script.run(cubes, clock), clock)
+        wall = time.perf_counter() - wall_start
+    finally:
+        for cube in cubes:
+            await cube.disconnect()
+    writes = sum(cube.motor_writes for cube in cubes)
+    return {
+        "virtual_s": clock.now(),
+        "wall_s": wall,
+        "steps": clock.steps,
+        "motor_writes": writes,
+        "commands_per_s": fleet.commands_per_second(),
+        "commands_per_wall_s": writes / wall if wall > 0 else 0.0,
+        "closest": closest.distance,
+    }
+
+
+async def _run_with_timeout(coro, clock):
+    task = asyncio.ensure_future(coro)
+    timeout = asyncio.ensure_future(clock.sleep(TIMEOUT_S))
+    await asyncio.wait((task, timeout), return_when=asyncio.FIRST_COMPLETED)
+    timeout.cancel()
+    if not task.done():
+        task.cancel()
+        raise TimeoutError(f"仮想時間 {TIMEOUT_S} 秒以内に終わりませんでした")
+    return task.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="制御スクリプトをシミュレーターで実行します")
+    parser.add_argument("script", choices=sorted(START_POSES) + list(FLEET_SCRIPTS))
+    parser.add_argument("--mode", choices=(POLL, NOTIFY), help="制御ループの方式（省略時はスクリプトの設定）")
+    parser.add_argument("--tour", choices=(HOST, TARGET),
+                        help="4_traveling.py の巡回の進め方（省略時はスクリプトの設定）")
+    parser.add_argument("--follower", choices=(PURSUIT, WAYPOINT),
+                        help="4_traveling.py をホストで制御するときの進み方（省略時はスクリプトの設定）")
+    parser.add_argument("--repeat", type=int, default=1, help="繰り返し回数（ベンチマーク用）")
+    parser.add_argument("--cubes", type=int, nargs="+", default=[2],
+                        help="複数台用スクリプトの台数（複数指定すると台数ごとの指令/sを比べる）")
+    parser.add_argument("--write-latency", type=float, default=0.0,
+                        help="モーター指令1回の書き込みにかかる時間 [ms]")
+    parser.add_argument("--notify-latency", type=float, default=0.0,
+                        help="座標の通知が届くまでの遅れ [ms]（1台用）")
+    parser.add_argument("--record", type=Path, help="通知とモーター指令をこのファイルに記録する（1台用）")
+    parser.add_argument("--replay", type=Path,
+                        help="記録ファイルの通知をスクリプトに流し直し、指令を記録と比べる")
+    parser.add_argument("--realtime", action="store_true", help="--replay を記録したときの速さで流す")
+    parser.add_argument("--no-avoid", dest="avoid", action="store_false", default=None,
+                        help="複数台用スクリプトでキューブ同士の衝突回避を使わない")
+    parser.add_argument("--no-estimator", dest="estimator", action="store_false", default=None,
+                        help="姿勢の推定器（遅れの補正と推測航法）を使わない")
+    parser.add_argument("--fixed-rate", dest="adaptive", action="store_false", default=None,
+                        help="制御周期を状態に合わせて切り替えず、スクリプトの CONTROL_PERIOD で回す")
+    parser.add_argument("--tuned-gains", action="store_true",
+                        help="tune.py が pid_gains.json に書き出したそのスクリプト用のゲインを使う")
+    args = parser.parse_args()
+
+    if args.script in FLEET_SCRIPTS:
+        for n in args.cubes:
+            for i in range(args.repeat):
+                r = asyncio.run(simulate_fleet(args.script, n, args.write_latency / 1000, args.avoid,
+                                               args.adaptive))
+                closest = f"{r['closest']:.0f}" if math.isfinite(r['closest']) else "-"
+                print(f"[{n}台 {i+1}] 仮想時間 {r['virtual_s']:.2f}s / 実時間 {r['wall_s']*1000:.1f}ms, "
+                      f"モーター書き込み {r['motor_writes']}回, "
+                      f"{r['commands_per_s']:.1f} 指令/s (仮想時間), "
+                      f"{r['commands_per_wall_s']:.0f} 指令/s (実時間), 最接近 {closest}")
+        return
+
+    if args.replay is not None:
+        for i in range(args.repeat):
+            with contextlib.redirect_stdout(io.StringIO()) if i else contextlib.nullcontext():
+                r = asyncio.run(replay(args.script, args.replay, args.mode, args.realtime))
+            print(f"[{i+1}] 記録 {r['duration_s']:.2f}s 分 (通知 {r['notifications']}回) を "
+                  f"実時間 {r['wall_s']*1000:.1f}ms で流し直しました / 指令 記録 {r['recorded']}回, "
+                  f"今回 {r['replayed']}回, 記録との差 最大 {r['max_diff']:.0f}, 平均 {r['mean_diff']:.1f}")
+        return
+
+    x, y, angle = START_POSES[args.script]
+    for i in range(args.repeat):
+        record = args.record if args.repeat == 1 else None
+        r = asyncio.run(simulate(args.script, x, y, angle, args.mode, args.tour, args.estimator,
+                                 args.write_latency / 1000, args.notify_latency / 1000, record,
+                                 args.follower, args.adaptive, args.tuned_gains))
+        print(f"[{i+1}] 仮想時間 {r['virtual_s']:.2f}s / 実時間 {r['wall_s']*1000:.1f}ms "
+              f"({r['steps'] / r['wall_s']:.0f} steps/s), "
+              f"モーター書き込み {r['motor_writes']}回, 通知 {r['notifications']}回, "
+              f"最終位置 {r['final_pose']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import asyncio
+import contextlib
+import io
+
+import numpy as np
+
+import simulate
+from toio_control.capture import KIND_ID, KIND_MOTOR, KIND_START, load_capture, motor_commands
+
+
+def run_quietly(coroutine):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(coroutine)
+
+
+def test_recorded_run_replays_to_the_same_commands(tmp_path):
+    path = tmp_path / "capture.bin"
+    result = run_quietly(simulate.simulate("3_pid_control.py", 100, 100, 0, record=path, write_latency=0.02))
+
+    capture = load_capture(path)
+    assert capture["kind"][0] == KIND_START
+    assert np.count_nonzero(capture["kind"] == KIND_ID) > 0
+    assert np.count_nonzero(capture["kind"] == KIND_MOTOR) == result["motor_writes"]
+    assert len(motor_commands(capture)) == result["motor_writes"]
+
+    replayed = run_quietly(simulate.replay("3_pid_control.py", path))
+    assert replayed["recorded"] == replayed["replayed"] == result["motor_writes"]
+    assert replayed["max_diff"] == 0.0
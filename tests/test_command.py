@@ -0,0 +1,60 @@
+import asyncio
+
+from toio_control.clock import VirtualClock
+from toio_control.command import MotorCommander
+from toio_control.model import MOTOR_DEAD_ZONE
+
+
+class RecordingMotor:
+    def __init__(self):
+        self.calls = []
+
+    async def motor_control(self, left, right, duration_ms=None):
+        self.calls.append((left, right) if duration_ms is None else (left, right, duration_ms))
+
+
+class ManualClock(VirtualClock):
+    def set(self, now):
+        self._now = now
+
+
+def send_all(commander, commands):
+    async def main():
+        for command in commands:
+            await commander.motor_control(*command)
+    asyncio.run(main())
+
+
+def test_repeated_and_small_changes_are_suppressed():
+    motor = RecordingMotor()
+    commander = MotorCommander(motor, ManualClock(), deadband=2)
+    send_all(commander, [(50, 50), (50, 50), (51, 49), (53, 50)])
+    assert motor.calls == [(50, 50), (53, 50)]
+    assert commander.suppressed == 2
+
+
+def test_stop_and_dead_zone_crossing_are_always_sent():
+    motor = RecordingMotor()
+    commander = MotorCommander(motor, ManualClock(), deadband=5)
+    inside = MOTOR_DEAD_ZONE - 1
+    send_all(commander, [(MOTOR_DEAD_ZONE, 0), (inside, 0), (inside, 0), (0, 0), (0, 0)])
+    assert motor.calls == [(MOTOR_DEAD_ZONE, 0), (inside, 0), (0, 0)]
+
+
+def test_same_command_is_refreshed_after_interval():
+    motor = RecordingMotor()
+    clock = ManualClock()
+    commander = MotorCommander(motor, clock, refresh_interval=1.0)
+    send_all(commander, [(30, 30)])
+    clock.set(0.5)
+    send_all(commander, [(30, 30)])
+    clock.set(1.0)
+    send_all(commander, [(30, 30)])
+    assert motor.calls == [(30, 30), (30, 30)]
+
+
+def test_timed_command_is_always_sent_and_resets_last_sent():
+    motor = RecordingMotor()
+    commander = MotorCommander(motor, ManualClock())
+    send_all(commander, [(30, 30), (30, 30, 100), (30, 30)])
+    assert motor.calls == [(30, 30), (30, 30, 100), (30, 30)]
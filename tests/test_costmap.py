@@ -0,0 +1,46 @@
+import numpy as np
+
+from toio_control.costmap import CostMap
+from toio_control.model import MAT_BOUNDS
+from toio_control.obstacles import ObstacleSet
+
+
+def random_layout(rng, n):
+    x0, y0, x1, y1 = MAT_BOUNDS
+    centers = rng.uniform((x0, y0), (x1, y1), size=(n, 2))
+    return ObstacleSet([tuple(c) for c in centers], rng.uniform(5, 40, size=n).tolist())
+
+
+def test_path_check_is_never_looser_than_obstacle_set():
+    rng = np.random.default_rng(0)
+    x0, y0, x1, y1 = MAT_BOUNDS
+    for _ in range(10):
+        obstacles = random_layout(rng, int(rng.integers(1, 30)))
+        for resolution in (2.0, 5.0):
+            costmap = CostMap.build(obstacles, resolution=resolution)
+            for _ in range(200):
+                ax, bx = rng.uniform(x0, x1, size=2)
+                ay, by = rng.uniform(y0, y1, size=2)
+                margin = float(rng.choice((0.0, 10.0, 30.0)))
+                if obstacles.is_path_blocked(ax, ay, bx, by, margin):
+                    assert costmap.is_path_blocked(ax, ay, bx, by, margin)
+                if obstacles.contains(ax, ay, margin):
+                    assert costmap.contains(ax, ay, margin)
+
+
+def test_clearance_matches_exact_distance():
+    obstacles = ObstacleSet([(250, 250)], [40])
+    costmap = CostMap.build(obstacles)
+    assert abs(costmap.clearance(350, 250) - 60) <= costmap.slack
+    assert abs(costmap.clearance(250, 250) + 40) <= costmap.slack
+    gx, gy = costmap.gradient(350, 250)
+    assert gx > 0.9 and abs(gy) < 0.1
+
+
+def test_cache_round_trip(tmp_path):
+    obstacles = ObstacleSet([(200, 200), (300, 320)], [30, 20])
+    built = CostMap.load_or_build(obstacles, cache_dir=tmp_path)
+    assert CostMap.cache_path(obstacles, tmp_path).exists()
+    loaded = CostMap.load_or_build(obstacles, cache_dir=tmp_path)
+    np.testing.assert_array_equal(built.sdf, loaded.sdf)
+    assert loaded.key == obstacles.key
@@ -0,0 +1,33 @@
+import struct
+
+from toio import PositionIdMissed
+
+from toio_control.decode import POSITION_ID, POSITION_ID_MISSED, POSITION_ID_SIZE, PoseRecord, decode_id
+
+
+def position_id(x, y, angle):
+    return bytearray(struct.pack("<BHHHHHH", POSITION_ID, x, y, angle, x, y, angle))
+
+
+def test_position_id_is_written_into_pose():
+    pose = PoseRecord()
+    assert decode_id(position_id(120, 340, 270), pose, now=1.5) is pose
+    assert (pose.x, pose.y, pose.angle) == (120, 340, 270)
+    assert pose.seq == 1 and pose.on_mat and pose.received_at == 1.5
+
+
+def test_missed_clears_on_mat():
+    pose = PoseRecord()
+    decode_id(position_id(120, 340, 270), pose)
+    assert isinstance(decode_id(bytearray((POSITION_ID_MISSED,)), pose), PositionIdMissed)
+    assert not pose.on_mat
+    assert (pose.x, pose.y, pose.seq) == (120, 340, 1)
+
+
+def test_empty_and_truncated_payloads_are_dropped():
+    pose = PoseRecord()
+    payload = position_id(120, 340, 270)
+    assert decode_id(bytearray(), pose) is None
+    for n in range(1, POSITION_ID_SIZE):
+        assert decode_id(payload[:n], pose) is None
+    assert pose.seq == 0 and not pose.on_mat
@@ -0,0 +1,49 @@
+import time
+
+from toio_control.estimator import PoseEstimator
+
+PERIOD = 0.05
+
+
+def drop_out(estimator, start, seconds, hold):
+    """ 座標が途切れた間の制御を seconds だけ続ける（hold なら止めて待つ、そうでなければ推測航法で進む） """
+    now = start
+    longest = 0.0
+    while now < start + seconds:
+        now += PERIOD
+        if hold:
+            estimator.command(0, 0, now)
+        else:
+            estimator.predict(now)
+            estimator.command(30, 30, now)
+        longest = max(longest, now - estimator.time)
+        assert len(estimator._commands) <= 2
+    return now, longest
+
+
+def test_coasting_keeps_the_estimate_current():
+    estimator = PoseEstimator()
+    estimator.measure(250, 250, 0, 0.0)
+    estimator.missed(0.05)
+    started = time.perf_counter()
+    now, longest = drop_out(estimator, 0.05, 1.0, hold=False)
+    first_second = time.perf_counter() - started
+    # predict() が計算し直す長さは、途切れてからの時間によらず1周期ほど
+    assert longest <= estimator.notify_latency + PERIOD + 1e-9
+    started = time.perf_counter()
+    now, longest = drop_out(estimator, now, 29.0, hold=False)
+    assert (time.perf_counter() - started) / 29 < first_second * 3
+    assert longest <= estimator.notify_latency + PERIOD + 1e-9
+    assert not estimator.is_reliable(now)
+
+
+def test_holding_does_not_pile_up_commands():
+    estimator = PoseEstimator()
+    estimator.measure(250, 250, 0, 0.0)
+    estimator.command(30, 30, 0.0)
+    estimator.missed(0.05)
+    now, longest = drop_out(estimator, 0.05, 30.0, hold=True)
+    assert longest <= estimator.notify_latency + PERIOD + 1e-9
+    # 座標が戻ったら、途切れていた30秒を計算し直さずにすぐ補正できる
+    estimator.measure(260, 250, 0, now + PERIOD)
+    assert estimator.on_mat and estimator.is_reliable(now + PERIOD)
@@ -0,0 +1,71 @@
+import asyncio
+
+from toio_control.clock import VirtualClock
+from toio_control.command import MotorCommander
+from toio_control.loop import LoopStats, _send
+
+
+class SlowMotor:
+    """ 書き込みに latency [s] かかるモーター """
+
+    def __init__(self, clock, latency):
+        self.clock = clock
+        self.latency = latency
+        self.calls = []
+
+    async def motor_control(self, left, right, duration_ms=None):
+        await self.clock.sleep(self.latency)
+        self.calls.append((left, right))
+
+
+def test_commands_queued_during_a_write_are_counted_as_writes():
+    clock = VirtualClock()
+    motor = SlowMotor(clock, 0.03)
+    commander = MotorCommander(motor, clock)
+    stats = LoopStats()
+
+    async def main():
+        first = asyncio.ensure_future(_send(commander, (50, 50), stats, clock, 0.0))
+        await asyncio.sleep(0)
+        # 書き込み中に2つ来たら、最後の1つだけを預かって送る
+        await _send(commander, (60, 60), stats, clock, 0.0)
+        await _send(commander, (70, 70), stats, clock, 0.01)
+        await first
+
+    asyncio.run(main())
+    assert motor.calls == [(50, 50), (70, 70)]
+    assert (stats.writes, stats.suppressed, stats.coalesced) == (2, 0, 1)
+    assert stats.writes == commander.sent
+    assert len(stats.latency) == 2
+    assert stats.latency[-1] == clock.now() - 0.01
+
+
+def test_suppressed_commands_are_not_counted_as_writes():
+    clock = VirtualClock()
+    commander = MotorCommander(SlowMotor(clock, 0.0), clock)
+    stats = LoopStats()
+
+    async def main():
+        for command in ((50, 50), (50, 50), (51, 50)):
+            await _send(commander, command, stats, clock, None)
+
+    asyncio.run(main())
+    assert (stats.writes, stats.suppressed) == (1, 2)
+
+
+def test_queued_command_dropped_at_write_time_counts_as_suppressed():
+    clock = VirtualClock()
+    motor = SlowMotor(clock, 0.03)
+    commander = MotorCommander(motor, clock)
+    stats = LoopStats()
+
+    async def main():
+        first = asyncio.ensure_future(_send(commander, (50, 50), stats, clock, 0.0))
+        await asyncio.sleep(0)
+        await _send(commander, (51, 50), stats, clock, 0.0)
+        await first
+
+    asyncio.run(main())
+    assert motor.calls == [(50, 50)]
+    assert (stats.writes, stats.suppressed, stats.coalesced) == (1, 1, 0)
+    assert len(stats.latency) == 1
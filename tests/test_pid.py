@@ -0,0 +1,43 @@
+import numpy as np
+
+from toio_control.pid import PIDBank
+
+
+def test_output_is_clipped_to_out_limit():
+    pid = PIDBank(2, kp=(10.0, 10.0), ki=(0.0, 0.0), kd=(0.0, 0.0), out_limit=(80, 50))
+    out = pid.update([[100.0, -100.0], [1.0, -1.0]], 0.05)
+    np.testing.assert_allclose(out, [[80, -50], [10, -10]])
+
+
+def test_integral_stops_growing_while_saturated():
+    pid = PIDBank(1, kp=(1.0, 1.0), ki=(1.0, 1.0), kd=(0.0, 0.0), out_limit=(80, 50), i_limit=1000)
+    for _ in range(100):
+        pid.update([[100.0, 100.0]], 0.05)
+    # 飽和している間は積分を止める（i_limit まで積もらない）
+    assert pid.integral[0, 0] == 0.0
+    # 偏差の向きが変われば、すぐに反対向きの出力になる
+    out = pid.update([[-5.0, -5.0]], 0.05)
+    assert out[0, 0] < 0
+
+
+def test_integral_is_limited_to_out_limit_over_ki():
+    pid = PIDBank(1, kp=(0.0, 0.0), ki=(2.0, 2.0), kd=(0.0, 0.0), out_limit=(80, 50))
+    for _ in range(1000):
+        pid.update([[10.0, 10.0]], 0.05)
+    np.testing.assert_allclose(pid.integral, [[40.0, 25.0]])
+
+
+def test_integral_limit_follows_out_limit():
+    pid = PIDBank(1, kp=(0.0, 0.0), ki=(2.0, 2.0), kd=(0.0, 0.0), out_limit=(80, 50))
+    pid.out_limit = (40, 20)
+    np.testing.assert_allclose(pid.i_limit, [[20.0, 10.0]])
+    for _ in range(1000):
+        pid.update([[10.0, 10.0]], 0.05)
+    np.testing.assert_allclose(pid.integral, [[20.0, 10.0]])
+
+
+def test_derivative_skips_first_update_and_zero_dt():
+    pid = PIDBank(1, kp=(0.0, 0.0), ki=(0.0, 0.0), kd=(1.0, 1.0), out_limit=(80, 50))
+    np.testing.assert_allclose(pid.update([[10.0, 0.0]], 0.05), [[0.0, 0.0]])
+    np.testing.assert_allclose(pid.update([[12.0, 0.0]], 0.0), [[0.0, 0.0]])
+    np.testing.assert_allclose(pid.update([[13.0, 0.0]], 0.1), [[10.0, 0.0]])
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from toio_control.obstacles import ObstacleSet
+from toio_control.planner import DStarLite, PathPlanner
+
+
+def fresh_cost(blocked, start, goal):
+    search = DStarLite(blocked, goal)
+    search.move_start(start)
+    return search.compute()
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_repair_matches_fresh_search(seed):
+    rng = np.random.default_rng(seed)
+    height, width = 24, 32
+    blocked = rng.random((height, width)) < 0.25
+    start, goal = 0, height * width - 1
+    blocked.flat[[start, goal]] = False
+    search = DStarLite(blocked, goal)
+    search.move_start(start)
+    search.compute()
+
+    for _ in range(5):
+        # スタートを少し動かし、いくつかのマスを塞いだり空けたりする
+        start = int(rng.choice(np.flatnonzero(~blocked.ravel())))
+        changed = rng.choice(blocked.size, size=20, replace=False)
+        changed = changed[(changed != start) & (changed != goal)]
+        blocked.flat[changed] = ~blocked.flat[changed]
+        search.move_start(start)
+        search.update_cells(changed, blocked.ravel())
+        assert search.compute() == fresh_cost(blocked, start, goal)
+        path = search.path()
+        if path is not None:
+            assert path[0] == start and path[-1] == goal
+            assert not blocked.ravel()[path].any()
+
+
+def test_planned_path_stays_clear_of_obstacles():
+    obstacles = ObstacleSet([(250, 250), (200, 320)], [40, 30])
+    planner = PathPlanner(clearance=30.0)
+    path = planner.plan((100, 100), (400, 400), obstacles)
+    assert path[0] == (100, 100) and path[-1] == (400, 400)
+    for a, b in zip(path, path[1:]):
+        assert not obstacles.is_path_blocked(*a, *b, 30.0 - planner.resolution)
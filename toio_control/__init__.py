@@ -0,0 +1,33 @@
+"""
+toio制御スクリプトで共通に使う部品をまとめたパッケージ
+
+下の名前は使われたときに初めて読み込む（CLI の起動を NumPy の読み込みで待たせないため）。
+"""
+
+import importlib
+
+# 名前 -> 定義しているモジュール
+_EXPORTS = {
+    "MOTOR_LIMIT": ".drive",
+    "mix_wheels": ".drive",
+    "get_angle_diff": ".geometry",
+    "heading_errors": ".geometry",
+    "ANGLE": ".pid",
+    "DIST": ".pid",
+    "N_AXES": ".pid",
+    "PIDBank": ".pid",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value  # 2回目からは普通の属性として引ける
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
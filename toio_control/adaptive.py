@@ -0,0 +1,112 @@
+import numpy as np
+
+# 制御周期の段階 [s]
+FAST_PERIOD = 0.04    # ゴールの近く・大きく向きを変えるとき・障害物やほかのキューブを避けているとき
+NORMAL_PERIOD = 0.05  # そのほか（固定周期のときの CONTROL_PERIOD と同じ）
+SLOW_PERIOD = 0.1     # ゴールから遠く、向きも合っているとき（まっすぐ走るだけ）
+FAST, NORMAL, SLOW = range(3)
+
+NEAR_DISTANCE = 30    # 目標までこれより近ければ速くする [単位]
+FAR_DISTANCE = 80     # 目標までこれより遠く、向きも合っていれば遅くする [単位]
+TURN_ANGLE = 60       # 向きの差がこれより大きければ速くする [度]
+STRAIGHT_ANGLE = 15   # 遅くしてよい向きの差 [度]
+SLOW_DOWN_HOLD = 0.2  # 遅い段階に移るのは、その条件がこれだけ続いてから [s]（速くするのはすぐ）
+
+
+class AdaptiveRate:
+    """
+    N台分の制御周期を、目標までの距離・向きの差・回避中かどうかで3段階に切り替える。
+
+    遠くをまっすぐ走っている間は SLOW_PERIOD に下げて計算と書き込みを減らし、
+    ゴールの近くや大きく曲がるとき、避けているときは FAST_PERIOD に上げて細かく直す。
+    速くするのはすぐ、遅くするのは条件が SLOW_DOWN_HOLD 続いてからなので、境目で何度も切り替わらない。
+    制御ループは period（全台で一番速い周期）で回し、台ごとの周期は cube_periods() で引く。
+
+    >>> rate = AdaptiveRate(1)
+    >>> rate.update([distance], [angle_diff], [is_avoiding], now)  # step の中で毎回呼ぶ
+    >>> rate.period  # 次の制御までの周期 [s]
+    """
+
+    def __init__(self, n=1, periods=(FAST_PERIOD, NORMAL_PERIOD, SLOW_PERIOD), near=NEAR_DISTANCE,
+                 far=FAR_DISTANCE, turn_angle=TURN_ANGLE, straight_angle=STRAIGHT_ANGLE, hold=SLOW_DOWN_HOLD):
+        self.periods = np.asarray(periods, dtype=float)
+        self.near = near
+        self.far = far
+        self.turn_angle = turn_angle
+        self.straight_angle = straight_angle
+        self.hold = hold
+        self.levels = np.full(n, NORMAL)
+        self._slower_since = np.full(n, np.nan)  # 遅い段階の条件になった時刻（なっていなければ NaN）
+        self.ticks = np.zeros(len(self.periods), dtype=np.int64)  # 段階ごとの制御回数（台 × 回）
+        self.changes = 0  # 段階を切り替えた回数（台ごとに数える）
+        self.period = float(self.periods[NORMAL])  # 次の制御までの周期 [s]（全台で一番速いもの）
+
+    def cube_periods(self):
+        """ 台ごとの周期 (N,) [s] """
+        return self.periods[self.levels]
+
+    def _wanted(self, distance, angle, avoiding):
+        # 1台分の段階（angle は向きの差の絶対値）
+        if distance < self.near or angle > self.turn_angle or avoiding:
+            return FAST
+        if distance > self.far and angle < self.straight_angle:
+            return SLOW
+        return NORMAL
+
+    def update(self, distance, angle_error, avoiding=False, now=0.0, idle=None):
+        """
+        目標までの距離・向きの差 [度]・回避中かどうか（どれも (N,)）から段階を決め、台ごとの周期を返す。
+        idle (N,) が True の台（着いて止まっているなど）は、すぐに一番遅い段階にする。
+        """
+        if len(self.levels) == 1:
+            return self._update_one(distance, angle_error, avoiding, now, idle)
+        distance = np.asarray(distance, dtype=float)
+        angle = np.abs(np.asarray(angle_error, dtype=float))
+        wanted = np.full(len(self.levels), NORMAL)
+        wanted[(distance > self.far) & (angle < self.straight_angle)] = SLOW
+        wanted[(distance < self.near) | (angle > self.turn_angle) | np.asarray(avoiding, dtype=bool)] = FAST
+
+        levels = self.levels
+        slower = wanted > levels
+        since = self._slower_since
+        since[~slower] = np.nan
+        since[slower & np.isnan(since)] = now
+        ready = slower & (now - since >= self.hold)
+        new = np.minimum(wanted, levels)
+        new[ready] = wanted[ready]
+        if idle is not None:
+            new[np.asarray(idle, dtype=bool)] = SLOW
+        since[ready] = np.nan
+        self.changes += int(np.count_nonzero(new != levels))
+        self.levels = new
+        self.ticks += np.bincount(new, minlength=len(self.periods))
+        self.period = float(self.periods[new.min()])
+        return self.periods[new]
+
+    def _update_one(self, distance, angle_error, avoiding, now, idle):
+        # 1台のときは NumPy の配列を作らずに同じ判定をする（配列を作る方が判定より時間がかかる）
+        avoiding = avoiding if isinstance(avoiding, bool) else bool(avoiding[0])
+        wanted = self._wanted(distance[0], abs(angle_error[0]), avoiding)
+        level = int(self.levels[0])
+        since = self._slower_since[0]
+        if wanted > level:
+            if since != since:  # NaN: 遅い段階の条件になったばかり
+                since = now
+            new = level
+            if now - since >= self.hold:
+                new, since = wanted, np.nan
+        else:
+            new, since = wanted, np.nan
+        if idle is not None and idle[0]:
+            new = SLOW
+        self._slower_since[0] = since
+        if new != level:
+            self.changes += 1
+            self.levels[0] = new
+        self.ticks[new] += 1
+        self.period = float(self.periods[new])
+        return self.periods[self.levels]
+
+    def report(self):
+        counts = ", ".join(f"{p * 1000:.0f}ms {c}回" for p, c in zip(self.periods, self.ticks.tolist()))
+        return f"可変周期: {counts} (台×回), 切り替え {self.changes}回"
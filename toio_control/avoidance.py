@@ -0,0 +1,325 @@
+import numpy as np
+
+from .geometry import get_angle_diff, heading_errors
+from .model import MOTOR_DEAD_ZONE
+
+# --- 設定 ---
+AGENT_RADIUS = 20        # キューブ1台の半径 [マット単位]（32mm 角の外接円 ≒ 16.6単位 + 余裕）
+NEIGHBOR_DIST = 90       # これより遠いキューブは気にしない [単位]（空間ハッシュのセルの大きさ）
+TIME_HORIZON = 1.5       # この時間 [s] 先までぶつからない速度を選ぶ
+MAX_SPEED = 200          # 速度の上限 [単位/s]
+GOAL_GAIN = 2.0          # 目標へ向かう速度 = 距離 × GOAL_GAIN（MAX_SPEED まで）[1/s]
+LOOKAHEAD = 0.4          # 避けるときは「進みたい速さ × LOOKAHEAD」を距離の誤差として PID に渡す [s]
+SOLVER_ITERATIONS = 10   # 半平面への射影を繰り返す回数
+VELOCITY_SMOOTHING = 0.5  # 座標の差から求めた速度の平滑化（1 なら平滑化しない）
+# 最後の安全策（ORCA の近似と、横に動けない車輪のせいで、選んだ速度どおりに避けられないことがあるため）：
+# まっすぐ進むと相手の手前（中心間 2 × 半径 + CLEARANCE_BUFFER + 止まるまでに進む分）に入る台は、そこで止める
+CLEARANCE_BUFFER = 5     # ぶつかる距離のこれだけ手前で止める [単位]（ORCA はこの分だけ大きい半径で避ける）
+CLEARANCE_REACTION = 0.2   # 動いている台は、さらに「今の速さ × この時間 [s]」だけ手前で止める（指令が効くまでの遅れ）
+CLEARANCE_CREEP = 15     # 止める位置まで道のりが残っている間は、距離の誤差をこれだけ足す（不感帯で止まらないように）
+CLEARANCE_GRAZE = 3      # 手前に入った台は、中心間がぶつかる距離 + これを切る向きには進ませない [単位]（座標の誤差の分）
+CLEARANCE_RANGE = 40     # 止める位置からさらにこれ以内の組だけ調べる [単位]
+
+# 隣のセルのうち、半分だけ見れば全部の組が1回ずつ見つかる（自分のセル + 右・右上・上・左上）
+_HALF_NEIGHBORHOOD = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+
+
+def neighbor_pairs(positions, radius):
+    """
+    距離が radius 未満の組 (i, j)（i < j）を空間ハッシュで探し、2つの配列で返す。
+    セルの大きさを radius にして隣のセルだけを比べるので、計算量は O(N + 見つかった組の数)。
+    """
+    positions = np.asarray(positions, dtype=float)
+    n = len(positions)
+    if n < 2:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+    cells = np.floor(positions / radius).astype(np.int64)
+    cells -= cells.min(axis=0) - 1  # 隣のセルも負にならないようにずらす
+    stride = int(cells[:, 1].max()) + 2
+    keys = cells[:, 0] * stride + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    index = np.arange(n)
+
+    found_i, found_j = [], []
+    for dx, dy in _HALF_NEIGHBORHOOD:
+        target = keys + (dx * stride + dy)
+        start = np.searchsorted(sorted_keys, target, side="left")
+        counts = np.searchsorted(sorted_keys, target, side="right") - start
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        # i ごとに、隣のセルに入っているキューブを全部並べる
+        i = np.repeat(index, counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(start, counts) + offsets]
+        if (dx, dy) == (0, 0):
+            keep = i < j
+            i, j = i[keep], j[keep]
+        found_i.append(i)
+        found_j.append(j)
+    if not found_i:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+    i = np.concatenate(found_i)
+    j = np.concatenate(found_j)
+    d = positions[j] - positions[i]
+    near = d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] < radius * radius
+    i, j = i[near], j[near]
+    # 組は小さい番号を先にそろえる（上下のセルの組は向きが逆のことがある）
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+def orca_planes(positions, velocities, i, j, radius, time_horizon, dt):
+    """
+    組 (i, j) ごとに、i が守るべき ORCA の半平面（点 (k, 2) と内向きの法線 (k, 2)）と、
+    i と j の相対速度をどれだけ変えればよいか u (k, 2) を返す（RVO2 と同じ作り方を配列でまとめて行う）。
+    j 側の半平面は点が velocities[j] - u / 2、法線が逆向きになる。
+    """
+    rel_pos = positions[j] - positions[i]
+    rel_vel = velocities[i] - velocities[j]
+    dist_sq = np.einsum("ij,ij->i", rel_pos, rel_pos)
+    r = 2 * radius
+    r_sq = r * r
+    inv_tau = 1.0 / time_horizon
+
+    # まだぶつかっていない組：時間 time_horizon までの衝突円錐のどこに近いかで分ける
+    colliding = dist_sq <= r_sq
+    w = rel_vel - np.where(colliding[:, None], 1.0 / dt, inv_tau) * rel_pos
+    w_len_sq = np.einsum("ij,ij->i", w, w)
+    dot = np.einsum("ij,ij->i", w, rel_pos)
+    w_len = np.sqrt(np.maximum(w_len_sq, 1e-12))
+    unit_w = w / w_len[:, None]
+    # 打ち切りの円（またはぶつかっている組）に射影する場合
+    on_circle = colliding | ((dot < 0) & (dot * dot > r_sq * w_len_sq))
+    circle_dir = np.column_stack((unit_w[:, 1], -unit_w[:, 0]))
+    circle_u = (np.where(colliding, r / dt, r * inv_tau) - w_len)[:, None] * unit_w
+
+    # 円錐の左右の脚に射影する場合
+    leg = np.sqrt(np.maximum(dist_sq - r_sq, 0.0))
+    left = rel_pos[:, 0] * w[:, 1] - rel_pos[:, 1] * w[:, 0] > 0
+    px, py = rel_pos[:, 0], rel_pos[:, 1]
+    safe_sq = np.maximum(dist_sq, 1e-12)
+    left_dir = np.column_stack((px * leg - py * r, px * r + py * leg)) / safe_sq[:, None]
+    right_dir = -np.column_stack((px * leg + py * r, -px * r + py * leg)) / safe_sq[:, None]
+    leg_dir = np.where(left[:, None], left_dir, right_dir)
+    leg_u = np.einsum("ij,ij->i", rel_vel, leg_dir)[:, None] * leg_dir - rel_vel
+
+    direction = np.where(on_circle[:, None], circle_dir, leg_dir)
+    u = np.where(on_circle[:, None], circle_u, leg_u)
+    normal = np.column_stack((-direction[:, 1], direction[:, 0]))
+    return normal, u
+
+
+def clearance_room(positions, headings, radius, buffers=CLEARANCE_BUFFER, search=CLEARANCE_RANGE):
+    """
+    各台が向き headings [度] にまっすぐ進んだとき、ほかの台の手前（中心間 2 × radius + buffers）に
+    入るまでの道のり (N,) を返す。どの台にも入らなければ inf。buffers は全台共通の値か (N,) の配列。
+    すでに手前の範囲にいるときは、そのまま進むと中心間が 2 × radius + CLEARANCE_GRAZE を切るなら 0、
+    もうぶつかる距離より近くて相手の方を向いているなら、食い込んでいる分だけ負の値。
+    """
+    n = len(positions)
+    room = np.full(n, np.inf)
+    contact = 2 * radius
+    buffers = np.broadcast_to(np.asarray(buffers, dtype=float), (n,))
+    i, j = neighbor_pairs(positions, contact + float(buffers.max()) + search)
+    if len(i) == 0:
+        return room
+    # 組の両側を「自分 → 相手」の向きでまとめて扱う
+    me = np.concatenate((i, j))
+    d = np.concatenate((positions[j] - positions[i], positions[i] - positions[j]))
+    heading = np.radians(np.asarray(headings, dtype=float)[me])
+    ahead = d[:, 0] * np.cos(heading) + d[:, 1] * np.sin(heading)
+    dist_sq = np.einsum("ij,ij->i", d, d)
+    keep_out = contact + buffers[me]
+    # 半直線が円に入るか（判別式が 0 以上か）と、入るまでの道のり
+    outer = ahead * ahead - (dist_sq - keep_out * keep_out)
+    graze = contact + CLEARANCE_GRAZE
+    inner = ahead * ahead - (dist_sq - graze * graze)
+    touching = dist_sq < contact * contact
+    near = ~touching & (dist_sq < keep_out * keep_out)
+    far = ~touching & ~near
+    value = np.full(len(me), np.inf)
+    value[touching] = np.sqrt(dist_sq[touching]) - contact
+    value[near & (inner >= 0)] = 0.0
+    hit = far & (outer >= 0)
+    value[hit] = ahead[hit] - np.sqrt(outer[hit])
+    value[ahead <= 0] = np.inf
+    np.minimum.at(room, me, value)
+    return room
+
+
+class CollisionAvoidance:
+    """
+    全台の ORCA（相互速度障害物）による衝突回避を、1 tick につき NumPy でまとめて計算する。
+
+    近くのキューブの組は neighbor_pairs() の空間ハッシュで探すので、台数が増えても
+    ほぼ台数に比例した計算量で済む。1台ごとの線形計画は解かず、破っている半平面への射影を
+    全台同時に SOLVER_ITERATIONS 回繰り返す近似で速度を選ぶ。
+    結果は PID に渡す距離と角度差で返す。避ける必要がないキューブは本当の目標への値のまま。
+    近似で避けきれない分は、相手の手前で止める確認（hold_clearance / guard_commands）で防ぐ。
+
+    >>> avoidance = CollisionAvoidance(len(cubes))
+    >>> errors = avoidance.heading_errors(poses, targets, now, fixed=reached)
+    >>> commands = mix_wheels(pid.update(errors, dt))
+    >>> avoidance.guard_commands(poses, commands)  # 前後に動くとぶつかる台は旋回だけにする
+    """
+
+    def __init__(self, n, radius=AGENT_RADIUS, neighbor_dist=NEIGHBOR_DIST, time_horizon=TIME_HORIZON,
+                 max_speed=MAX_SPEED, iterations=SOLVER_ITERATIONS):
+        self.radius = radius
+        self.neighbor_dist = neighbor_dist
+        self.time_horizon = time_horizon
+        self.max_speed = max_speed
+        self.iterations = iterations
+        self.velocities = np.zeros((n, 2))  # 座標の差から推定した今の速度 [単位/s]
+        self._last_positions = None
+        self._last_time = None
+        self.ticks = 0
+        self.pairs = 0          # 調べた組の合計
+        self.adjusted = 0       # 仮の目標に差し替えた回数（台 × tick）
+        self.avoiding = np.zeros(n, dtype=bool)  # 最後の tick で避けていた台
+        self.min_distance = np.inf  # 近くの組の中心間の距離の最小値 [単位]
+        self.held = 0           # 相手の手前で止まるように距離の誤差を抑えた回数（台 × tick）
+        self.stopped = 0        # 指令の前後の成分を止めた回数（台 × tick）
+
+    def _update_velocities(self, positions, now):
+        if self._last_positions is not None and now > self._last_time:
+            measured = (positions - self._last_positions) / (now - self._last_time)
+            self.velocities += VELOCITY_SMOOTHING * (measured - self.velocities)
+        self._last_positions = positions.copy()
+        self._last_time = now
+
+    def preferred_velocities(self, positions, targets):
+        """ 目標へまっすぐ向かう速度（近いほど遅く、MAX_SPEED まで） """
+        to_goal = targets - positions
+        distance = np.hypot(to_goal[:, 0], to_goal[:, 1])
+        speed = np.minimum(distance * GOAL_GAIN, self.max_speed)
+        return to_goal * (speed / np.maximum(distance, 1e-9))[:, None]
+
+    def solve(self, positions, preferred, dt, fixed=None):
+        """
+        全台の新しい速度 (N, 2) を選ぶ。fixed（bool の配列）のキューブは動かないものとして扱い、
+        その相手が避ける分をすべて受け持つ。
+        """
+        n = len(positions)
+        i, j = neighbor_pairs(positions, self.neighbor_dist)
+        self.pairs += len(i)
+        if len(i) == 0:
+            return preferred.copy()
+        d = positions[j] - positions[i]
+        self.min_distance = min(self.min_distance, float(np.sqrt(np.einsum("ij,ij->i", d, d).min())))
+
+        normal, u = orca_planes(positions, self.velocities, i, j, self.radius + CLEARANCE_BUFFER,
+                                self.time_horizon, dt)
+        # 半平面は組の両側に1つずつ（受け持ちは半分ずつ。相手が動かないなら全部）
+        fixed = np.zeros(n, dtype=bool) if fixed is None else np.asarray(fixed, dtype=bool)
+        share_i = np.where(fixed[j], 1.0, 0.5)[:, None]
+        share_j = np.where(fixed[i], 1.0, 0.5)[:, None]
+        owner = np.concatenate((i, j))
+        points = np.concatenate((self.velocities[i] + share_i * u, self.velocities[j] - share_j * u))
+        normals = np.concatenate((normal, -normal))
+        active = ~fixed[owner]
+        owner, points, normals = owner[active], points[active], normals[active]
+
+        v = preferred.copy()
+        for _ in range(self.iterations):
+            # 破っている半平面の境界までの射影を、台ごとに平均して同時に動かす
+            depth = np.einsum("ij,ij->i", points - v[owner], normals)
+            violated = depth > 0
+            if not violated.any():
+                break
+            push = normals * np.where(violated, depth, 0.0)[:, None]
+            counts = np.maximum(np.bincount(owner, weights=violated, minlength=n), 1)
+            v[:, 0] += np.bincount(owner, weights=push[:, 0], minlength=n) / counts
+            v[:, 1] += np.bincount(owner, weights=push[:, 1], minlength=n) / counts
+            speed = np.hypot(v[:, 0], v[:, 1])
+            v *= np.minimum(1.0, self.max_speed / np.maximum(speed, 1e-9))[:, None]
+        return v
+
+    def _clearance_buffers(self):
+        # 速く動いている台ほど手前で止める（止まるまでに進む分）
+        return CLEARANCE_BUFFER + np.hypot(self.velocities[:, 0], self.velocities[:, 1]) * CLEARANCE_REACTION
+
+    def hold_clearance(self, poses, errors):
+        """
+        今の向きにまっすぐ進むと相手の手前に入る台は、そこまでの道のり + CLEARANCE_CREEP より
+        距離の誤差を大きくしない（errors をその場で変える）。近づくほど遅くなって手前で止まり、
+        もうぶつかる距離より近ければ負になって下がる。抑えた台の bool の配列を返す。
+        """
+        room = clearance_room(poses[:, :2], poses[:, 2], self.radius, self._clearance_buffers())
+        limit = np.where(room > 0, room + CLEARANCE_CREEP, room)
+        held = limit < errors[:, 0]
+        errors[held, 0] = limit[held]
+        self.held += int(held.sum())
+        return held
+
+    def guard_commands(self, poses, commands):
+        """
+        モーター指令 (N, 2: left, right) の最終確認（commands をその場で変える）。
+        前進（後退）すると相手の手前に入る台は、前後の成分を 0 にする。前がふさがっている台の旋回は
+        不感帯 MOTOR_DEAD_ZONE より小さくしない（小さな向きの誤差で回れずに、その場で固まらないように）。
+        PID のD項などで、距離の誤差を抑えても前後に動いてしまう分もここで止める。止めた台の bool の配列を返す。
+        """
+        positions, headings = poses[:, :2], poses[:, 2]
+        buffers = self._clearance_buffers()
+        forward = (commands[:, 0] + commands[:, 1]) / 2
+        turn = (commands[:, 0] - commands[:, 1]) / 2
+        front = clearance_room(positions, headings, self.radius, buffers) <= 0
+        stop = front & (forward > 0)
+        backing = forward < 0
+        if backing.any():
+            back = clearance_room(positions, headings + 180, self.radius, buffers) <= 0
+            stop |= backing & back
+        if not (stop.any() or front.any()):
+            return stop
+        forward[stop] = 0
+        spin = front & (turn != 0)
+        turn[spin] = np.sign(turn[spin]) * np.maximum(np.abs(turn[spin]), MOTOR_DEAD_ZONE)
+        changed = stop | spin
+        commands[changed, 0] = np.rint(forward[changed] + turn[changed])
+        commands[changed, 1] = np.rint(forward[changed] - turn[changed])
+        self.stopped += int(stop.sum())
+        return stop
+
+    def heading_errors(self, poses, targets, now, fixed=None):
+        """
+        poses (N, 3) と本当の目標 targets (N, 2) から、PID に渡す距離と角度差 (N, 2) を返す
+        （geometry.heading_errors と同じ形）。避けるキューブは、選んだ速度の向きを角度差に、
+        その速度のうち今の向きに進める分 × LOOKAHEAD を距離にする
+        （横に動けないので、向きが大きくずれている間は前に進まずに回る）。
+        """
+        poses = np.asarray(poses, dtype=float)
+        positions = poses[:, :2]
+        targets = np.asarray(targets, dtype=float)
+        dt = now - self._last_time if self._last_time is not None and now > self._last_time else 0.05
+        self._update_velocities(positions, now)
+        self.ticks += 1
+        preferred = self.preferred_velocities(positions, targets)
+        # 着いたキューブと、ゴールの目の前まで来たキューブは避けない（相手が全部よける）。
+        # 着いたキューブは目標から REACH_THRESHOLD ほどずれて止まるので、ゴールの近くでまで避けると詰まる
+        to_goal = targets - positions
+        passive = np.hypot(to_goal[:, 0], to_goal[:, 1]) < 2 * self.radius
+        if fixed is not None:
+            passive |= np.asarray(fixed, dtype=bool)
+        velocities = self.solve(positions, preferred, dt, passive)
+        errors = heading_errors(targets, poses)
+        changed = np.hypot(*(velocities - preferred).T) > 1e-6
+        self.adjusted += int(changed.sum())
+        self.avoiding = changed
+        if changed.any():
+            v = velocities[changed]
+            heading = np.radians(poses[changed, 2])
+            forward = v[:, 0] * np.cos(heading) + v[:, 1] * np.sin(heading)
+            errors[changed, 0] = np.maximum(forward, 0.0) * LOOKAHEAD
+            errors[changed, 1] = get_angle_diff(np.degrees(np.arctan2(v[:, 1], v[:, 0])), poses[changed, 2])
+        self.avoiding |= self.hold_clearance(poses, errors)
+        return errors
+
+    def report(self):
+        closest = f"{self.min_distance:.0f}" if np.isfinite(self.min_distance) else "-"
+        return (f"衝突回避: tick {self.ticks}回, 近くの組 平均 {self.pairs / max(self.ticks, 1):.1f}, "
+                f"避けた回数 {self.adjusted}回 (台×tick), 手前で抑えた回数 {self.held}回, "
+                f"前後を止めた回数 {self.stopped}回 (台×tick), "
+                f"最接近 {closest} (ぶつかる距離 {2 * self.radius})")
@@ -0,0 +1,300 @@
+import asyncio
+import struct
+from pathlib import Path
+
+import numpy as np
+from toio import MotorResponseCode
+
+from .clock import REAL_CLOCK, VirtualClock
+from .decode import POSITION_ID
+from .sim import SimApi
+
+# 記録の種類
+KIND_START = 0      # 記録を始めた時刻の印（流し直すときの時刻の起点）
+KIND_ID = 1         # IdInformation の通知（生データ）
+KIND_MOTOR = 2      # 送ったモーター指令（left, right, duration_ms を int16, int16, uint16 で）
+KIND_RESPONSE = 3   # モーターの通知（目標指定制御の応答など、生データ）
+
+# 1件分の記録（24バイト固定。ファイル全体を np.memmap でそのまま配列として読める）
+PAYLOAD_SIZE = 13   # PositionId の大きさ（これより長い通知は切り詰める）
+CAPTURE_DTYPE = np.dtype([
+    ("time", "<f8"),     # 単調増加時計の時刻 [s]
+    ("cube", "u1"),      # 何台目のキューブか
+    ("kind", "u1"),
+    ("length", "u1"),    # payload の有効な長さ
+    ("payload", "u1", (PAYLOAD_SIZE,)),
+])
+# ファイルの先頭（識別子 + 1件の大きさ）
+_MAGIC = b"TOIOCAP1"
+_HEADER = struct.Struct("<8sII")
+_MOTOR = struct.Struct("<hhH")
+
+
+def load_capture(path):
+    """ 記録ファイルをメモリマップで開き、CAPTURE_DTYPE の配列として返す（全体は読み込まない） """
+    path = Path(path)
+    with path.open("rb") as f:
+        magic, record_size, _ = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != _MAGIC or record_size != CAPTURE_DTYPE.itemsize:
+        raise ValueError(f"{path} は通知の記録ファイルではありません")
+    if path.stat().st_size == _HEADER.size:
+        return np.zeros(0, CAPTURE_DTYPE)
+    return np.memmap(path, CAPTURE_DTYPE, mode="r", offset=_HEADER.size)
+
+
+def payload_of(record):
+    return bytearray(record["payload"][:record["length"]].tobytes())
+
+
+def motor_commands(capture, cube=0):
+    """ 記録からモーター指令だけを (時刻, left, right) の配列 (n, 3) にして返す """
+    records = capture[(capture["kind"] == KIND_MOTOR) & (capture["cube"] == cube)]
+    commands = np.empty((len(records), 3))
+    commands[:, 0] = records["time"]
+    raw = np.ascontiguousarray(records["payload"][:, :4]).view("<i2").reshape(-1, 2)
+    commands[:, 1:] = raw
+    return commands
+
+
+class _RecordingMotor:
+    """ cube.api.motor の代わりに置き、送ったモーター指令を記録してから本物に渡す """
+
+    def __init__(self, motor, recorder, index):
+        self._motor = motor
+        self._recorder = recorder
+        self._index = index
+
+    async def motor_control(self, left, right, duration_ms=None):
+        self._recorder.record(KIND_MOTOR, _MOTOR.pack(int(left), int(right), duration_ms or 0), self._index)
+        if duration_ms is None:
+            return await self._motor.motor_control(left, right)
+        return await self._motor.motor_control(left, right, duration_ms)
+
+    def __getattr__(self, name):
+        # 目標指定制御やハンドラの登録などはそのまま本物へ
+        return getattr(self._motor, name)
+
+
+class CaptureRecorder:
+    """
+    ID通知の生データと送ったモーター指令を、時刻付きの固定長レコードとしてファイルに追記する記録係。
+
+    レコードはメモリ上のバッファに貯め、いっぱいになったらまとめて書き出す。
+    記録は load_capture() でメモリマップとして開け、ReplayCube でそのまま流し直せる。
+
+    >>> recorder = CaptureRecorder("logs/run1/capture.bin")
+    >>> await recorder.attach(cube)   # 以後の通知と cube.api.motor への指令を記録する
+    >>> ...
+    >>> await recorder.detach()
+    """
+
+    def __init__(self, path, clock=REAL_CLOCK, buffer_records=4096):
+        self.path = Path(path)
+        self.clock = clock
+        self._buffer = np.zeros(buffer_records, CAPTURE_DTYPE)
+        self._n = 0
+        self._file = None
+        self._attached = []  # (cube, 元の motor, ID のハンドラ, モーターのハンドラ)
+        self.records = 0
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("wb")
+        self._file.write(_HEADER.pack(_MAGIC, CAPTURE_DTYPE.itemsize, 0))
+
+    def record(self, kind, payload, cube=0):
+        """ 1件記録する（payload は PAYLOAD_SIZE バイトまで） """
+        row = self._buffer[self._n]
+        row["time"] = self.clock.now()
+        row["cube"] = cube
+        row["kind"] = kind
+        n = min(len(payload), PAYLOAD_SIZE)
+        row["length"] = n
+        row["payload"][:n] = np.frombuffer(bytes(payload[:n]), np.uint8)
+        row["payload"][n:] = 0
+        self._n += 1
+        self.records += 1
+        if self._n == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        if self._file is None:
+            self.open()
+        self._file.write(self._buffer[:self._n].tobytes())
+        self._file.flush()
+        self._n = 0
+
+    async def attach(self, cube, index=0):
+        """ cube の ID 通知とモーターの通知を記録し、cube.api.motor を記録付きのものに差し替える """
+        if self._file is None:
+            self.open()
+
+        def on_id(payload):
+            self.record(KIND_ID, payload, index)
+
+        def on_motor(payload):
+            self.record(KIND_RESPONSE, payload, index)
+
+        motor = cube.api.motor
+        await cube.api.id_information.register_notification_handler(on_id)
+        await motor.register_notification_handler(on_motor)
+        cube.api.motor = _RecordingMotor(motor, self, index)
+        self._attached.append((cube, motor, on_id, on_motor))
+        self.record(KIND_START, b"", index)
+
+    async def detach(self):
+        """ 差し替えを元に戻し、残りを書き出してファイルを閉じる """
+        for cube, motor, on_id, on_motor in self._attached:
+            cube.api.motor = motor
+            await cube.api.id_information.unregister_notification_handler(on_id)
+            await motor.unregister_notification_handler(on_motor)
+        self._attached = []
+        self.close()
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+
+class ReplayCube:
+    """
+    記録した ID 通知を、記録したときの間隔で流し直す ToioCoreCube の代わり。
+
+    スクリプトの run(cube, clock) にそのまま渡せる。送られたモーター指令は commands に
+    (時刻, left, right) で残るので、記録したときの指令と比べられる（compare_commands）。
+    時計が VirtualClock なら、シミュレーターと同じく時計に attach して tick ごとに通知を流す
+    （待ち時間なしで、結果は毎回同じ）。REAL_CLOCK なら記録した速さで流す。
+    座標は記録のままなので、指令を変えてもキューブの動きは変わらない（開ループ）。
+    目標指定制御には対応していない（ERROR_NOT_SUPPORTED を返す）。
+
+    >>> capture = load_capture("logs/run1/capture.bin")
+    >>> cube = ReplayCube(capture)
+    >>> async with cube:
+    >>>     await script.run(cube, cube.clock)
+    """
+
+    def __init__(self, capture, clock=None, cube=0):
+        ids = capture[(capture["kind"] == KIND_ID) & (capture["cube"] == cube)]
+        self._ids = ids
+        self._times = ids["time"].tolist()  # 比較を速くするため時刻だけは先に読む
+        # 記録を始めた時刻から流す（スクリプトの待ち時間の起点を記録のときと揃える）
+        start = float(capture["time"][0]) if len(capture) else 0.0
+        self.clock = clock if clock is not None else VirtualClock(start=start)
+        self._offset = self.clock.now() - start  # 記録の時刻 → 時計の時刻
+        self.api = SimApi(self)
+        self.indicator = None
+        self.write_latency = 0.0
+        self.multiple_targets = False
+        self.commands = []
+        self.motor_writes = 0
+        self.notifications = 0
+        self._last_payload = None
+        self._next = 0        # 次に流す通知
+        self._done_at = None  # 最後の通知を流した時刻
+        self._feeder = None
+        self._attached = False
+        self.finished = None  # 記録を流し終えたら完了する future
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        self.finished = loop.create_future()
+        if hasattr(self.clock, "attach"):
+            # 仮想時計：シミュレーターと同じく、時計が進むたびに advance() で通知を流す
+            self.clock.attach(self)
+            self._attached = True
+        else:
+            self._feeder = loop.create_task(self._feed())
+        return True
+
+    async def disconnect(self):
+        if self._attached:
+            self.clock.detach(self)
+            self._attached = False
+        if self._feeder is not None:
+            self._feeder.cancel()
+            self._feeder = None
+        return True
+
+    def is_connect(self):
+        return self._attached or self._feeder is not None
+
+    def set_id_notification(self, interval_ms, condition):
+        pass  # 通知は記録したときの間隔のまま流す
+
+    def advance(self, dt):
+        """ 仮想時計から呼ばれる。今の時刻までに記録された通知を流す """
+        now = self.clock.now() - self._offset
+        times = self._times
+        while self._next < len(times) and times[self._next] <= now + 1e-9:
+            self._deliver(self._ids[self._next])
+            self._next += 1
+        if self._next == len(times):
+            if self._done_at is None:
+                self._done_at = now
+            # 最後の通知を受け取ったハンドラが動けるように1周期だけ待ってから終える
+            elif now - self._done_at >= 0.05 and not self.finished.done():
+                self.finished.set_result(None)
+                self.clock.detach(self)
+                self._attached = False
+
+    async def _feed(self):
+        try:
+            for record in self._ids:
+                wait = float(record["time"]) + self._offset - self.clock.now()
+                if wait > 0:
+                    await self.clock.sleep(wait)
+                self._deliver(record)
+            await self.clock.sleep(0.05)
+        finally:
+            if not self.finished.done():
+                self.finished.set_result(None)
+
+    def _deliver(self, record):
+        payload = payload_of(record)
+        self._last_payload = payload
+        self.notifications += 1
+        self.api.id_information._notify(payload)
+
+    # --- SimApi から呼ばれる ---
+    def id_payload(self):
+        return self._last_payload if self._last_payload is not None else bytearray((POSITION_ID,))
+
+    def set_motor(self, left, right, duration_ms=None):
+        self.commands.append((self.clock.now() - self._offset, left, right))
+        self.motor_writes += 1
+
+    def start_targets(self, response, timeout, movement_type, speed, targets):
+        self.respond(response, MotorResponseCode.ERROR_NOT_SUPPORTED)
+
+    def respond(self, response, code):
+        self.api.motor._notify(bytearray((response, 0, code.value)))
+
+
+def compare_commands(recorded, replayed):
+    """
+    記録したときの指令と流し直したときの指令 ((n, 3): 時刻, left, right) を比べる。
+    流し直した指令それぞれについて、同じ時刻に効いていた記録の指令との差を取る。
+    """
+    recorded = np.asarray(recorded, dtype=float).reshape(-1, 3)
+    replayed = np.asarray(replayed, dtype=float).reshape(-1, 3)
+    summary = {"recorded": len(recorded), "replayed": len(replayed), "max_diff": 0.0, "mean_diff": 0.0}
+    if len(recorded) == 0 or len(replayed) == 0:
+        return summary
+    index = np.searchsorted(recorded[:, 0], replayed[:, 0] + 1e-9, side="right") - 1
+    valid = index >= 0
+    if not valid.any():
+        return summary
+    diff = np.abs(replayed[valid, 1:] - recorded[index[valid], 1:]).max(axis=1)
+    summary["max_diff"] = float(diff.max())
+    summary["mean_diff"] = float(diff.mean())
+    return summary
@@ -0,0 +1,112 @@
+import time
+
+_STARTED = time.monotonic()  # CLI を読み込み始めた時刻（起動時間の起点。REAL_CLOCK と同じ時計）
+
+import argparse
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+# --- 設定 ---
+# 番号付きスクリプトのある場所（リポジトリ直下）。toio コマンドは、--scripts / 環境変数 TOIO_SCRIPTS、
+# 今いるディレクトリ、パッケージの隣（uv sync の編集可能インストール）の順に探す
+SCRIPT_DIR = Path(__file__).resolve().parent.parent
+SCRIPT_DIR_ENV = "TOIO_SCRIPTS"
+# サブコマンド -> (スクリプト, 説明)
+COMMANDS = {
+    "connect": ("connect_test.py", "接続テスト（LEDを赤く点灯）"),
+    "position": ("1_position.py", "座標と角度を表示し続ける"),
+    "p-control": ("2_p_control.py", "P制御で目標地点へ移動"),
+    "pid": ("3_pid_control.py", "PID制御で目標地点へ移動"),
+    "travel": ("4_traveling.py", "経由点を巡回してログとグラフを残す"),
+    "obstacle": ("5_obstacle.py", "障害物を避けてゴールへ移動"),
+    "fleet": ("7_fleet.py", "複数台で隊列を組む"),
+}
+# スクリプトの読み込み（import）にかけてよい時間 [ms]。超えたら --import-only が失敗を返す
+IMPORT_BUDGET_MS = 100
+
+
+def load_script(path, prefix="_script_"):
+    """ 数字で始まるスクリプトを毎回新しいモジュールとして読み込む（グローバル変数を初期化するため） """
+    path = Path(path)
+    spec = importlib.util.spec_from_file_location(f"{prefix}{path.stem}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def find_script(name, script_dir=None):
+    """ サブコマンドのスクリプトを探してパスを返す。見つからなければ None """
+    candidates = [script_dir or os.environ.get(SCRIPT_DIR_ENV), Path.cwd(), SCRIPT_DIR]
+    for directory in candidates:
+        if directory:
+            path = Path(directory) / COMMANDS[name][0]
+            if path.exists():
+                return path
+    return None
+
+
+def load_command(name, script_dir=None):
+    """ サブコマンドのスクリプトを読み込む（numpy や toio はここで初めて読み込まれる） """
+    path = find_script(name, script_dir)
+    if path is None:
+        raise FileNotFoundError(f"{COMMANDS[name][0]} が見つかりません")
+    return load_script(path)
+
+
+def startup_report(cli_ms, import_ms):
+    """ 起動の段階ごとの時間（接続と最初のモーター指令は ConnectionManager の記録から） """
+    text = f"起動時間: CLI {cli_ms:.0f}ms, スクリプト読み込み {import_ms:.0f}ms (予算 {IMPORT_BUDGET_MS}ms)"
+    connection = sys.modules.get("toio_control.connection")
+    manager = connection.ConnectionManager.last if connection is not None else None
+    if manager is None:
+        return text
+    text += f", 接続 {manager.timings.get('total', 0.0):.2f}s"
+    first = [link.first_write_at for link in manager.links if link.first_write_at is not None]
+    if first:
+        text += f", 最初のモーター指令まで {min(first) - _STARTED:.2f}s"
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="toio", description="toioコアキューブの制御スクリプトを実行します")
+    parser.add_argument("--timing", action="store_true",
+                        help="終了時に起動時間（読み込み・接続・最初のモーター指令まで）を表示する")
+    parser.add_argument("--scripts", type=Path, metavar="DIR",
+                        help=f"番号付きスクリプトのあるディレクトリ（既定は環境変数 {SCRIPT_DIR_ENV}、今いる所、パッケージの隣）")
+    parser.add_argument("--import-only", action="store_true",
+                        help="スクリプトを読み込むだけで終わり、読み込み時間を予算と比べる（接続しない）")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for name, (script, help_text) in COMMANDS.items():
+        commands.add_parser(name, help=f"{help_text} ({script})")
+    args = parser.parse_args(argv)
+    path = find_script(args.command, args.scripts)
+    if path is None:
+        parser.error(f"{COMMANDS[args.command][0]} が見つかりません（リポジトリの中で実行するか、"
+                     f"--scripts か {SCRIPT_DIR_ENV} でスクリプトのあるディレクトリを指定してください）")
+
+    loaded = time.monotonic()
+    script = load_script(path)
+    import_ms = (time.monotonic() - loaded) * 1000
+    cli_ms = (loaded - _STARTED) * 1000
+    if args.import_only:
+        over = import_ms > IMPORT_BUDGET_MS
+        print(f"{args.command}: 読み込み {import_ms:.0f}ms (予算 {IMPORT_BUDGET_MS}ms)"
+              f"{' 超過' if over else ''}")
+        return 1 if over else 0
+
+    import asyncio  # スクリプトがどうせ読み込むので、--help などでは読み込まない
+
+    try:
+        asyncio.run(script.main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.timing:
+            print(startup_report(cli_ms, import_ms))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class RealClock:
+    """ 実機用の時計（単調増加時計 + asyncio.sleep） """
+
+    def now(self):
+        return time.monotonic()
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+# スクリプトが時計を指定しないときに使う共通インスタンス
+REAL_CLOCK = RealClock()
+
+
+class VirtualClock:
+    """
+    シミュレーター用の仮想時計。
+
+    sleep() は実時間を待たずに仮想時刻を進める。
+    attach() されたシミュレーター（advance(dt) を持つオブジェクト）は
+    tick ごとに進められるので、誰も sleep していなくても時間は流れる。
+    """
+
+    # 仮想時刻を進める前に、起きたタスクへ処理を回す回数
+    SETTLE_YIELDS = 2
+
+    def __init__(self, tick=0.005, start=0.0):
+        self.tick = tick
+        self._now = start
+        self._sleepers = []  # (起床時刻, 連番, future) のヒープ
+        self._seq = itertools.count()
+        self._worlds = []
+        self._runner = None
+        self.steps = 0  # 進めた tick の数
+
+    def now(self):
+        return self._now
+
+    async def sleep(self, seconds):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        heapq.heappush(self._sleepers, (self._now + max(seconds, 0.0), next(self._seq), fut))
+        self._ensure_runner()
+        await fut
+
+    def attach(self, world):
+        """ 時間とともに進めるシミュレーターを登録する """
+        self._worlds.append(world)
+        self._ensure_runner()
+
+    def detach(self, world):
+        if world in self._worlds:
+            self._worlds.remove(world)
+
+    def _ensure_runner(self):
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._sleepers or self._worlds:
+            # 直前に起こしたタスクが次の sleep を登録するまで待つ
+            for _ in range(self.SETTLE_YIELDS):
+                await asyncio.sleep(0)
+
+            # キャンセルされた sleep は捨てる
+            while self._sleepers and self._sleepers[0][2].done():
+                heapq.heappop(self._sleepers)
+            if not (self._sleepers or self._worlds):
+                break
+
+            # 次に進める幅を決める（シミュレーターがなければ次の起床時刻まで一気に飛ぶ）
+            if self._sleepers:
+                until_next = max(self._sleepers[0][0] - self._now, 0.0)
+            else:
+                until_next = self.tick
+            dt = min(self.tick, until_next) if self._worlds else until_next
+
+            if dt > 0:
+                self._now += dt
+                self.steps += 1
+                for world in list(self._worlds):
+                    world.advance(dt)
+
+            # 起床時刻になったタスクを起こす（同時刻のものはまとめて）
+            while self._sleepers and self._sleepers[0][0] <= self._now + 1e-12:
+                _, _, fut = heapq.heappop(self._sleepers)
+                if not fut.done():
+                    fut.set_result(None)
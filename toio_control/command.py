@@ -0,0 +1,104 @@
+from .clock import REAL_CLOCK
+from .model import MOTOR_DEAD_ZONE
+
+# 前回送った値との差がこれ以下なら送らない（左右それぞれ）
+DEFAULT_DEADBAND = 2
+# 同じ指令でもこの時間 [s] 送っていなければ送り直す（書き込みの取りこぼし対策。None なら送り直さない）
+DEFAULT_REFRESH_INTERVAL = 1.0
+
+
+class MotorCommander:
+    """
+    cube.api.motor の前に置く、モーター指令の間引き係。
+
+    - 前回送った指令と同じ・deadband 以内の指令は送らない（suppressed に数える）。
+      ただし、どちらかの車輪が止まる／動き出す変化（0 との行き来、不感帯 MOTOR_DEAD_ZONE の出入り）は必ず送る
+    - 書き込み中に来た指令は最新の1件だけ残し、書き込みが終わったら送る（coalesced に数える）
+    - 同じ指令が続いても refresh_interval ごとに1回だけ送り直す
+    停止 (0, 0) への切り替えと duration_ms 付きの指令は必ず送る。
+
+    >>> motor = MotorCommander(cube.api.motor)
+    >>> await motor.motor_control(left, right)  # cube.api.motor と同じ呼び方
+    """
+
+    def __init__(self, motor, clock=REAL_CLOCK, deadband=DEFAULT_DEADBAND,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.motor = motor
+        self.clock = clock
+        self.deadband = deadband
+        self.refresh_interval = refresh_interval
+        self.last_sent = None     # 最後に送った (left, right)
+        self.last_sent_at = None
+        self._pending = None      # 書き込み中に来た指令 (left, right, duration_ms)
+        self._writing = False
+        self.sent = 0
+        self.suppressed = 0
+        self.coalesced = 0
+
+    @property
+    def queued(self):
+        """ 書き込み中に来て、あとで送るために預かっている指令があるか """
+        return self._pending is not None
+
+    def needs_send(self, left, right):
+        """ (left, right) を送る必要があるか（前回との差と送り直しの時刻で判断する） """
+        last = self.last_sent
+        if last is None:
+            return True
+        if (left, right) == (0, 0):
+            return last != (0, 0)
+        if abs(left - last[0]) > self.deadband or abs(right - last[1]) > self.deadband:
+            return True
+        if _starts_or_stops(left, last[0]) or _starts_or_stops(right, last[1]):
+            return True
+        return (self.refresh_interval is not None
+                and self.clock.now() - self.last_sent_at >= self.refresh_interval)
+
+    async def motor_control(self, left, right, duration_ms=None):
+        """
+        必要なときだけ書き込み、実際に書き込んだ回数を返す。間引いたか書き込み中で預けたら 0。
+        預けた指令は今の書き込みが終わったところで送るので、その分は書き込んでいる側の回数に入る
+        （0 のとき、預けたかどうかは queued で分かる）。
+        """
+        if duration_ms is None and not self.needs_send(left, right):
+            self.suppressed += 1
+            return 0
+        if self._writing:
+            # 送信中の書き込みが終わったら、最新の1件だけを送る
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = (left, right, duration_ms)
+            return 0
+
+        self._writing = True
+        written = 0
+        try:
+            command = (left, right, duration_ms)
+            while command is not None:
+                await self._write(*command)
+                written += 1
+                command, self._pending = self._pending, None
+                if command is not None and command[2] is None and not self.needs_send(*command[:2]):
+                    self.suppressed += 1
+                    command = None
+        finally:
+            self._writing = False
+        return written
+
+    async def _write(self, left, right, duration_ms):
+        if duration_ms is None:
+            await self.motor.motor_control(left, right)
+        else:
+            await self.motor.motor_control(left, right, duration_ms)
+        # 時間指定の指令は途中で止まるので、次の指令は必ず送るようにしておく
+        self.last_sent = (left, right) if duration_ms is None else None
+        self.last_sent_at = self.clock.now()
+        self.sent += 1
+
+    def report(self):
+        return f"送信 {self.sent}回, 間引き {self.suppressed}回, まとめ {self.coalesced}回"
+
+
+def _starts_or_stops(value, last):
+    """ last から value への変化で、車輪が止まる／動き出すか（差が deadband 以内でも効きが変わる） """
+    return (value == 0) != (last == 0) or (abs(value) < MOTOR_DEAD_ZONE) != (abs(last) < MOTOR_DEAD_ZONE)
@@ -0,0 +1,308 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+
+from toio import BLEScanner, ToioCoreCube
+from toio.device_interface.ble import BleCube
+
+from .clock import REAL_CLOCK
+
+# 接続できたキューブのアドレスの保存先（リポジトリ直下。PCごとに違うので git には入れない）
+ADDRESS_CACHE = Path(__file__).resolve().parent.parent / "cube_addresses.json"
+# 覚えておくアドレスの数（新しく接続したものから残す）
+MAX_CACHED = 16
+
+SCAN_TIMEOUT = 5.0      # スキャンの制限時間 [s]
+CONNECT_TIMEOUT = 5.0   # アドレスを指定した直接接続の制限時間 [s]（全部まとめて。つながらなければスキャンに回す）
+WATCH_INTERVAL = 0.5    # 切断を確かめる間隔 [s]
+RECONNECT_DELAYS = (0.5, 1.0, 2.0, 5.0)  # つなぎ直しに失敗したときの待ち時間 [s]（最後の値を繰り返す）
+
+# 起動時の段階（timings のキー）
+PHASE_CACHE = "cache"      # キャッシュの読み込み
+PHASE_DIRECT = "direct"    # 覚えているアドレスへの直接接続
+PHASE_SCAN = "scan"        # 足りない分のスキャン
+PHASE_CONNECT = "connect"  # スキャンで見つけたキューブへの接続
+PHASE_TOTAL = "total"
+PHASE_NAMES = {PHASE_CACHE: "キャッシュ読み込み", PHASE_DIRECT: "直接接続", PHASE_SCAN: "スキャン",
+               PHASE_CONNECT: "スキャン後の接続", PHASE_TOTAL: "合計"}
+
+
+def load_addresses(path=ADDRESS_CACHE):
+    """ 覚えているキューブ {アドレス: 名前} を新しい順に返す。ファイルがなければ空の dict """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    data = json.loads(path.read_text(encoding="utf-8"))
+    return {entry["address"]: entry.get("name") for entry in data.get("cubes", [])}
+
+
+def save_addresses(entries, path=ADDRESS_CACHE):
+    """ [{"address", "name"}, ...] を先頭に、前から覚えているものを後ろに足して書き出す """
+    path = Path(path)
+    old = json.loads(path.read_text(encoding="utf-8")).get("cubes", []) if path.exists() else []
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    cubes = [dict(entry, last_connected=now) for entry in entries]
+    known = {entry["address"] for entry in cubes}
+    cubes += [entry for entry in old if entry["address"] not in known]
+    path.write_text(json.dumps({"cubes": cubes[:MAX_CACHED]}, indent=2, ensure_ascii=False) + "\n",
+                    encoding="utf-8")
+
+
+def address_of(cube):
+    """ 接続に使った BLE アドレス（BleCube 以外では None） """
+    client = getattr(cube.interface, "device", None)
+    return getattr(client, "address", None)
+
+
+async def _drop_client(interface, timeout):
+    """ 接続できなかった BleCube のクライアントを切断する（途中まで接続していても残さない。失敗は無視） """
+    interface.connected = False
+    try:
+        await asyncio.wait_for(interface.device.disconnect(), timeout)
+    except Exception:
+        pass
+
+
+class _GuardedMotor:
+    """
+    cube.api.motor の代わりに置き、切断中の指令は送らずに捨てる（制御ループを止めない）。
+    書き込みで例外が出たら、その場で切断とみなしてつなぎ直しを頼む。
+    """
+
+    def __init__(self, motor, link):
+        self._motor = motor
+        self._link = link
+
+    async def motor_control(self, left, right, duration_ms=None):
+        link = self._link
+        if not link.connected:
+            link.dropped_writes += 1
+            return None
+        try:
+            if link.first_write_at is None:
+                link.first_write_at = time.monotonic()
+            if duration_ms is None:
+                return await self._motor.motor_control(left, right)
+            return await self._motor.motor_control(left, right, duration_ms)
+        except Exception as e:
+            link.dropped_writes += 1
+            link.lost(e)
+            return None
+
+    def __getattr__(self, name):
+        return getattr(self._motor, name)
+
+
+class CubeLink:
+    """ 1台分の接続の状態（切断の見張りとつなぎ直し） """
+
+    def __init__(self, cube, index, address, name=None):
+        self.cube = cube
+        self.index = index
+        self.address = address
+        self.name = name
+        self.connected = True
+        self.reconnects = 0        # つなぎ直せた回数
+        self.reconnect_time = 0.0  # つなぎ直しにかかった合計時間 [s]
+        self.dropped_writes = 0    # 切断中に捨てたモーター指令
+        self.first_write_at = None  # 最初のモーター指令を送った時刻（time.monotonic()）
+        self._lost = asyncio.Event()  # 切断に気づいたら set する
+
+    def lost(self, reason=None):
+        if self.connected:
+            print(f"[{self.index}] 接続が切れました{f': {reason}' if reason else ''}")
+        self.connected = False
+        self._lost.set()
+
+
+class ConnectionManager:
+    """
+    キューブへの接続係。
+
+    前回接続できたアドレスを ADDRESS_CACHE に覚えておき、次からはスキャンせずに直接つなぐ
+    （見つからなかった分だけスキャンする）。複数台の接続は並行に進める。
+    接続が切れたら、プログラムを止めずに裏でつなぎ直す（通知のハンドラは登録したまま戻る）。
+    起動の段階ごとにかかった時間は timings に残る（report() で表示）。
+
+    >>> async with ConnectionManager(2) as cubes:
+    >>>     print(cubes.report())
+    >>>     await run(cubes)       # cubes[0], cubes[1] は ToioCoreCube
+    """
+
+    last = None  # 最後に接続を始めた ConnectionManager（CLI の --timing が起動時間の表示に使う）
+
+    def __init__(self, count=1, addresses=(), cache_path=ADDRESS_CACHE, clock=REAL_CLOCK,
+                 scan_timeout=SCAN_TIMEOUT, connect_timeout=CONNECT_TIMEOUT, reconnect=True):
+        self.count = count
+        self.addresses = [a for a in addresses if a]  # 最初に試すアドレス（キャッシュより優先）
+        self.cache_path = cache_path                  # None ならキャッシュを使わない
+        self.clock = clock
+        self.scan_timeout = scan_timeout
+        self.connect_timeout = connect_timeout
+        self.reconnect = reconnect
+        self.links = []
+        self.timings = {}  # 段階 -> かかった時間 [s]
+        self._watchers = []
+
+    # --- キューブの一覧として使う ---
+    def __len__(self):
+        return len(self.links)
+
+    def __getitem__(self, index):
+        return self.links[index].cube
+
+    def __iter__(self):
+        return (link.cube for link in self.links)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    # --- 接続 ---
+    async def connect(self):
+        """ count 台そろうまで、覚えているアドレス → スキャンの順に接続する """
+        ConnectionManager.last = self
+        started = self.clock.now()
+
+        phase = self.clock.now()
+        known = load_addresses(self.cache_path) if self.cache_path is not None else {}
+        candidates = {address: known.get(address) for address in self.addresses}
+        candidates.update((address, name) for address, name in known.items() if address not in candidates)
+        self.timings[PHASE_CACHE] = self.clock.now() - phase
+
+        if candidates:
+            phase = self.clock.now()
+            await self._connect_direct(candidates)
+            self.timings[PHASE_DIRECT] = self.clock.now() - phase
+
+        if len(self.links) < self.count:
+            phase = self.clock.now()
+            found = await BLEScanner.scan(self.count - len(self.links), timeout=self.scan_timeout)
+            self.timings[PHASE_SCAN] = self.clock.now() - phase
+            known = {link.address for link in self.links}
+            found = [info for info in found if info.device.address not in known]
+            phase = self.clock.now()
+            cubes = [ToioCoreCube(interface=info.interface, name=info.name)
+                     for info in found[:self.count - len(self.links)]]
+            results = await asyncio.gather(*(cube.connect() for cube in cubes), return_exceptions=True)
+            for cube, result in zip(cubes, results):
+                if result is True:
+                    self._add(cube, address_of(cube), cube.name)
+            self.timings[PHASE_CONNECT] = self.clock.now() - phase
+
+        self.timings[PHASE_TOTAL] = self.clock.now() - started
+        if len(self.links) < self.count:
+            await self.disconnect()
+            raise ConnectionError(f"{self.count}台のうち{len(self.links)}台しか接続できませんでした")
+        if self.cache_path is not None:
+            save_addresses([{"address": link.address, "name": link.name} for link in self.links],
+                           self.cache_path)
+        if self.reconnect:
+            loop = asyncio.get_running_loop()
+            self._watchers = [loop.create_task(self._watch(link)) for link in self.links]
+        return True
+
+    async def _connect_direct(self, candidates):
+        """
+        {アドレス: 名前} のキューブ全部に、アドレスを指定して並行に接続する。
+        制限時間 connect_timeout はまとめて1回分で、count 台つながった時点で残りは打ち切る。
+        つながったものが多ければ新しいもの（candidates の前）から使い、それ以外は切断しておく。
+        """
+        cubes = {address: ToioCoreCube(interface=BleCube(address), name=name)
+                 for address, name in candidates.items()}
+        tasks = {asyncio.ensure_future(cube.connect()): address for address, cube in cubes.items()}
+        need = self.count - len(self.links)
+        connected = set()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.connect_timeout
+        pending = set(tasks)
+        while pending and len(connected) < need:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None and task.result():
+                    connected.add(tasks[task])
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        used = [address for address in candidates if address in connected][:need]
+        for address in used:
+            self._add(cubes[address], address, cubes[address].name)
+        # 時間切れ・失敗・余った分は、つながりかけたまま残さないように切っておく
+        await asyncio.gather(*(_drop_client(cube.interface, self.connect_timeout)
+                               for address, cube in cubes.items() if address not in used))
+
+    def _add(self, cube, address, name):
+        link = CubeLink(cube, len(self.links), address, name)
+        cube.api.motor = _GuardedMotor(cube.api.motor, link)
+        self.links.append(link)
+
+    async def disconnect(self):
+        for watcher in self._watchers:
+            watcher.cancel()
+        await asyncio.gather(*self._watchers, return_exceptions=True)
+        self._watchers = []
+        await asyncio.gather(*(link.cube.disconnect() for link in self.links if link.connected),
+                             return_exceptions=True)
+
+    # --- 切断の見張りとつなぎ直し ---
+    async def _watch(self, link):
+        while True:
+            # 切断は書き込みの失敗（lost()）か、定期的な is_connect() の確認で気づく
+            try:
+                await asyncio.wait_for(link._lost.wait(), WATCH_INTERVAL)
+            except asyncio.TimeoutError:
+                if link.cube.is_connect():
+                    continue
+                link.lost()
+            link._lost.clear()
+            await self._reconnect(link)
+
+    async def _reconnect(self, link):
+        """ 同じ api のままつなぎ直し、登録してあった通知を張り直す """
+        started = self.clock.now()
+        attempt = 0
+        while True:
+            try:
+                interface = link.cube.interface
+                interface.connected = False  # BleCube は切れたことを知らないので、接続できる状態に戻す
+                if await asyncio.wait_for(interface.connect(), self.connect_timeout):
+                    await self._resubscribe(link.cube)
+                    break
+            except Exception:
+                # 時間切れで残ったクライアントが次の接続の邪魔をしないように切っておく
+                await _drop_client(interface, self.connect_timeout)
+            await self.clock.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+            attempt += 1
+        link.connected = True
+        link.reconnects += 1
+        elapsed = self.clock.now() - started
+        link.reconnect_time += elapsed
+        print(f"[{link.index}] つなぎ直しました ({elapsed:.1f}s)")
+
+    @staticmethod
+    async def _resubscribe(cube):
+        # 切断で止まった通知を、ハンドラが登録されている特性の分だけ開始し直す
+        for characteristic in vars(cube.api).values():
+            if getattr(characteristic, "notification_handler_is_registered", False):
+                await characteristic._register_notification_handler(
+                    characteristic._root_notification_handler)
+
+    # --- 計測 ---
+    def report(self):
+        parts = [f"{PHASE_NAMES[phase]} {seconds:.2f}s" for phase, seconds in self.timings.items()]
+        text = f"{len(self)}台接続 ({', '.join(parts)})"
+        for link in self.links:
+            text += f"\n  [{link.index}] {link.name or '?'} {link.address}"
+            if link.reconnects or link.dropped_writes:
+                text += (f", つなぎ直し {link.reconnects}回 (合計 {link.reconnect_time:.1f}s), "
+                         f"切断中に捨てた指令 {link.dropped_writes}回")
+        return text
@@ -0,0 +1,143 @@
+import hashlib
+import math
+from pathlib import Path
+
+import numpy as np
+
+from .model import MAT_BOUNDS
+
+# 表の1マスの大きさ [マット単位]
+DEFAULT_RESOLUTION = 2.0
+# 線分の判定で1回に進む最小の距離（マスの大きさに対する割合）
+MIN_STEP_RATIO = 0.25
+
+
+class CostMap:
+    """
+    マット全体の符号付き距離場（SDF）。各マスの中心から一番近い障害物の縁までの距離を持つ
+    （障害物の内側は負）。通れないマス（占有グリッド）は距離が 0 以下のマス。
+
+    障害物の配置から NumPy で1回だけ作り、配置が変わったときだけ作り直す。
+    cache_dir を渡すと作った表をディスクに保存し、同じ配置なら次からは読み込むだけで済む。
+    ObstacleSet と同じ is_path_blocked / contains / inflated を持つので、PathPlanner にそのまま渡せる。
+
+    >>> costmap = CostMap.load_or_build(obstacles, cache_dir="costmaps")
+    >>> costmap.clearance(x, y)                      # 一番近い障害物の縁までの距離（表の補間）
+    >>> costmap.is_path_blocked(ax, ay, bx, by, 30)  # 距離の分ずつ進むレイマーチ
+    """
+
+    def __init__(self, sdf, key, bounds=MAT_BOUNDS, resolution=DEFAULT_RESOLUTION):
+        self.sdf = np.asarray(sdf, dtype=np.float32)
+        self.key = key  # 元の障害物と同じ識別子（経路のキャッシュのキーに使う）
+        self.x0, self.y0 = bounds[0], bounds[1]
+        self.bounds = tuple(bounds)
+        self.resolution = float(resolution)
+        self.height, self.width = self.sdf.shape
+        self.occupancy = self.sdf <= 0
+        # 表の補間で距離を多めに見積もる分の上限（マスの中心からマスの角までの距離）。
+        # 通れるかどうかの判定ではこの分を引き、ObstacleSet より甘くならないようにする
+        self.slack = self.resolution * math.sqrt(2) / 2
+        # 距離の勾配（障害物から離れる向き）も先に求めておく
+        self.grad_y, self.grad_x = np.gradient(self.sdf, self.resolution)
+
+    # --- 作る・保存する ---
+    @classmethod
+    def build(cls, obstacles, bounds=MAT_BOUNDS, resolution=DEFAULT_RESOLUTION):
+        """ ObstacleSet から距離場を計算する """
+        x0, y0, x1, y1 = bounds
+        width = math.ceil((x1 - x0) / resolution)
+        height = math.ceil((y1 - y0) / resolution)
+        xs = x0 + (np.arange(width) + 0.5) * resolution
+        ys = (y0 + (np.arange(height) + 0.5) * resolution)[:, None]
+        # 障害物がなければマットの対角線の長さ（どこまで行っても当たらない）
+        sdf = np.full((height, width), math.hypot(x1 - x0, y1 - y0), dtype=np.float32)
+        for (cx, cy), r in zip(obstacles.centers, obstacles.radii):
+            np.minimum(sdf, np.hypot(xs - cx, ys - cy) - r, out=sdf, casting="unsafe")
+        return cls(sdf, obstacles.key, bounds, resolution)
+
+    @staticmethod
+    def cache_path(obstacles, cache_dir, bounds=MAT_BOUNDS, resolution=DEFAULT_RESOLUTION):
+        """ 障害物の配置・範囲・マスの大きさで決まるキャッシュファイルの場所 """
+        name = hashlib.sha1(f"{obstacles.key}:{tuple(bounds)}:{resolution}".encode()).hexdigest()[:16]
+        return Path(cache_dir) / f"costmap_{name}.npz"
+
+    @classmethod
+    def load_or_build(cls, obstacles, cache_dir=None, bounds=MAT_BOUNDS, resolution=DEFAULT_RESOLUTION):
+        """ キャッシュがあれば読み込み、なければ作って保存する（cache_dir=None なら毎回作る） """
+        if cache_dir is None:
+            return cls.build(obstacles, bounds, resolution)
+        path = cls.cache_path(obstacles, cache_dir, bounds, resolution)
+        if path.exists():
+            try:
+                with np.load(path) as data:
+                    return cls(data["sdf"], obstacles.key, bounds, resolution)
+            except (OSError, ValueError, KeyError):
+                pass  # 壊れたキャッシュは作り直して上書きする
+        costmap = cls.build(obstacles, bounds, resolution)
+        costmap.save(path)
+        return costmap
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, sdf=self.sdf)
+
+    # --- 問い合わせ ---
+    def _locate(self, x, y):
+        # マスの中心を格子点とみなした座標（端の外は端の値を使う）
+        u = min(max((x - self.x0) / self.resolution - 0.5, 0.0), self.width - 1.0)
+        v = min(max((y - self.y0) / self.resolution - 0.5, 0.0), self.height - 1.0)
+        ix, iy = min(int(u), self.width - 2), min(int(v), self.height - 2)
+        return ix, iy, u - ix, v - iy
+
+    def _bilinear(self, grid, ix, iy, fx, fy):
+        top = grid[iy, ix] + (grid[iy, ix + 1] - grid[iy, ix]) * fx
+        bottom = grid[iy + 1, ix] + (grid[iy + 1, ix + 1] - grid[iy + 1, ix]) * fx
+        return float(top + (bottom - top) * fy)
+
+    def clearance(self, x, y):
+        """ 点 (x, y) から一番近い障害物の縁までの距離（内側なら負） """
+        return self._bilinear(self.sdf, *self._locate(x, y))
+
+    def gradient(self, x, y):
+        """ 距離が一番増える向き (gx, gy)。障害物から離れる向きで、長さはおよそ 1 """
+        cell = self._locate(x, y)
+        return self._bilinear(self.grad_x, *cell), self._bilinear(self.grad_y, *cell)
+
+    def sample(self, xs, ys):
+        """ 座標の配列で clearance をまとめて引く（xs, ys はブロードキャストできる形） """
+        u = np.clip((np.asarray(xs, dtype=float) - self.x0) / self.resolution - 0.5, 0.0, self.width - 1.0)
+        v = np.clip((np.asarray(ys, dtype=float) - self.y0) / self.resolution - 0.5, 0.0, self.height - 1.0)
+        ix = np.minimum(u.astype(np.intp), self.width - 2)
+        iy = np.minimum(v.astype(np.intp), self.height - 2)
+        fx, fy = u - ix, v - iy
+        sdf = self.sdf
+        top = sdf[iy, ix] + (sdf[iy, ix + 1] - sdf[iy, ix]) * fx
+        bottom = sdf[iy + 1, ix] + (sdf[iy + 1, ix + 1] - sdf[iy + 1, ix]) * fx
+        return top + (bottom - top) * fy
+
+    def inflated(self, xs, ys, margin):
+        """ 障害物を margin だけ膨らませて塗ったマス (len(ys), len(xs))。xs, ys はマスの中心の座標 """
+        return self.sample(np.asarray(xs)[None, :], np.asarray(ys)[:, None]) - self.slack < margin
+
+    def is_path_blocked(self, ax, ay, bx, by, margin=0.0):
+        """
+        線分 A→B が障害物から margin 以内を通るか。
+        その点の距離 - margin だけ進んでも当たらないので、空いている所は大きく飛ばして進む。
+        距離は補間の誤差 slack の分だけ少なめに見るので、ObstacleSet.is_path_blocked より甘くはならない。
+        """
+        length = math.hypot(bx - ax, by - ay)
+        ux, uy = ((bx - ax) / length, (by - ay) / length) if length > 0 else (0.0, 0.0)
+        min_step = self.resolution * MIN_STEP_RATIO
+        t = 0.0
+        while True:
+            free = self.clearance(ax + ux * t, ay + uy * t) - self.slack - margin
+            if free < 0:
+                return True
+            if t >= length:
+                return False
+            t = min(t + max(free, min_step), length)
+
+    def contains(self, x, y, margin=0.0):
+        """ 点 (x, y) がどれかの障害物の (半径 + margin) の内側にあるか """
+        return self.clearance(x, y) - self.slack < margin
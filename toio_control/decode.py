@@ -0,0 +1,57 @@
+import struct
+
+from toio import IdInformation, PositionIdMissed
+
+# IdInformation の先頭1バイト（データの種類）
+POSITION_ID = 0x01
+POSITION_ID_MISSED = 0x03
+
+# PositionId の先頭 (種類, 中心x, 中心y, 中心の角度) だけを読むレイアウト
+_POSITION_CENTER = struct.Struct("<xHHH")
+POSITION_ID_SIZE = 13  # PositionId 全体の長さ（センサーの座標と角度まで）[byte]
+
+
+class PoseRecord:
+    """
+    1台分の最新の座標を入れておく入れ物。
+    通知のたびに作り直さず、decode_id() が同じオブジェクトに上書きする。
+    """
+
+    __slots__ = ("x", "y", "angle", "seq", "on_mat", "received_at")
+
+    def __init__(self):
+        self.x = 0
+        self.y = 0
+        self.angle = 0
+        self.seq = 0            # PositionId を受け取るたびに1増える
+        self.on_mat = False     # 最後の通知がマット上の座標だったか
+        self.received_at = None # 最後に PositionId を受け取った時刻
+
+
+def decode_id(payload, pose, now=None):
+    """
+    IdInformation の生データを解析する。
+
+    PositionId なら PositionId オブジェクトを作らずに pose へ直接書き込み、pose を返す。
+    それ以外（StandardId, PositionIdMissed など）は従来どおり
+    IdInformation.is_my_data() の結果を返す。
+    空のデータや途中で切れたデータは捨てて None を返す（BLE のハンドラの中で例外にしない）。
+    """
+    if not payload:
+        return None
+    if payload[0] == POSITION_ID:
+        if len(payload) < POSITION_ID_SIZE:
+            return None
+        pose.x, pose.y, pose.angle = _POSITION_CENTER.unpack_from(payload)
+        pose.seq += 1
+        pose.on_mat = True
+        pose.received_at = now
+        return pose
+
+    try:
+        id_info = IdInformation.is_my_data(payload)
+    except (IndexError, struct.error):
+        return None
+    if isinstance(id_info, PositionIdMissed):
+        pose.on_mat = False
+    return id_info
@@ -0,0 +1,16 @@
+import numpy as np
+
+# toioのモーター指令値の範囲（-100〜100）
+MOTOR_LIMIT = 100
+
+
+def mix_wheels(outputs, limit=MOTOR_LIMIT):
+    """
+    PIDの出力 (n, 2: 前進, 旋回) を左右のモーター速度 (n, 2: left, right) に変換する。
+    結果は整数にして ±limit に収める。
+    """
+    outputs = np.asarray(outputs, dtype=float)
+    wheels = np.empty(outputs.shape)
+    np.add(outputs[:, 0], outputs[:, 1], out=wheels[:, 0])
+    np.subtract(outputs[:, 0], outputs[:, 1], out=wheels[:, 1])
+    return np.clip(wheels.astype(int), -limit, limit)
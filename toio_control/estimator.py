@@ -0,0 +1,205 @@
+import math
+from collections import deque
+
+from .geometry import get_angle_diff
+from .model import MAT_UNITS_PER_MM, MOTOR_TIME_CONSTANT, WHEEL_BASE_MM, speed_from_param
+
+# 通知が届くまでの遅れ [s]（座標は受信時刻よりこの分だけ前のもの）
+DEFAULT_NOTIFY_LATENCY = 0.02
+# 指令を送ってからモーターに効くまでの遅れ [s]（制御はこの分だけ先の姿勢で計算する）
+DEFAULT_COMMAND_LATENCY = 0.02
+
+# 推定の細かさ [s]（この刻みで運動モデルを進める）
+_PREDICT_STEP = 0.01
+
+
+class PoseEstimator:
+    """
+    1台分の姿勢の推定器（差動二輪の運動モデル + 相補フィルタ）。
+
+    - 送ったモーター指令から運動モデルで姿勢を進め、届いた座標でずれを補正する
+    - 座標は受信時刻より notify_latency だけ前のものとして扱い、
+      制御には command_latency だけ先の予測値を渡す
+    - PositionIdMissed の間は運動モデルだけで進め（推測航法）、不確かさ uncertainty を増やす
+    - 速度の推定値を返すので、PIDのD項を差分ではなく速度から計算できる
+
+    >>> estimator = PoseEstimator()
+    >>> estimator.measure(x, y, angle, received_at)  # 座標が届いたとき
+    >>> x, y, angle = estimator.predict(now)         # 制御するとき
+    >>> estimator.command(left, right, now)          # 指令を送ったとき
+    """
+
+    def __init__(self, notify_latency=DEFAULT_NOTIFY_LATENCY, command_latency=DEFAULT_COMMAND_LATENCY,
+                 position_gain=0.6, angle_gain=0.6, velocity_gain=0.05,
+                 position_noise=2.0, drift_rate=0.3, max_uncertainty=30.0):
+        self.notify_latency = notify_latency
+        self.command_latency = command_latency
+        # 相補フィルタの重み（1 なら座標をそのまま信じる）
+        self.position_gain = position_gain
+        self.angle_gain = angle_gain
+        self.velocity_gain = velocity_gain
+        # 不確かさ：座標が届いた直後は position_noise、推測航法では進んだ距離 × drift_rate ずつ増える
+        self.position_noise = position_noise
+        self.drift_rate = drift_rate
+        self.max_uncertainty = max_uncertainty
+
+        self.x = self.y = self.angle = 0.0
+        self.time = None             # 上の姿勢の時刻
+        self.wheel_left = 0.0        # モデル上の車輪速度 [単位/s]
+        self.wheel_right = 0.0
+        self.command_left = 0        # time の時点で効いている指令
+        self.command_right = 0
+        self._commands = deque()     # まだ効いていない指令 (効く時刻, left, right)
+        self.v_scale = 1.0           # 実測 / モデル の速度の比（補正分）
+        self.omega_scale = 1.0
+        self.uncertainty = math.inf  # 位置の不確かさ [マット単位]
+        self.on_mat = False
+        self.coasting = 0            # 推測航法で進めた回数
+        self._last_measure = None    # 前回の座標 (x, y, angle, 時刻)
+        self._predicted = (0.0, 0.0, 0.0)
+        self._predicted_velocity = (0.0, 0.0)
+
+    # --- 入力 ---
+    def measure(self, x, y, angle, received_at):
+        """ 座標が届いたとき（received_at は受信した時刻） """
+        t = received_at - self.notify_latency
+        if self.time is None:
+            self.x, self.y, self.angle, self.time = float(x), float(y), float(angle), t
+        else:
+            self._advance_to(t)
+            self.x += self.position_gain * (x - self.x)
+            self.y += self.position_gain * (y - self.y)
+            self.angle = (self.angle + self.angle_gain * get_angle_diff(angle, self.angle)) % 360
+            self._update_velocity(x, y, angle, t)
+        self._last_measure = (x, y, angle, t)
+        self.uncertainty = self.position_noise
+        self.on_mat = True
+
+    def missed(self, received_at):
+        """ PositionIdMissed が届いたとき（ここからは推測航法） """
+        self.on_mat = False
+        self._last_measure = None
+
+    def command(self, left, right, now):
+        """ モーター指令を送ったとき（モデルでは command_latency 後から新しい指令で動く） """
+        if not self.on_mat:
+            self._coast_to(now)  # 止めて待っている間も、効き終わった指令は溜めない
+        self._commands.append((now + self.command_latency, left, right))
+
+    # --- 出力 ---
+    def predict(self, now):
+        """ 指令が効く時刻（now + command_latency）の姿勢 (x, y, angle) を予測する """
+        if self.time is None:
+            return self._predicted
+        if not self.on_mat:
+            self.coasting += 1
+            self._coast_to(now)
+        x, y, angle, left, right = self._propagate(now + self.command_latency)
+        self._predicted = (x, y, angle)
+        self._predicted_velocity = self._model_velocity(left, right)
+        return self._predicted
+
+    def velocity(self):
+        """ 最後に predict() した時刻の速度 (前進 [単位/s], 旋回 [度/s]) の推定値 """
+        return self._predicted_velocity
+
+    def current_uncertainty(self, now):
+        """ now の時点での位置の不確かさ（推測航法の間は進んだ距離に応じて増える） """
+        if self.time is None:
+            return math.inf
+        if self.on_mat:
+            return self.uncertainty
+        v, _ = self.velocity()
+        return self.uncertainty + abs(v) * max(now - self.time, 0.0) * self.drift_rate
+
+    def is_reliable(self, now):
+        """ 推定した姿勢で制御を続けてよいか """
+        return self.current_uncertainty(now) <= self.max_uncertainty
+
+    def error_rates(self, target_x, target_y):
+        """
+        最後に predict() した姿勢から見た、止まっている目標への
+        (距離の変化率 [単位/s], 角度差の変化率 [度/s])。PIDBank.update の rates に渡す。
+        """
+        x, y, angle = self._predicted
+        v, omega = self.velocity()
+        dx, dy = target_x - x, target_y - y
+        distance = math.hypot(dx, dy)
+        if distance < 1e-6:
+            return 0.0, -omega
+        relative = math.atan2(dy, dx) - math.radians(angle)
+        return (-v * math.cos(relative),
+                math.degrees(v * math.sin(relative) / distance) - omega)
+
+    # --- 運動モデル ---
+    def _coast_to(self, now):
+        """
+        推測航法の間、推定した姿勢を now 時点で届きうる一番新しい座標の時刻まで進めておく。
+        こうしないと predict() のたびに座標が途切れた所から計算し直すことになり、途切れている時間に比例して重くなる
+        """
+        if self.time is not None:
+            self._advance_to(now - self.notify_latency)
+
+    def _advance_to(self, t):
+        """ 推定した姿勢を時刻 t まで進める（推測航法なら不確かさも増やす） """
+        if t <= self.time:
+            return
+        x, y, angle, self.wheel_left, self.wheel_right = self._propagate(t)
+        # t までに効いた指令を確定させる
+        while self._commands and self._commands[0][0] <= t:
+            _, self.command_left, self.command_right = self._commands.popleft()
+        if not self.on_mat:
+            self.uncertainty += math.hypot(x - self.x, y - self.y) * self.drift_rate
+        self.x, self.y, self.angle = x, y, angle
+        self.time = t
+
+    def _propagate(self, t):
+        """ 今の推定から時刻 t の (x, y, angle, 左車輪, 右車輪) を計算する（状態は変えない） """
+        x, y, angle = self.x, self.y, self.angle
+        left, right = self.wheel_left, self.wheel_right
+        now = self.time
+        command = (self.command_left, self.command_right)
+        pending = iter(self._commands)
+        change = next(pending, None)
+        while now < t - 1e-9:
+            # 途中で指令が変わるなら、そこで区切る
+            while change is not None and change[0] <= now:
+                command = change[1:]
+                change = next(pending, None)
+            end = t if change is None else min(t, change[0])
+            h = min(end - now, _PREDICT_STEP)
+            k = min(h / MOTOR_TIME_CONSTANT, 1.0)
+            left += (speed_from_param(command[0]) - left) * k
+            right += (speed_from_param(command[1]) - right) * k
+            v, omega = self._model_velocity(left, right)
+            theta = math.radians(angle)
+            x += v * math.cos(theta) * h
+            y += v * math.sin(theta) * h
+            angle = (angle + omega * h) % 360
+            now += h
+        return x, y, angle, left, right
+
+    def _model_velocity(self, left, right):
+        v = (left + right) / 2 * self.v_scale
+        omega = math.degrees((left - right) / (WHEEL_BASE_MM * MAT_UNITS_PER_MM)) * self.omega_scale
+        return v, omega
+
+    def _update_velocity(self, x, y, angle, t):
+        """ 前回の座標との差から実際の速度を求め、モデルとの比を少しずつ補正に取り込む """
+        if self._last_measure is None:
+            return
+        px, py, pangle, pt = self._last_measure
+        dt = t - pt
+        if dt <= 0:
+            return
+        theta = math.radians(self.angle)
+        v_measured = ((x - px) * math.cos(theta) + (y - py) * math.sin(theta)) / dt
+        omega_measured = get_angle_diff(angle, pangle) / dt
+        v_model, omega_model = self._model_velocity(self.wheel_left, self.wheel_right)
+        # 動いているときだけ比を取る（止まっているときは割り算が不安定）
+        if abs(v_model) > 5:
+            ratio = min(max(v_measured / v_model * self.v_scale, 0.5), 1.5)
+            self.v_scale += self.velocity_gain * (ratio - self.v_scale)
+        if abs(omega_model) > 20:
+            ratio = min(max(omega_measured / omega_model * self.omega_scale, 0.5), 1.5)
+            self.omega_scale += self.velocity_gain * (ratio - self.omega_scale)
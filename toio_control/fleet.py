@@ -0,0 +1,238 @@
+import asyncio
+import math
+from time import perf_counter_ns
+
+import numpy as np
+
+from .clock import REAL_CLOCK
+from .command import DEFAULT_DEADBAND, MotorCommander
+from .metrics import CONTROL, DECODE, WRITE
+from .notification import (DEFAULT_CONDITION, NotificationSettings, configure_id_notification,
+                           interval_for_period)
+from .schedule import RateScheduler, TimingStats
+from .state import CubeState
+
+
+class FleetLink:
+    """
+    1台分の通信係。最新の座標を受け取り、モーター指令を自分のペースで送る。
+
+    指令は「最新の1件」だけを持つ箱に入れる。書き込み中に次の指令が来たら上書きし
+    （superseded に数える）、古い指令を溜めない。遅いキューブがいても、
+    制御の tick や他のキューブの書き込みは待たされない。
+    前回送った指令と変わらない指令は MotorCommander が間引く。
+    """
+
+    def __init__(self, cube, index, clock=REAL_CLOCK, min_interval=0.0, deadband=DEFAULT_DEADBAND,
+                 metrics=None):
+        self.cube = cube
+        self.index = index
+        self.clock = clock
+        self.metrics = metrics
+        self.min_interval = min_interval  # 書き込みの最短間隔 [s]
+        self.motor = MotorCommander(cube.api.motor, clock, deadband)
+        self.pose = CubeState(clock)
+        self._pending = None
+        self._wake = None
+        self._writer = None
+        self._last_write = -math.inf
+        self.notifications = 0
+        self.writes = 0
+        self.superseded = 0     # 送る前に新しい指令で置き換えられた数
+        self.write_time = 0.0   # 書き込みにかかった合計時間 [s]
+        self.notify_settings = None  # キューブに設定したID通知（NotificationSettings）
+
+    def __call__(self, payload):
+        # ID通知のハンドラ（PositionId だけ pose に書き込む）
+        metrics = self.metrics
+        started = perf_counter_ns() if metrics is not None else 0
+        if self.pose.receive(payload, self.clock.now()):
+            self.notifications += 1
+        if metrics is not None:
+            metrics.record(DECODE, started)
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        await self.cube.api.id_information.register_notification_handler(self)
+        self._writer = asyncio.get_running_loop().create_task(self._write_loop())
+
+    async def stop(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        await self.cube.api.id_information.unregister_notification_handler(self)
+
+    def submit(self, left, right):
+        """ 送る指令を最新のものに置き換える（すぐ戻る） """
+        if self._pending is not None:
+            self.superseded += 1
+        self._pending = (left, right)
+        self._wake.set()
+
+    async def _write_loop(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            # 前回の書き込みから min_interval 経つまで待つ（その間に来た指令は上書きされる）
+            wait = self._last_write + self.min_interval - self.clock.now()
+            if wait > 0:
+                await self.clock.sleep(wait)
+            command, self._pending = self._pending, None
+            if command is None:
+                continue
+            started = self.clock.now()
+            started_ns = perf_counter_ns() if self.metrics is not None else 0
+            written = await self.motor.motor_control(*command)
+            if written:
+                if self.metrics is not None:
+                    self.metrics.record(WRITE, started_ns)
+                self._last_write = started
+                self.write_time += self.clock.now() - started
+                self.writes += written
+
+
+class Fleet:
+    """
+    N台のキューブをまとめて動かすランタイム。
+
+    制御は1 tick につき全台分を1回の step(poses, now) でまとめて計算し、
+    返ってきた (N, 2) の指令を台ごとの FleetLink に渡す。書き込みは台ごとに並行に進む。
+
+    >>> async with MultipleToioCoreCubes(cubes=4) as cubes:
+    >>>     async with Fleet(cubes) as fleet:
+    >>>         await fleet.run(step)
+    """
+
+    def __init__(self, cubes, clock=REAL_CLOCK, min_write_interval=0.0, deadband=DEFAULT_DEADBAND,
+                 metrics=None, notify_condition=DEFAULT_CONDITION):
+        self.cubes = list(cubes)
+        self.clock = clock
+        self.metrics = metrics  # Metrics を渡すと、段階ごとの処理時間を全台まとめて記録する
+        # None でなければ、run() で全台のID通知の最短間隔を tick の周期に合わせる
+        self.notify_condition = notify_condition
+        self.min_write_interval = min_write_interval
+        self.links = [FleetLink(cube, i, clock, min_write_interval, deadband, metrics)
+                      for i, cube in enumerate(self.cubes)]
+        self.poses = np.zeros((len(self.cubes), 3))  # (x, y, angle)
+        self.ticks = 0
+        self.started_at = None
+        self.finished_at = None
+        self.timing = None  # tick の周期の記録（TimingStats）
+        self.rate = None    # 台ごとに周期を切り替えたときの記録（AdaptiveRate）
+
+    def __len__(self):
+        return len(self.links)
+
+    async def __aenter__(self):
+        await asyncio.gather(*(link.start() for link in self.links))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await asyncio.gather(*(link.stop() for link in self.links))
+        await self.stop_motors()
+
+    async def stop_motors(self):
+        await asyncio.gather(*(cube.api.motor.motor_control(0, 0) for cube in self.cubes))
+
+    async def wait_for_poses(self):
+        """ 全台の座標が一度は届くまで待つ（最後の1台が届いた瞬間に戻る） """
+        await asyncio.gather(*(link.pose.first_pose() for link in self.links))
+
+    async def configure_notifications(self, period):
+        """ 全台のID通知を周期 period [s] の制御に合わせて設定する（応答は並行して待つ） """
+        interval_ms = interval_for_period(period)
+        results = await asyncio.gather(
+            *(configure_id_notification(link.cube, interval_ms, self.notify_condition, self.clock)
+              for link in self.links),
+            return_exceptions=True)
+        for link, result in zip(self.links, results):
+            if isinstance(result, Exception):
+                result = NotificationSettings(interval_ms, self.notify_condition)  # 応答なしとして扱う
+            link.notify_settings = result
+
+    def read_poses(self):
+        """ 全台の最新の座標を poses (N, 3) に読み込んで返す """
+        poses = self.poses
+        for i, link in enumerate(self.links):
+            pose = link.pose
+            poses[i, 0] = pose.x
+            poses[i, 1] = pose.y
+            poses[i, 2] = pose.angle
+        return poses
+
+    async def run(self, step, period=0.05, rate=None):
+        """
+        period [s] ごとに step(poses, now) を呼び、返ってきた (N, 2: left, right) を送る。
+        step が None を返したら終了。tick は締め切り方式で、計算の時間で周期が延びない。
+        rate（AdaptiveRate）を渡すと、tick の周期を rate.period（一番速い台）に、台ごとの書き込みの
+        最短間隔をその台の周期に合わせる（step の中で rate.update() を呼んでおく）。
+        ID通知は一番速い段階に合わせて最初に1回だけ設定する。
+        """
+        await self.wait_for_poses()
+        timing = None
+        if rate is not None:
+            self.rate = rate
+            timing = TimingStats(period, max_value=4 * max(period, float(rate.periods.max())))
+        # 通知の設定は座標が揃ってから（止まっているキューブは変化時の条件だと通知を送らないため）
+        configure = None
+        if self.notify_condition is not None:
+            fastest = period if rate is None else min(period, float(rate.periods.min()))
+            configure = asyncio.ensure_future(self.configure_notifications(fastest))
+        scheduler = RateScheduler(period, self.clock, timing)
+        self.timing = scheduler.stats
+        scheduler.start()
+        self.started_at = self.clock.now()
+        try:
+            while True:
+                started = perf_counter_ns() if self.metrics is not None else 0
+                commands = step(self.read_poses(), self.clock.now())
+                if self.metrics is not None:
+                    self.metrics.record(CONTROL, started)
+                self.ticks += 1
+                if commands is None:
+                    break
+                for link, (left, right) in zip(self.links, commands.tolist()):
+                    link.submit(left, right)
+                if rate is not None:
+                    self._apply_rate(rate, scheduler)
+                await scheduler.wait()
+        finally:
+            self.finished_at = self.clock.now()
+            if configure is not None and not configure.done():
+                configure.cancel()
+
+    def _apply_rate(self, rate, scheduler):
+        # 書き込みの最短間隔より速く回しても、指令は上書きされるだけなので回さない
+        scheduler.period = max(rate.period, self.min_write_interval)
+        for link, cube_period in zip(self.links, rate.cube_periods().tolist()):
+            link.min_interval = max(self.min_write_interval, cube_period)
+
+    # --- 計測 ---
+    def commands_per_second(self):
+        """ 実際にキューブへ届けたモーター指令の数 / 走行時間 """
+        if self.started_at is None or self.finished_at <= self.started_at:
+            return 0.0
+        return sum(link.writes for link in self.links) / (self.finished_at - self.started_at)
+
+    def report(self):
+        writes = sum(link.writes for link in self.links)
+        superseded = sum(link.superseded for link in self.links)
+        suppressed = sum(link.motor.suppressed for link in self.links)
+        text = (f"{len(self)}台, tick {self.ticks}回, 書き込み {writes}回 "
+                f"({self.commands_per_second():.1f} 指令/s), 上書き {superseded}回, 間引き {suppressed}回")
+        if self.rate is not None:
+            text += "\n" + self.rate.report()
+        if self.timing is not None:
+            text += "\n" + self.timing.report()
+        for link in self.links:
+            mean_ms = link.write_time / link.writes * 1000 if link.writes else 0.0
+            text += (f"\n  [{link.index}] 通知 {link.notifications}回 ({link.pose.notification_rate():.1f}Hz), "
+                     f"書き込み {link.writes}回, 上書き {link.superseded}回, 間引き {link.motor.suppressed}回, "
+                     f"書き込み平均 {mean_ms:.1f}ms")
+            if link.notify_settings is not None:
+                text += f"\n      {link.notify_settings.report()}"
+        return text
@@ -0,0 +1,51 @@
+import json
+from pathlib import Path
+
+# tune.py が求めたゲインの保存先（リポジトリ直下。スクリプトごとに分けて入れる）
+GAINS_FILE = Path(__file__).resolve().parent.parent / "pid_gains.json"
+# ファイルから読み込む設定の名前（スクリプトのグローバル変数と同じ）
+GAIN_NAMES = ("DIST_KP", "DIST_KI", "DIST_KD", "ANGLE_KP", "ANGLE_KI", "ANGLE_KD")
+
+
+def _read(path):
+    path = Path(path)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def load_gains(script, path=GAINS_FILE):
+    """ script（ファイル名）用に保存されたゲイン {名前: 値} を返す。なければ空の dict """
+    gains = _read(path).get(Path(script).name, {}).get("gains", {})
+    return {name: float(gains[name]) for name in GAIN_NAMES if name in gains}
+
+
+def save_gains(gains, script, path=GAINS_FILE, **info):
+    """ script 用のゲインと、その求め方などの情報（info）を JSON に書き出す（ほかのスクリプトの分は残す） """
+    data = _read(path)
+    entry = {"gains": {name: round(float(gains[name]), 4) for name in GAIN_NAMES}}
+    entry.update(info)
+    data[Path(script).name] = entry
+    Path(path).write_text(json.dumps(data, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+def format_gains(gains):
+    return ", ".join(f"{name}={gains[name]:.3g}" for name in GAIN_NAMES if name in gains)
+
+
+def apply_gains(namespace, path=GAINS_FILE):
+    """
+    そのスクリプト用に保存されたゲインで設定を上書きし、使ったゲインを表示する。
+    スクリプトが USE_TUNED_GAINS = True のときだけ呼ぶ（黙ってスクリプトの値を変えないように）。
+
+    >>> if USE_TUNED_GAINS:
+    >>>     apply_gains(globals())  # DIST_KP などを定義したあとで呼ぶ
+    """
+    script = Path(namespace["__file__"]).name
+    gains = load_gains(script, path)
+    if not gains:
+        print(f"{Path(path).name} に {script} のゲインがありません（スクリプトに書いた値を使います）")
+        return gains
+    namespace.update(gains)
+    print(f"{Path(path).name} のゲインを使います: {format_gains(gains)}")
+    return gains
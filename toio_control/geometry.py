@@ -0,0 +1,38 @@
+import numpy as np
+
+
+# -180度〜+180度の範囲で、どちらにどれだけ回ればいいかを計算
+# （スカラーでも numpy 配列でもそのまま使える）
+def get_angle_diff(target_deg, current_deg):
+    return 180 - (180 - (target_deg - current_deg)) % 360
+
+
+def heading_errors(targets, poses):
+    """
+    目標座標 targets (n, 2) と現在の姿勢 poses (n, 3: x, y, angle) から
+    距離と角度差 (n, 2) をまとめて計算する
+    """
+    targets = np.asarray(targets, dtype=float)
+    poses = np.asarray(poses, dtype=float)
+    dx = targets[:, 0] - poses[:, 0]
+    dy = targets[:, 1] - poses[:, 1]
+    errors = np.empty((len(poses), 2))
+    errors[:, 0] = np.hypot(dx, dy)
+    errors[:, 1] = get_angle_diff(np.degrees(np.arctan2(dy, dx)), poses[:, 2])
+    return errors
+
+
+def segment_distances(ax, ay, bx, by, cx, cy):
+    """
+    線分 A→B から各点 (cx, cy)（配列）までの最短距離と、
+    いちばん近い位置が線分上のどこか（0=A, 1=B）をまとめて返す
+    """
+    cx = np.asarray(cx, dtype=float)
+    cy = np.asarray(cy, dtype=float)
+    ab_x, ab_y = bx - ax, by - ay
+    ab_len2 = ab_x * ab_x + ab_y * ab_y
+    if ab_len2 == 0:
+        t = np.zeros_like(cx)
+    else:
+        t = np.clip(((cx - ax) * ab_x + (cy - ay) * ab_y) / ab_len2, 0.0, 1.0)
+    return np.hypot(ax + t * ab_x - cx, ay + t * ab_y - cy), t
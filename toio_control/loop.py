@@ -0,0 +1,360 @@
+import asyncio
+from collections import deque
+from time import perf_counter_ns
+
+from .clock import REAL_CLOCK
+from .command import MotorCommander
+from .decode import POSITION_ID_MISSED
+from .metrics import CONTROL, DECODE, ESTIMATE, RECEIVE, WRITE
+from .notification import (DEFAULT_CONDITION, NotificationSettings, configure_id_notification,
+                           interval_for_period)
+from .schedule import RateScheduler, TimingStats
+from .state import CubeState, give_back, take_over
+
+# 制御ループの動かし方
+POLL = "poll"      # 一定周期で最新の座標を読んで制御する（従来の方式）
+NOTIFY = "notify"  # PositionId の通知が来るたびに1回だけ制御する
+
+
+class LoopStats:
+    """ 制御ループの回数と「通知受信 → モーター指令」の遅延を記録する """
+
+    def __init__(self, max_samples=10000):
+        self.notifications = 0  # 受け取った PositionId 通知
+        self.steps = 0          # 制御計算の回数
+        self.writes = 0         # モーター指令の回数（実際に送ったもの）
+        self.suppressed = 0     # 前回と同じなどの理由で送らなかったモーター指令
+        self.coalesced = 0      # 書き込み中に預けたが、次の指令に上書きされて送らなかったもの
+        self.skipped = 0        # 最小周期や処理中のため見送った通知
+        self.coasted = 0        # 座標が読めない間に推測航法で制御した回数
+        self.held = 0           # 推定の不確かさが大きく、止めて待った回数
+        self.latency = deque(maxlen=max_samples)  # [s]
+        self.timing = None      # poll のときの周期の記録（TimingStats）
+        self.notify_settings = None  # キューブに設定したID通知（NotificationSettings）
+        self.notify_rate = None      # 実際に届いた PositionId の頻度 [Hz]
+        self.rate = None        # 周期を切り替えたときの記録（AdaptiveRate）
+        self._queued = False             # 書き込み中に MotorCommander に預けた指令があるか
+        self._queued_received_at = None  # その指令の元の座標の受信時刻
+
+    def record_latency(self, seconds):
+        self.latency.append(seconds)
+
+    def latency_summary(self):
+        """ 遅延の統計（ミリ秒）を返す """
+        if not self.latency:
+            return {}
+        samples = sorted(self.latency)
+        n = len(samples)
+
+        def percentile(q):
+            return samples[min(int(q * n), n - 1)] * 1000
+
+        return {
+            "count": n,
+            "mean_ms": sum(samples) / n * 1000,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": samples[-1] * 1000,
+        }
+
+    def report(self):
+        text = (f"通知 {self.notifications}回, 制御 {self.steps}回, "
+                f"書き込み {self.writes}回 (間引き {self.suppressed}回"
+                f"{f', まとめ {self.coalesced}回' if self.coalesced else ''}), 見送り {self.skipped}回")
+        s = self.latency_summary()
+        if s:
+            text += (f" / 通知→指令の遅延 平均 {s['mean_ms']:.1f}ms, "
+                     f"p50 {s['p50_ms']:.1f}ms, p99 {s['p99_ms']:.1f}ms, 最大 {s['max_ms']:.1f}ms")
+        if self.coasted or self.held:
+            text += f" / 推測航法 {self.coasted}回, 停止して待機 {self.held}回"
+        if self.notify_settings is not None:
+            text += "\n" + self.notify_settings.report(self.notify_rate)
+        if self.rate is not None:
+            text += "\n" + self.rate.report()
+        if self.timing is not None:
+            text += "\n" + self.timing.report()
+        return text
+
+
+class _LatestPose:
+    """
+    最後に受け取った座標と受信時刻を CubeState に上書きしていくハンドラ。
+    state（スクリプトの CubeState）を渡すとそれに書き込み、なければ自分用に1つ作る。
+    estimator があれば、座標と PositionIdMissed をそちらにも渡す。
+    """
+
+    def __init__(self, clock, stats, on_pose=None, estimator=None, metrics=None, state=None):
+        self.clock = clock
+        self.stats = stats
+        self.on_pose = on_pose
+        self.estimator = estimator
+        self.metrics = metrics
+        self.pose = state if state is not None else CubeState(clock)
+        # 渡された state がもう座標を持っていれば、推定器もそこから始める（次の通知を待たない）
+        if estimator is not None and self.pose.seq and self.pose.on_mat:
+            estimator.measure(self.pose.x, self.pose.y, self.pose.angle, self.pose.received_at)
+
+    def __call__(self, payload):
+        metrics = self.metrics
+        if metrics is not None:
+            started = perf_counter_ns()
+        now = self.clock.now()
+        pose = self.pose
+        is_pose = pose.receive(payload, now)
+        if metrics is not None:
+            metrics.record(DECODE, started)
+        if is_pose:
+            self.stats.notifications += 1
+            if self.estimator is not None:
+                if metrics is not None:
+                    estimate_started = perf_counter_ns()
+                self.estimator.measure(pose.x, pose.y, pose.angle, now)
+                if metrics is not None:
+                    metrics.record(ESTIMATE, estimate_started)
+            if self.on_pose is not None:
+                self.on_pose()
+        elif payload[0] == POSITION_ID_MISSED and self.estimator is not None:
+            self.estimator.missed(now)
+        if metrics is not None:
+            metrics.record(RECEIVE, started)
+
+
+async def _send(motor, command, stats, clock, received_at, metrics=None):
+    """
+    指令を MotorCommander 経由で送り、送った・間引いた回数を stats に数える。
+    書き込み中に来た指令は MotorCommander が預かり、今の書き込みが終わったところで送るので、
+    預けた指令は送ったときに（書き込んでいた側の呼び出しで）書き込みと遅延を数える。
+    """
+    started = perf_counter_ns() if metrics is not None else 0
+    suppressed, coalesced = motor.suppressed, motor.coalesced
+    written = await motor.motor_control(*command)
+    if not written:
+        # 書き込まずに戻るときは待たないので、増えた分はこの指令のもの
+        if motor.suppressed > suppressed:
+            stats.suppressed += 1
+        else:
+            stats.coalesced += motor.coalesced - coalesced
+            stats._queued = True
+            stats._queued_received_at = received_at
+        return
+    if metrics is not None:
+        metrics.record(WRITE, started)
+    stats.writes += written
+    now = clock.now()
+    if received_at is not None:
+        stats.record_latency(now - received_at)
+    if stats._queued:
+        # 預けていた指令は、送られた（written > 1）か、送る前に間引かれたかのどちらか
+        if written > 1:
+            if stats._queued_received_at is not None:
+                stats.record_latency(now - stats._queued_received_at)
+        else:
+            stats.suppressed += 1
+        stats._queued = False
+        stats._queued_received_at = None
+
+
+async def _control_once(step, pose, motor, stats, clock, estimator, metrics=None):
+    """
+    1回分の制御：姿勢を決めて step を呼び、指令を送る。step が None を返したら False。
+    estimator があれば、指令が効く時刻の予測姿勢で制御する。座標が読めない間は推測航法で続け、
+    不確かさが大きくなりすぎたら止めて座標が戻るのを待つ。
+    """
+    now = clock.now()
+    received_at = pose.received_at
+    if estimator is None:
+        x, y, angle = pose.x, pose.y, pose.angle
+    elif estimator.is_reliable(now):
+        if not pose.on_mat:
+            stats.coasted += 1
+            received_at = None  # 古い座標からの遅延は数えない
+        started = perf_counter_ns() if metrics is not None else 0
+        x, y, angle = estimator.predict(now)
+        if metrics is not None:
+            metrics.record(ESTIMATE, started)
+    else:
+        stats.held += 1
+        await _send(motor, (0, 0), stats, clock, None, metrics)
+        estimator.command(0, 0, now)
+        return True
+    started = perf_counter_ns() if metrics is not None else 0
+    command = step(x, y, angle, now)
+    if metrics is not None:
+        metrics.record(CONTROL, started)
+    stats.steps += 1
+    if command is None:
+        return False
+    await _send(motor, command, stats, clock, received_at, metrics)
+    if estimator is not None:
+        estimator.command(*command, now)
+    return True
+
+
+async def run_polling(cube, step, clock=REAL_CLOCK, period=0.05, stats=None, motor=None,
+                      estimator=None, metrics=None, on_ready=None, rate=None, state=None):
+    """
+    period [s] ごとに最新の座標で step(x, y, angle, now) を呼び、
+    返ってきた (left, right) をモーターに送る（前回と変わらない指令は間引く）。
+    step が None を返したら終了。
+    周期は RateScheduler の締め切りで決めるので、計算や書き込みの時間で延びていかない。
+    metrics（Metrics）を渡すと、段階ごとの処理時間を記録する。
+    on_ready は最初の座標が届いて制御を始めるときに1回だけ呼ばれる。
+    rate（AdaptiveRate）を渡すと、制御のたびに次の周期を rate.period に合わせる
+    （step の中で rate.update() を呼んでおく）。
+    state（ID通知に登録済みの CubeState）を渡すと、制御の間はそのハンドラと入れ替えて state に書き込む
+    （同じ通知を2回解析しない）。終わったら state を登録し直す。
+    """
+    stats = stats if stats is not None else LoopStats()
+    timing = None
+    if rate is not None:
+        stats.rate = rate
+        timing = TimingStats(period, max_value=4 * max(period, float(rate.periods.max())))
+    scheduler = RateScheduler(period, clock, timing)
+    stats.timing = scheduler.stats
+    motor = motor if motor is not None else MotorCommander(cube.api.motor, clock)
+    latest = _LatestPose(clock, stats, estimator=estimator, metrics=metrics, state=state)
+    await take_over(cube.api.id_information, latest, state)
+    pose = latest.pose
+    try:
+        await pose.first_pose()
+        if on_ready is not None:
+            on_ready()
+        scheduler.start()
+        while await _control_once(step, pose, motor, stats, clock, estimator, metrics):
+            if rate is not None:
+                scheduler.period = rate.period
+            await scheduler.wait()
+    finally:
+        stats.notify_rate = pose.notification_rate()
+        await give_back(cube.api.id_information, latest, state)
+    return stats
+
+
+async def run_on_notification(cube, step, clock=REAL_CLOCK, min_period=0.0, stats=None, motor=None,
+                              estimator=None, coast_period=0.05, metrics=None, on_ready=None, rate=None,
+                              rate_scale=1.0, state=None):
+    """
+    PositionId の通知1回につき step(x, y, angle, now) を1回呼び、モーターに1回書き込む。
+    前回の制御から min_period [s] 経っていない通知と、書き込み中に来た通知は見送る。
+    step が None を返したら終了。
+    estimator があれば、座標が読めない間（通知が来ない間）も coast_period ごとに推測航法で制御する。
+    on_ready は最初の座標で制御するときに1回だけ呼ばれる。
+    rate（AdaptiveRate）を渡すと、rate.period × rate_scale（min_period より短くはしない）を最短周期にする。
+    state は run_polling と同じ。
+    """
+    stats = stats if stats is not None else LoopStats()
+    floor = min_period  # 周期を切り替えても、これより短くはしない
+    if rate is not None:
+        stats.rate = rate
+    motor = motor if motor is not None else MotorCommander(cube.api.motor, clock)
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+    busy = False
+    last_step = None
+
+    async def step_and_write():
+        nonlocal busy, min_period
+        try:
+            if not await _control_once(step, latest.pose, motor, stats, clock, estimator, metrics):
+                if not finished.done():
+                    finished.set_result(None)
+            elif rate is not None:
+                min_period = max(rate.period * rate_scale, floor)
+        except Exception as e:
+            if not finished.done():
+                finished.set_exception(e)
+        finally:
+            busy = False
+
+    def on_pose():
+        nonlocal busy, last_step, on_ready
+        if on_ready is not None:
+            on_ready()
+            on_ready = None
+        now = latest.pose.received_at
+        if finished.done() or busy or (last_step is not None and now - last_step < min_period):
+            stats.skipped += 1
+            return
+        busy = True
+        last_step = now
+        loop.create_task(step_and_write())
+
+    async def coast():
+        nonlocal busy
+        while not finished.done():
+            await clock.sleep(coast_period)
+            if latest.pose.seq and not latest.pose.on_mat and not busy and not finished.done():
+                busy = True
+                loop.create_task(step_and_write())
+
+    latest = _LatestPose(clock, stats, on_pose, estimator, metrics, state)
+    await take_over(cube.api.id_information, latest, state)
+    coaster = loop.create_task(coast()) if estimator is not None else None
+    try:
+        await finished
+    finally:
+        if coaster is not None:
+            coaster.cancel()
+        stats.notify_rate = latest.pose.notification_rate()
+        await give_back(cube.api.id_information, latest, state)
+    return stats
+
+
+async def run_control_loop(cube, step, mode=POLL, clock=REAL_CLOCK, period=0.05, min_period=0.0,
+                           estimator=None, metrics=None, notify_condition=DEFAULT_CONDITION, rate=None,
+                           state=None):
+    """
+    mode に応じて run_polling / run_on_notification のどちらかで制御する。
+    notify_condition が None でなければ、始めるときにキューブのID通知の最短間隔を制御の速さに合わせる
+    （poll なら周期の半分、notify なら最短制御周期。使われずに捨てる通知で無線を混ませない）。
+    設定は最初の座標が届いてから制御と並行して行う（止まっているキューブは変化時の条件だと
+    しばらく通知を送らないので、先に設定すると最初の座標を待たされる）。
+    rate（AdaptiveRate）を渡すと、制御の周期を状態に合わせて切り替える（notify のときは rate の周期を
+    min_period / period 倍して最短制御周期にする）。ID通知の間隔は一番速い段階に合わせて1回だけ設定する
+    （切り替えのたびに設定を書き込むと、その書き込みの方が減らした指令より多くなる）。
+    state（スクリプトが登録した CubeState）を渡すと、制御ループはその state に座標を書き込む
+    （ループ用に別の CubeState を作って同じ通知をもう1回解析しない）。
+    結果と実際に届いた頻度は stats.report() に出る。
+    """
+    if mode == NOTIFY:
+        fastest = min_period or period
+        if rate is not None:
+            fastest = max(float(rate.periods.min()) * fastest / period, min_period)
+        interval_ms = interval_for_period(fastest, per_step=1)
+    elif mode == POLL:
+        fastest = period if rate is None else min(period, float(rate.periods.min()))
+        interval_ms = interval_for_period(fastest)
+    else:
+        raise ValueError(f"unknown control mode: {mode}")
+    configure = None
+
+    def on_ready():
+        nonlocal configure
+        if notify_condition is not None:
+            configure = asyncio.ensure_future(
+                configure_id_notification(cube, interval_ms, notify_condition, clock))
+
+    try:
+        if mode == NOTIFY:
+            stats = await run_on_notification(cube, step, clock, min_period=min_period, estimator=estimator,
+                                              coast_period=period, metrics=metrics, on_ready=on_ready,
+                                              rate=rate, rate_scale=(min_period or period) / period,
+                                              state=state)
+        else:
+            stats = await run_polling(cube, step, clock, period=period, estimator=estimator,
+                                      metrics=metrics, on_ready=on_ready, rate=rate, state=state)
+    except BaseException:
+        if configure is not None:
+            configure.cancel()
+        raise
+    if notify_condition is None:
+        return stats
+    if configure is not None and configure.done() and configure.exception() is None:
+        stats.notify_settings = configure.result()
+    else:
+        # 応答を待っている間に制御が終わった / 書き込みに失敗した（応答なしとして出す）
+        if configure is not None:
+            configure.cancel()
+        stats.notify_settings = NotificationSettings(interval_ms, notify_condition)
+    return stats
@@ -0,0 +1,134 @@
+import asyncio
+import json
+from bisect import bisect_left
+from pathlib import Path
+from time import perf_counter_ns
+
+# 制御ループの段階
+RECEIVE = "receive"    # 通知ハンドラ全体（decode と estimate を含む）
+DECODE = "decode"      # 通知の生データの解析
+ESTIMATE = "estimate"  # 姿勢の推定（measure / predict）
+PLAN = "plan"          # 経路計画（control の内側で呼ばれたときはその時間にも含まれる）
+CONTROL = "control"    # step() の計算
+WRITE = "write"        # モーターへの書き込み（間引いた指令は数えない）
+STAGES = (RECEIVE, DECODE, ESTIMATE, PLAN, CONTROL, WRITE)
+
+# ヒストグラムの区切り [s]（Prometheus の le）
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class StageStats:
+    """ 1段階分の回数・合計時間・最大時間とヒストグラム（時間はナノ秒の整数で持つ） """
+
+    __slots__ = ("count", "total_ns", "max_ns", "buckets")
+
+    def __init__(self, n_buckets):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * n_buckets  # 最後は区切りを超えた分（+Inf）
+
+    def to_dict(self, bounds):
+        return {
+            "count": self.count,
+            "sum_s": self.total_ns / 1e9,
+            "mean_s": self.total_ns / self.count / 1e9 if self.count else 0.0,
+            "max_s": self.max_ns / 1e9,
+            "buckets": {str(b): n for b, n in zip(bounds + ("+Inf",), self.buckets)},
+        }
+
+
+class Metrics:
+    """
+    制御ループの段階ごとの処理時間の記録係。
+
+    計測する側は perf_counter_ns() で開始時刻を取り、終わったら record() に渡す。
+    計測しないときは metrics=None にしておけば、ループ側は None の判定1回だけで済む。
+    結果は to_dict() / dump() で JSON に、prometheus_text() / serve() で Prometheus の形式で出せる。
+
+    >>> metrics = Metrics()
+    >>> started = perf_counter_ns()
+    >>> ...  # 計測したい処理
+    >>> metrics.record(DECODE, started)
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix="toio_control"):
+        self.bounds = tuple(buckets)
+        self._bounds_ns = [int(b * 1e9) for b in self.bounds]
+        self.prefix = prefix
+        self.stages = {name: StageStats(len(self.bounds) + 1) for name in STAGES}
+
+    def record(self, stage, started_ns):
+        """ started_ns（perf_counter_ns() の値）から今までの時間を stage に記録する """
+        self.observe_ns(stage, perf_counter_ns() - started_ns)
+
+    def observe_ns(self, stage, elapsed_ns):
+        s = self.stages[stage]
+        s.count += 1
+        s.total_ns += elapsed_ns
+        if elapsed_ns > s.max_ns:
+            s.max_ns = elapsed_ns
+        s.buckets[bisect_left(self._bounds_ns, elapsed_ns)] += 1
+
+    # --- 書き出し ---
+    def to_dict(self):
+        return {name: s.to_dict(self.bounds) for name, s in self.stages.items()}
+
+    def dump(self, path):
+        """ JSON ファイルに書き出す """
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2), encoding="utf-8")
+
+    def prometheus_text(self):
+        """ Prometheus のテキスト形式（ヒストグラム + 最大値のゲージ）で返す """
+        name = f"{self.prefix}_stage_seconds"
+        lines = [f"# HELP {name} Time spent in each control loop stage.",
+                 f"# TYPE {name} histogram"]
+        for stage, s in self.stages.items():
+            cumulative = 0
+            for bound, n in zip(self.bounds, s.buckets):
+                cumulative += n
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {s.count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {s.total_ns / 1e9}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {s.count}')
+        max_name = f"{self.prefix}_stage_max_seconds"
+        lines += [f"# HELP {max_name} Longest time spent in each control loop stage.",
+                  f"# TYPE {max_name} gauge"]
+        for stage, s in self.stages.items():
+            lines.append(f'{max_name}{{stage="{stage}"}} {s.max_ns / 1e9}')
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, port, host="127.0.0.1"):
+        """
+        http://host:port/metrics で prometheus_text() を返すサーバーを立てる。
+        戻り値の asyncio.Server は使い終わったら close() する。
+        """
+        async def handle(reader, writer):
+            try:
+                request = await reader.readline()
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                path = request.split()[1] if len(request.split()) > 1 else b"/"
+                if path == b"/metrics":
+                    body = self.prometheus_text().encode()
+                    status = b"200 OK"
+                else:
+                    body = b"not found\n"
+                    status = b"404 Not Found"
+                writer.write(b"HTTP/1.1 " + status + b"\r\n"
+                             b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                             b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                             b"Connection: close\r\n\r\n" + body)
+                await writer.drain()
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+    def report(self):
+        lines = []
+        for stage, s in self.stages.items():
+            if s.count:
+                mean_us = s.total_ns / s.count / 1000
+                lines.append(f"  {stage}: {s.count}回, 平均 {mean_us:.1f}µs, 最大 {s.max_ns / 1000:.1f}µs")
+        return "段階ごとの処理時間:\n" + "\n".join(lines) if lines else "段階ごとの処理時間: 記録なし"
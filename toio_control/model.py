@@ -0,0 +1,33 @@
+"""
+キューブとマットの物理的な定数（仕様の公称値）
+
+推定器・軌道・経路計画とシミュレーターが同じ値を使うので、どちらにも属さないここに置く。
+実機はこの公称値どおりには動かない（推定器は v_scale / omega_scale で差を補正する）。
+"""
+
+import math
+
+from .drive import MOTOR_LIMIT
+
+# --- キューブの運動モデルの定数（toio公式シミュレーターの値を参考） ---
+# マット座標 1単位 ≒ 1.36mm（411単位 / 560mm）
+MAT_UNITS_PER_MM = 411 / 560
+# モーター指令値 1 あたりの車輪速度 [mm/s]（4.3rpm × タイヤ直径25mm）
+MM_PER_SPEED_UNIT = 4.3 * math.pi * 25 / 60
+# 左右の車輪の間隔 [mm]
+WHEEL_BASE_MM = 26.6
+# この値より小さい指令値ではモーターが回らない
+MOTOR_DEAD_ZONE = 10
+# モーターの応答の時定数 [s]
+MOTOR_TIME_CONSTANT = 0.04
+
+# プレイマット（トイオ・コレクション付属）の読み取り範囲
+MAT_BOUNDS = (45, 45, 455, 455)
+
+
+def speed_from_param(value):
+    """ モーター指令値をマット座標系の車輪速度 [単位/s] に変換する """
+    value = max(min(value, MOTOR_LIMIT), -MOTOR_LIMIT)
+    if abs(value) < MOTOR_DEAD_ZONE:
+        return 0.0
+    return value * MM_PER_SPEED_UNIT * MAT_UNITS_PER_MM
@@ -0,0 +1,70 @@
+import asyncio
+
+from toio import NotificationCondition, ResponseIdNotificationSettings
+
+from .clock import REAL_CLOCK
+
+# ID通知を送る条件（toio の仕様）
+ALWAYS = NotificationCondition.Always                # 間隔ごとに必ず送る
+ON_CHANGE = NotificationCondition.ChangeDetection    # 座標が変わったときだけ送る
+ON_CHANGE_OR_300MS = NotificationCondition.Periodic  # 変わったとき + 変わらなくても 300ms ごとに送る
+CONDITION_NAMES = {ALWAYS: "常に", ON_CHANGE: "変化時", ON_CHANGE_OR_300MS: "変化時+300msごと"}
+
+# 止まっている間は通知を減らし、それでも notify 方式の制御が止まったままにならない条件
+DEFAULT_CONDITION = ON_CHANGE_OR_300MS
+INTERVAL_UNIT_MS = 10   # 設定できる間隔の刻み [ms]
+NOTIFIES_PER_STEP = 2   # poll のとき、制御1回の間に届けたい通知の数（座標は古くても周期の半分）
+RESPONSE_TIMEOUT = 1.0  # 設定の応答を待つ時間 [s]（対応していないファームウェアは応答しない）
+
+
+def interval_for_period(period, per_step=NOTIFIES_PER_STEP):
+    """ 制御周期 [s] に合わせた通知の最短間隔 [ms]（10ms 刻みに切り捨て、最短 10ms） """
+    ms = period * 1000 / per_step
+    return max(INTERVAL_UNIT_MS, int(ms // INTERVAL_UNIT_MS) * INTERVAL_UNIT_MS)
+
+
+class NotificationSettings:
+    """ 1台分のID通知の設定と、キューブが受け付けたかどうか """
+
+    def __init__(self, interval_ms, condition):
+        self.interval_ms = interval_ms
+        self.condition = condition
+        self.accepted = None  # True: 受理 / False: 拒否 / None: 応答なし（未対応のキューブなど）
+
+    def report(self, rate=None):
+        """ 設定と、rate [Hz]（実際に届いた通知の頻度）を1行にまとめる """
+        result = {True: "受理", False: "拒否", None: "応答なし"}[self.accepted]
+        text = (f"ID通知: 最短 {self.interval_ms}ms, "
+                f"{CONDITION_NAMES.get(self.condition, self.condition)} ({result})")
+        if rate is not None:
+            text += f", 実測 {rate:.1f}Hz (上限 {1000 / self.interval_ms:.0f}Hz)"
+        return text
+
+
+async def configure_id_notification(cube, interval_ms, condition=DEFAULT_CONDITION, clock=REAL_CLOCK,
+                                    timeout=RESPONSE_TIMEOUT):
+    """
+    キューブの設定（configuration）でID通知の最短間隔と条件を変え、応答を待って結果を返す。
+    設定の特性がないキューブや、timeout [s] 待っても応答がないときは accepted が None のまま。
+    """
+    settings = NotificationSettings(interval_ms, condition)
+    configuration = getattr(cube.api, "configuration", None)
+    if configuration is None:
+        return settings
+    response = asyncio.get_running_loop().create_future()
+
+    def on_response(payload):
+        if ResponseIdNotificationSettings.is_myself(payload) and not response.done():
+            response.set_result(ResponseIdNotificationSettings(payload).result)
+
+    await configuration.register_notification_handler(on_response)
+    try:
+        await configuration.set_id_notification(interval_ms, condition)
+        timer = asyncio.ensure_future(clock.sleep(timeout))
+        await asyncio.wait((response, timer), return_when=asyncio.FIRST_COMPLETED)
+        timer.cancel()
+        if response.done():
+            settings.accepted = response.result()
+    finally:
+        await configuration.unregister_notification_handler(on_response)
+    return settings
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+
+from .geometry import segment_distances
+
+
+class ObstacleSet:
+    """
+    マット上の円形の障害物の集まり。
+
+    障害物は一様グリッド（cell_size 四方のマス目）に登録しておき、
+    線分の判定では線分の近くのマスに入っている障害物だけをNumPyでまとめて調べる。
+    障害物が何百個あっても、1回の判定で調べる数は線分の周りの分だけで済む。
+    """
+
+    def __init__(self, centers, radii, cell_size=50.0):
+        self.centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+        self.radii = np.broadcast_to(np.asarray(radii, dtype=float), len(self.centers)).copy()
+        self.cell_size = float(cell_size)
+        self.max_radius = float(self.radii.max()) if len(self.radii) else 0.0
+        # 配置が同じなら同じ値になる識別子（経路のキャッシュのキーに使う）
+        self.key = hashlib.sha1(self.centers.tobytes() + self.radii.tobytes()).hexdigest()
+        self._build_grid()
+
+    @classmethod
+    def load(cls, path, cell_size=50.0):
+        """
+        JSONファイルから読み込む。形式:
+        {"obstacles": [{"x": 250, "y": 250, "r": 30}, ...]}
+        """
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        items = data["obstacles"]
+        centers = [(o["x"], o["y"]) for o in items]
+        radii = [o["r"] for o in items]
+        return cls(centers, radii, cell_size)
+
+    def save(self, path):
+        items = [{"x": float(x), "y": float(y), "r": float(r)}
+                 for (x, y), r in zip(self.centers, self.radii)]
+        Path(path).write_text(json.dumps({"obstacles": items}, indent=2), encoding="utf-8")
+
+    def __len__(self):
+        return len(self.centers)
+
+    # --- グリッド ---
+    def _cell(self, v):
+        return math.floor(v / self.cell_size)
+
+    def _build_grid(self):
+        cells = {}
+        for i, ((x, y), r) in enumerate(zip(self.centers, self.radii)):
+            for ix in range(self._cell(x - r), self._cell(x + r) + 1):
+                for iy in range(self._cell(y - r), self._cell(y + r) + 1):
+                    cells.setdefault((ix, iy), []).append(i)
+        self._grid = {key: np.array(items, dtype=np.intp) for key, items in cells.items()}
+
+    def candidates_near_segment(self, ax, ay, bx, by, margin=0.0):
+        """ 線分から margin 以内にかかるマスに登録されている障害物の番号を返す """
+        length = math.hypot(bx - ax, by - ay)
+        pieces = max(1, math.ceil(length / self.cell_size))
+        found = []
+        for k in range(pieces):
+            # 線分を cell_size 以下に区切り、それぞれの外接矩形 + margin のマスを見る
+            x0 = ax + (bx - ax) * k / pieces
+            y0 = ay + (by - ay) * k / pieces
+            x1 = ax + (bx - ax) * (k + 1) / pieces
+            y1 = ay + (by - ay) * (k + 1) / pieces
+            for ix in range(self._cell(min(x0, x1) - margin), self._cell(max(x0, x1) + margin) + 1):
+                for iy in range(self._cell(min(y0, y1) - margin), self._cell(max(y0, y1) + margin) + 1):
+                    items = self._grid.get((ix, iy))
+                    if items is not None:
+                        found.append(items)
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        return np.unique(np.concatenate(found))
+
+    # --- 判定 ---
+    def blocking(self, ax, ay, bx, by, margin=0.0):
+        """
+        線分 A→B が (半径 + margin) の円に当たる障害物の番号を、A に近い順に返す
+        """
+        idx = self.candidates_near_segment(ax, ay, bx, by, margin)
+        if len(idx) == 0:
+            return idx
+        dist, t = segment_distances(ax, ay, bx, by, self.centers[idx, 0], self.centers[idx, 1])
+        hit = dist < self.radii[idx] + margin
+        return idx[hit][np.argsort(t[hit], kind="stable")]
+
+    def first_blocking(self, ax, ay, bx, by, margin=0.0):
+        """ 線分を最初に塞いでいる障害物の番号（なければ -1） """
+        hits = self.blocking(ax, ay, bx, by, margin)
+        return int(hits[0]) if len(hits) else -1
+
+    def is_path_blocked(self, ax, ay, bx, by, margin=0.0):
+        return self.first_blocking(ax, ay, bx, by, margin) >= 0
+
+    def inflated(self, xs, ys, margin):
+        """ 障害物を (半径 + margin) だけ膨らませて塗ったマス (len(ys), len(xs))。xs, ys はマスの中心の座標（昇順） """
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        grid = np.zeros((len(ys), len(xs)), dtype=bool)
+        for (cx, cy), r in zip(self.centers, self.radii):
+            # 障害物の外接矩形の範囲だけ調べる
+            reach = r + margin
+            ix0, ix1 = np.searchsorted(xs, (cx - reach, cx + reach))
+            iy0, iy1 = np.searchsorted(ys, (cy - reach, cy + reach))
+            dx = xs[ix0:ix1] - cx
+            dy = ys[iy0:iy1, None] - cy
+            grid[iy0:iy1, ix0:ix1] |= dx * dx + dy * dy < reach * reach
+        return grid
+
+    def contains(self, x, y, margin=0.0):
+        """ 点 (x, y) がどれかの障害物の (半径 + margin) の内側にあるか """
+        return self.first_blocking(x, y, x, y, margin) >= 0
@@ -0,0 +1,113 @@
+import numpy as np
+
+# 軸のインデックス（errors / 出力配列の列番号）
+DIST = 0   # 距離（前進速度）
+ANGLE = 1  # 角度（旋回速度）
+N_AXES = 2
+
+
+class PIDBank:
+    """ N台 × 軸ごとのPIDをまとめて配列で計算するコントローラー """
+
+    def __init__(self, n_cubes, kp, ki, kd, out_limit, i_limit=None):
+        # ゲインや出力制限は (n_cubes, N_AXES) にブロードキャストして保持する
+        # 例: kp=(DIST_KP, ANGLE_KP) なら全キューブ共通のゲインになる
+        shape = (n_cubes, N_AXES)
+        self.n_cubes = n_cubes
+        self.kp = self._broadcast(kp, shape)
+        self.ki = self._broadcast(ki, shape)
+        self.kd = self._broadcast(kd, shape)
+        # 積分値の上限（None なら out_limit / ki から自動で決め、out_limit を変えるたびに決め直す）
+        self._auto_i_limit = i_limit is None
+        if not self._auto_i_limit:
+            self.i_limit = self._broadcast(i_limit, shape)
+        # 出力の上限（±out_limit に収める）
+        self.out_limit = out_limit
+
+        self.integral = np.zeros(shape)
+        self.prev_error = np.zeros(shape)
+        # 前回の偏差が有効かどうか（初回はD項を計算しない）
+        self.primed = np.zeros(n_cubes, dtype=bool)
+
+        # 毎tickの一時配列を使い回す（台数が増えても確保は増えない）
+        self._p = np.empty(shape)
+        self._d = np.empty(shape)
+        self._raw = np.empty(shape)
+        self._out = np.empty(shape)
+        self._next_i = np.empty(shape)
+        self._hold = np.empty(shape, dtype=bool)
+
+    @property
+    def out_limit(self):
+        """ 出力の上限 (n_cubes, N_AXES)。読み取り専用なので、変えるときは丸ごと代入する """
+        return self._out_limit
+
+    @out_limit.setter
+    def out_limit(self, value):
+        # 実行中に書き換えてもよい（自動で決めた積分の上限もここで追従させる）
+        self._out_limit = self._broadcast(value, (self.n_cubes, N_AXES))
+        self._out_limit.flags.writeable = False
+        if self._auto_i_limit:
+            with np.errstate(divide='ignore'):
+                self.i_limit = np.where(self.ki > 0, self._out_limit / self.ki, np.inf)
+
+    @staticmethod
+    def _broadcast(value, shape):
+        return np.array(np.broadcast_to(np.asarray(value, dtype=float), shape))
+
+    def reset(self, index=None):
+        """ 積分と前回偏差をクリアする（index=None なら全台） """
+        if index is None:
+            index = slice(None)
+        self.integral[index] = 0.0
+        self.prev_error[index] = 0.0
+        self.primed[index] = False
+
+    def update(self, errors, dt, rates=None):
+        """
+        偏差 errors (n_cubes, N_AXES) と経過時間 dt [s] から操作量を返す。
+        dt はスカラーまたは (n_cubes,) の配列。戻り値は ±out_limit に制限済みで、
+        次の update で上書きされる（残したい場合はコピーする）。
+        rates (n_cubes, N_AXES) に偏差の変化率（PoseEstimator.error_rates など）を渡すと、
+        D項は前回との差分ではなくその値から計算する。
+        """
+        errors = np.asarray(errors, dtype=float)
+        dt = np.asarray(dt, dtype=float)
+        if dt.ndim == 1:
+            dt = dt[:, None]
+        valid = dt > 0
+
+        # P項
+        np.multiply(errors, self.kp, out=self._p)
+
+        # I項（候補値）
+        np.multiply(errors, dt, out=self._next_i)
+        self._next_i += self.integral
+        np.clip(self._next_i, -self.i_limit, self.i_limit, out=self._next_i)
+
+        # D項（差分から計算するときは、初回と dt<=0 のときは 0）
+        if rates is not None:
+            np.multiply(rates, self.kd, out=self._d)
+        else:
+            np.subtract(errors, self.prev_error, out=self._d)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.divide(self._d, dt, out=self._d)
+            self._d *= self.kd
+            self._d[~self.primed] = 0.0
+            np.copyto(self._d, 0.0, where=~np.broadcast_to(valid, self._d.shape))
+
+        # 合計して出力制限
+        np.multiply(self._next_i, self.ki, out=self._raw)
+        self._raw += self._p
+        self._raw += self._d
+        np.clip(self._raw, -self.out_limit, self.out_limit, out=self._out)
+
+        # アンチワインドアップ：飽和していて、さらに同じ向きへ積もる場合は積分を止める
+        np.not_equal(self._raw, self._out, out=self._hold)
+        self._hold &= (np.sign(errors) == np.sign(self._raw))
+        self._hold |= ~np.broadcast_to(valid, self._hold.shape)
+        np.copyto(self.integral, self._next_i, where=~self._hold)
+
+        self.prev_error[...] = errors
+        self.primed[:] = True
+        return self._out
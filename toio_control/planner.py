@@ -0,0 +1,270 @@
+import heapq
+import math
+
+import numpy as np
+
+from .model import MAT_BOUNDS
+
+# 8近傍の移動（dx, dy, コスト）
+# コストは整数（縦横10・斜め14）にして、キーの比較で丸め誤差が出ないようにする
+_NEIGHBORS = tuple(
+    (dx, dy, 14 if dx and dy else 10)
+    for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy
+)
+
+
+class DStarLite:
+    """
+    格子上の D* Lite 探索（ゴールから逆向きに探索する）。
+
+    一度 compute() した後は、塞がったマス・空いたマスだけを update_cells() で伝えれば
+    影響のあるところだけを計算し直す。スタート（キューブの位置）が動いても作り直さなくてよい。
+    blocked は (高さ, 幅) の bool 配列。マスの番号は iy * 幅 + ix。
+    """
+
+    def __init__(self, blocked, goal):
+        self.height, self.width = blocked.shape
+        self.blocked = blocked.ravel().copy()
+        n = self.blocked.size
+        self.g = np.full(n, np.inf)
+        self.rhs = np.full(n, np.inf)
+        self.goal = goal
+        self.start = goal
+        self._last_start = goal
+        self._km = 0.0
+        self._queue = []
+        self._keys = {}  # キューに入っているマス → 現在のキー（古いエントリは取り出すときに捨てる）
+        self.expanded = 0
+        self.rhs[goal] = 0.0
+        self._push(goal)
+
+    # --- 格子 ---
+    def _xy(self, s):
+        return s % self.width, s // self.width
+
+    def _heuristic(self, a, b):
+        ax, ay = self._xy(a)
+        bx, by = self._xy(b)
+        dx, dy = abs(ax - bx), abs(ay - by)
+        return 10 * max(dx, dy) + 4 * min(dx, dy)
+
+    def _neighbors(self, s):
+        """ s から移動できるマスとコスト（壁の角をすり抜ける斜め移動はしない） """
+        x, y = self._xy(s)
+        w, h, blocked = self.width, self.height, self.blocked
+        for dx, dy, cost in _NEIGHBORS:
+            nx, ny = x + dx, y + dy
+            if not (0 <= nx < w and 0 <= ny < h):
+                continue
+            n = ny * w + nx
+            if blocked[s] or blocked[n]:
+                yield n, math.inf
+            elif dx and dy and (blocked[y * w + nx] or blocked[ny * w + x]):
+                yield n, math.inf
+            else:
+                yield n, cost
+
+    # --- 優先度付きキュー ---
+    def _key(self, s):
+        m = min(self.g[s], self.rhs[s])
+        return (m + self._heuristic(self.start, s) + self._km, m)
+
+    def _push(self, s):
+        key = self._key(s)
+        self._keys[s] = key
+        heapq.heappush(self._queue, (key, s))
+
+    def _top(self):
+        # 古くなったエントリを読み飛ばす
+        while self._queue:
+            key, s = self._queue[0]
+            if self._keys.get(s) == key:
+                return key, s
+            heapq.heappop(self._queue)
+        return (math.inf, math.inf), None
+
+    def _update_vertex(self, s):
+        if s != self.goal:
+            self.rhs[s] = min((cost + self.g[n] for n, cost in self._neighbors(s)), default=math.inf)
+        self._keys.pop(s, None)
+        if self.g[s] != self.rhs[s]:
+            self._push(s)
+
+    # --- 探索 ---
+    def move_start(self, start):
+        """ スタート地点を変える（キューの並べ直しは不要） """
+        self._km += self._heuristic(self._last_start, start)
+        self._last_start = start
+        self.start = start
+
+    def update_cells(self, cells, blocked):
+        """ cells のマスの通れる/通れないが blocked (bool, 平らな配列) に変わったことを反映する """
+        self._km += self._heuristic(self._last_start, self.start)
+        self._last_start = self.start
+        self.blocked[cells] = blocked[cells]
+        touched = set()
+        for s in cells:
+            s = int(s)
+            touched.add(s)
+            touched.update(self._adjacent(s))
+        for s in touched:
+            self._update_vertex(s)
+
+    def _adjacent(self, s):
+        """ 通れるかどうかに関係なく、s のまわりのマス """
+        x, y = self._xy(s)
+        for dx, dy, _ in _NEIGHBORS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.width and 0 <= ny < self.height:
+                yield ny * self.width + nx
+
+    def compute(self):
+        """ スタートの最短距離が確定するまで探索を進める """
+        start = self.start
+        while True:
+            top_key, u = self._top()
+            if u is None or (top_key >= self._key(start) and self.rhs[start] == self.g[start]):
+                break
+            new_key = self._key(u)
+            if top_key < new_key:
+                self._push(u)
+                continue
+            del self._keys[u]
+            heapq.heappop(self._queue)
+            self.expanded += 1
+            if self.g[u] > self.rhs[u]:
+                self.g[u] = self.rhs[u]
+                for n, _ in self._neighbors(u):
+                    self._update_vertex(n)
+            else:
+                self.g[u] = math.inf
+                self._update_vertex(u)
+                for n, _ in self._neighbors(u):
+                    self._update_vertex(n)
+        return self.g[start]
+
+    def path(self):
+        """ スタートからゴールまでのマスの列（たどり着けなければ None） """
+        s = self.start
+        if math.isinf(self.g[s]):
+            return None
+        cells = [s]
+        for _ in range(self.blocked.size):
+            if s == self.goal:
+                return cells
+            s = min(self._neighbors(s), key=lambda item: item[1] + self.g[item[0]])[0]
+            cells.append(s)
+        return None
+
+
+class PathPlanner:
+    """
+    マット全体を resolution 四方のマスに区切って障害物を避ける経路を作る。
+
+    障害物は (半径 + clearance) だけ膨らませてマスに塗り、D* Lite で最短経路を探したあと、
+    障害物に当たらない範囲で経由点を間引いて返す。
+    obstacles には ObstacleSet のほか、距離場を作っておいた CostMap も渡せる（判定が表引きになる）。
+    経路は (スタートのマス, ゴールのマス, 障害物) ごとに覚えておき、同じ条件なら計算しない。
+    ゴールごとの探索状態も残しておくので、障害物が変わったときは変わったマスの分だけ直す。
+
+    >>> planner = PathPlanner(clearance=30)
+    >>> path = planner.plan((x, y), GOAL_POS, obstacles)  # [(x, y), ..., GOAL_POS]
+    """
+
+    def __init__(self, bounds=MAT_BOUNDS, resolution=10.0, clearance=30.0, cache_size=64):
+        self.x0, self.y0, x1, y1 = bounds
+        self.resolution = float(resolution)
+        self.clearance = float(clearance)
+        self.width = math.ceil((x1 - self.x0) / self.resolution)
+        self.height = math.ceil((y1 - self.y0) / self.resolution)
+        self.cache_size = cache_size
+        self._paths = {}
+        self._grids = {}
+        self._searches = {}
+        # 計算した回数の記録
+        self.plans = 0
+        self.cache_hits = 0
+        self.repairs = 0
+
+    # --- マスと座標の変換 ---
+    def cell_of(self, x, y):
+        ix = min(max(int((x - self.x0) // self.resolution), 0), self.width - 1)
+        iy = min(max(int((y - self.y0) // self.resolution), 0), self.height - 1)
+        return iy * self.width + ix
+
+    def center_of(self, cell):
+        ix, iy = cell % self.width, cell // self.width
+        return (self.x0 + (ix + 0.5) * self.resolution,
+                self.y0 + (iy + 0.5) * self.resolution)
+
+    def occupancy(self, obstacles):
+        """ 障害物を (半径 + clearance) だけ膨らませて塗ったマス (高さ, 幅) を返す """
+        grid = self._grids.get(obstacles.key)
+        if grid is not None:
+            return grid
+        xs = self.x0 + (np.arange(self.width) + 0.5) * self.resolution
+        ys = self.y0 + (np.arange(self.height) + 0.5) * self.resolution
+        grid = obstacles.inflated(xs, ys, self.clearance)
+        self._grids = {obstacles.key: grid}
+        return grid
+
+    # --- 経路 ---
+    def plan(self, start, goal, obstacles):
+        """ start から goal までの経由点のリスト（最後は goal）。行けなければ None """
+        start_cell = self.cell_of(*start)
+        goal_cell = self.cell_of(*goal)
+        cache_key = (start_cell, goal_cell, obstacles.key)
+        if cache_key in self._paths:
+            self.cache_hits += 1
+            via = self._paths[cache_key]
+        else:
+            cells = self._search(start_cell, goal_cell, obstacles)
+            via = None if cells is None else self._shortcut([self.center_of(c) for c in cells], obstacles)
+            if len(self._paths) >= self.cache_size:
+                del self._paths[next(iter(self._paths))]
+            self._paths[cache_key] = via
+        if via is None:
+            return None
+        # 両端のマスの中心は、実際のスタート・ゴールに置き換える
+        return [tuple(start)] + via[1:-1] + [tuple(goal)]
+
+    def _search(self, start_cell, goal_cell, obstacles):
+        self.plans += 1
+        blocked = self.occupancy(obstacles)
+        flat = blocked.ravel()
+        if flat[goal_cell]:
+            return None
+        search = self._searches.get(goal_cell)
+        if search is None:
+            search = DStarLite(blocked, goal_cell)
+            self._searches = {goal_cell: search}
+        else:
+            changed = np.flatnonzero(search.blocked != flat)
+            if len(changed):
+                self.repairs += 1
+                search.update_cells(changed, flat)
+        # 膨らませた範囲の中から出発するときは、いちばん近い空きマスから探す
+        first = start_cell
+        if flat[start_cell]:
+            free = np.flatnonzero(~flat)
+            ix, iy = start_cell % self.width, start_cell // self.width
+            first = int(free[np.argmin((free % self.width - ix) ** 2 + (free // self.width - iy) ** 2)])
+        search.move_start(first)
+        search.compute()
+        cells = search.path()
+        if cells is None:
+            return None
+        return ([start_cell] if first != start_cell else []) + cells
+
+    def _shortcut(self, points, obstacles):
+        """ 障害物に当たらずまっすぐ行ける経由点は飛ばす """
+        margin = self.clearance - self.resolution
+        result = [points[0]]
+        i = 0
+        while i < len(points) - 1:
+            j = len(points) - 1
+            while j > i + 1 and obstacles.is_path_blocked(*points[i], *points[j], margin):
+                j -= 1
+            result.append(points[j])
+            i = j
+        return result
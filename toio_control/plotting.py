@@ -0,0 +1,197 @@
+import math
+import multiprocessing
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .telemetry import TELEMETRY_DTYPE, iter_chunks
+
+# グラフに描く列（(グラフ番号, 列名, ラベル, 線のスタイル)）
+PLOT_SERIES = (
+    (0, "distance", "Target Distance", dict(color="blue")),
+    (1, "target_angle", "Target Angle", dict(color="green", linestyle="--")),
+    (1, "current_angle", "Current Angle", dict(color="orange")),
+    (2, "left_speed", "Left", dict(color="red", alpha=0.7)),
+    (2, "right_speed", "Right", dict(color="blue", alpha=0.7)),
+)
+Y_LABELS = ("Distance (mm)", "Angle (deg)", "Speed")
+# ライブ表示のときの縦軸の範囲（固定しておくと軸を描き直さずに済む）
+LIVE_Y_LIMITS = ((0, 400), (-180, 360), (-100, 100))
+
+
+# --- 間引き ---
+def minmax_downsample(t, y, bucket):
+    """
+    bucket 行ずつのかたまりごとに最小値と最大値の2点だけを残す（順番は時刻順のまま）。
+    ピークを落とさずに点数を 2/bucket に減らせる。len(y) は bucket の倍数であること。
+    """
+    if bucket <= 1:
+        return np.asarray(t), np.asarray(y)
+    tb = np.asarray(t).reshape(-1, bucket)
+    yb = np.asarray(y).reshape(-1, bucket)
+    i_min = yb.argmin(axis=1)
+    i_max = yb.argmax(axis=1)
+    lo = np.minimum(i_min, i_max)
+    hi = np.maximum(i_min, i_max)
+    rows = np.arange(len(yb))
+    t_out = np.column_stack((tb[rows, lo], tb[rows, hi])).ravel()
+    y_out = np.column_stack((yb[rows, lo], yb[rows, hi])).ravel()
+    return t_out, y_out
+
+
+def load_downsampled(log_dir, max_points=4000):
+    """
+    保存したチャンクを1つずつ読みながら間引き、列ごとに最大 max_points 点程度の
+    (時刻, 値) を返す。走行時間が長くても使うメモリと描画時間はほぼ一定。
+    """
+    total = sum(len(chunk) for chunk in iter_chunks(log_dir))
+    if total == 0:
+        return None
+    bucket = max(1, math.ceil(total / (max_points // 2)))
+
+    parts = {name: ([], []) for _, name, _, _ in PLOT_SERIES}
+    start_time = None
+    leftover = np.empty(0, TELEMETRY_DTYPE)
+
+    def reduce(rows, size):
+        for name, (ts, ys) in parts.items():
+            t, y = minmax_downsample(rows["time"] - start_time, rows[name], size)
+            ts.append(t)
+            ys.append(y)
+
+    for chunk in iter_chunks(log_dir):
+        if start_time is None:
+            start_time = chunk["time"][0]
+        rows = np.concatenate((leftover, chunk)) if len(leftover) else chunk
+        n_full = len(rows) // bucket * bucket
+        if n_full:
+            reduce(rows[:n_full], bucket)
+        leftover = np.array(rows[n_full:])
+    if len(leftover):
+        reduce(leftover, len(leftover))
+
+    return {name: (np.concatenate(ts), np.concatenate(ys)) for name, (ts, ys) in parts.items()}
+
+
+def plot_log(log_dir, output="log_graph.png", max_points=4000, show=False):
+    """ 保存した走行ログを間引いてから描き、output に保存する """
+    import matplotlib.pyplot as plt
+
+    series = load_downsampled(log_dir, max_points) if log_dir else None
+    if series is None:
+        print("データがありません")
+        return False
+
+    fig, axes = plt.subplots(3, 1, figsize=(10, 12), sharex=True)
+    for index, name, label, style in PLOT_SERIES:
+        t, y = series[name]
+        axes[index].plot(t, y, label=label, **style)
+    for ax, ylabel in zip(axes, Y_LABELS):
+        ax.set_ylabel(ylabel)
+        ax.grid(True); ax.legend()
+    axes[-1].set_xlabel('Time (s)')
+
+    plt.tight_layout()
+    plt.savefig(output) # 画像保存
+    print(f"グラフを '{output}' に保存しました。")
+    if show:
+        plt.show()
+    plt.close(fig)
+    return True
+
+
+# --- ライブ表示 ---
+class LiveDashboard:
+    """
+    走行中のログをリアルタイムに表示するダッシュボード。
+
+    グラフは別プロセスで描くので、制御ループ側は push() で共有メモリに
+    1行書き込むだけ（描画の重さでモーター指令が遅れない）。
+    描画側は fps ごとに直近 window_s 秒分を読み、blit で線だけを描き直す。
+
+    >>> dashboard = LiveDashboard()
+    >>> dashboard.start()
+    >>> telemetry.add_listener(dashboard.push)
+    """
+
+    def __init__(self, window_s=20.0, fps=10, capacity=4096):
+        self.window_s = window_s
+        self.fps = fps
+        self.capacity = capacity
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=8 + capacity * TELEMETRY_DTYPE.itemsize)
+        self._count = np.ndarray(1, np.int64, buffer=self._shm.buf)
+        self._rows = np.ndarray(capacity, TELEMETRY_DTYPE, buffer=self._shm.buf, offset=8)
+        self._count[0] = 0
+        self._process = None
+
+    def start(self):
+        self._process = multiprocessing.get_context("spawn").Process(
+            target=_dashboard_main,
+            args=(self._shm.name, self.capacity, self.window_s, self.fps),
+            daemon=True,
+        )
+        self._process.start()
+
+    def push(self, row):
+        """ 1行追加する（TelemetryRecorder のリスナーとして使う） """
+        count = int(self._count[0])
+        self._rows[count % self.capacity] = row
+        self._count[0] = count + 1
+
+    def close(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+        # ndarray が共有メモリを参照したままだと close できないので先に外す
+        self._count = self._rows = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+def _dashboard_main(shm_name, capacity, window_s, fps):
+    """ 描画プロセス側：共有メモリから直近のデータを読んで blit で描く """
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    count = np.ndarray(1, np.int64, buffer=shm.buf)
+    rows = np.ndarray(capacity, TELEMETRY_DTYPE, buffer=shm.buf, offset=8)
+
+    fig, axes = plt.subplots(3, 1, figsize=(10, 12), sharex=True)
+    lines = []
+    for index, name, label, style in PLOT_SERIES:
+        line, = axes[index].plot([], [], label=label, animated=True, **style)
+        lines.append((name, line))
+    for ax, ylabel, ylim in zip(axes, Y_LABELS, LIVE_Y_LIMITS):
+        # 横軸は「何秒前か」で固定する → 軸を描き直さずに blit できる
+        ax.set_xlim(-window_s, 0)
+        ax.set_ylim(*ylim)
+        ax.set_ylabel(ylabel)
+        ax.grid(True); ax.legend(loc="upper left")
+    axes[-1].set_xlabel('Time (s, 0 = now)')
+
+    def update(_frame):
+        n = int(count[0])
+        if n == 0:
+            return [line for _, line in lines]
+        k = min(n, capacity)
+        # リングバッファを古い順に並べ直す
+        idx = np.arange(n - k, n) % capacity
+        recent = rows[idx]
+        t = recent["time"] - recent["time"][-1]
+        keep = t >= -window_s
+        for name, line in lines:
+            line.set_data(t[keep], recent[name][keep])
+        return [line for _, line in lines]
+
+    animation = FuncAnimation(fig, update, interval=1000 / fps, blit=True,
+                              cache_frame_data=False)
+    plt.show()
+
+
+if __name__ == '__main__':
+    # 保存済みのログを描く: python -m toio_control.plotting logs/20250101-120000 [出力ファイル]
+    plot_log(sys.argv[1], *(sys.argv[2:3] or ["log_graph.png"]))
@@ -0,0 +1,134 @@
+import math
+
+import numpy as np
+
+from .clock import REAL_CLOCK
+
+# ヒストグラムの刻み [s]
+DEFAULT_BIN_WIDTH = 0.001
+
+
+class TimingStats:
+    """
+    制御周期の記録。実際の周期と、締め切りからの遅れ（ジッタ）をヒストグラムに数える。
+    範囲（周期の4倍）を超えた値は最後の bin にまとめる。
+    """
+
+    def __init__(self, period, bin_width=DEFAULT_BIN_WIDTH, max_value=None):
+        self.period = period
+        self.bin_width = bin_width
+        max_value = max_value if max_value is not None else 4 * period
+        n_bins = int(math.ceil(max_value / bin_width)) + 1
+        self.period_hist = np.zeros(n_bins, dtype=np.int64)
+        self.jitter_hist = np.zeros(n_bins, dtype=np.int64)
+        self.ticks = 0
+        self.overruns = 0   # 締め切りまでに前の周期の処理が終わらなかった回数
+        self.missed = 0     # 1周期以上遅れて飛ばした周期の数
+        self.period_sum = 0.0
+        self.period_max = 0.0
+        self.jitter_max = 0.0
+
+    def record(self, period, jitter):
+        last = len(self.period_hist) - 1
+        # ちょうど境目の値（50ms など）が丸め誤差で1つ下の bin に入らないよう少し足す
+        self.period_hist[min(int(period / self.bin_width + 1e-6), last)] += 1
+        self.jitter_hist[min(int(max(jitter, 0.0) / self.bin_width + 1e-6), last)] += 1
+        self.ticks += 1
+        self.period_sum += period
+        self.period_max = max(self.period_max, period)
+        self.jitter_max = max(self.jitter_max, jitter)
+
+    def _percentile(self, hist, q):
+        """ ヒストグラムから q 分位を求める（bin の下端 [s]） """
+        total = hist.sum()
+        if total == 0:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(hist), q * total))
+        return index * self.bin_width
+
+    def summary(self):
+        """ 周期とジッタの統計（ミリ秒）を返す """
+        if self.ticks == 0:
+            return {}
+        mean = self.period_sum / self.ticks
+        return {
+            "ticks": self.ticks,
+            "target_hz": 1 / self.period,
+            "rate_hz": 1 / mean if mean > 0 else 0.0,
+            "mean_period_ms": mean * 1000,
+            "p50_period_ms": self._percentile(self.period_hist, 0.50) * 1000,
+            "p99_period_ms": self._percentile(self.period_hist, 0.99) * 1000,
+            "max_period_ms": self.period_max * 1000,
+            "p99_jitter_ms": self._percentile(self.jitter_hist, 0.99) * 1000,
+            "max_jitter_ms": self.jitter_max * 1000,
+            "overruns": self.overruns,
+            "missed": self.missed,
+        }
+
+    def to_dict(self):
+        """ 統計とヒストグラム（JSON にそのまま書ける形）を返す """
+        data = self.summary()
+        data["bin_width_ms"] = self.bin_width * 1000
+        data["period_hist"] = self.period_hist.tolist()
+        data["jitter_hist"] = self.jitter_hist.tolist()
+        return data
+
+    def report(self):
+        s = self.summary()
+        if not s:
+            return "周期: 記録なし"
+        return (f"周期: {s['rate_hz']:.1f}Hz (目標 {s['target_hz']:.1f}Hz), "
+                f"平均 {s['mean_period_ms']:.1f}ms, p99 {s['p99_period_ms']:.0f}ms, "
+                f"最大 {s['max_period_ms']:.1f}ms / ジッタ p99 {s['p99_jitter_ms']:.0f}ms, "
+                f"最大 {s['max_jitter_ms']:.1f}ms / 超過 {s['overruns']}回, 飛ばした周期 {s['missed']}回")
+
+
+class RateScheduler:
+    """
+    一定周期で制御を回すためのスケジューラ。
+
+    「処理のあとに period だけ sleep する」と、周期が period + 計算 + 書き込みの時間に延びていく。
+    ここでは締め切り（開始時刻 + k × period）を単調増加時計で決め、そこまでだけ待つ。
+    処理が延びた周期の次は待ち時間を短くして取り戻し、1周期以上遅れたときは
+    飛ばした周期を連続で回さずに次の締め切りに合わせ直す。
+
+    >>> scheduler = RateScheduler(0.05, clock)
+    >>> scheduler.start()
+    >>> while ...:
+    >>>     ...  # 制御
+    >>>     dt = await scheduler.wait()  # 前回からの実際の経過時間
+    """
+
+    def __init__(self, period, clock=REAL_CLOCK, stats=None):
+        self.period = period
+        self.clock = clock
+        self.stats = stats if stats is not None else TimingStats(period)
+        self.deadline = None
+        self.last_tick = None
+
+    def start(self):
+        """ 今を最初の tick にする """
+        self.deadline = self.last_tick = self.clock.now()
+
+    async def wait(self):
+        """ 次の締め切りまで待ち、前回の tick からの実際の経過時間 dt [s] を返す """
+        if self.deadline is None:
+            self.start()
+            return 0.0
+        self.deadline += self.period
+        now = self.clock.now()
+        if now < self.deadline:
+            await self.clock.sleep(self.deadline - now)
+            now = self.clock.now()
+        else:
+            self.stats.overruns += 1
+        late = now - self.deadline
+        if late >= self.period:
+            skipped = int(late // self.period)
+            self.stats.missed += skipped
+            self.deadline += skipped * self.period
+            late -= skipped * self.period
+        dt = now - self.last_tick
+        self.last_tick = now
+        self.stats.record(dt, late)
+        return dt
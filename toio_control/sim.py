@@ -0,0 +1,319 @@
+import asyncio
+import math
+import struct
+
+from toio import MotorResponseCode, MovementType, NotificationCondition, Speed, SpeedChangeType, TargetPosition
+from toio.cube.notification_handler_info import NotificationHandlerInfo
+
+from .clock import VirtualClock
+from .decode import POSITION_ID, POSITION_ID_MISSED
+from .model import (MAT_BOUNDS, MAT_UNITS_PER_MM, MOTOR_DEAD_ZONE, MOTOR_TIME_CONSTANT, WHEEL_BASE_MM,
+                    speed_from_param)
+
+# --- シミュレーターの定数（キューブとマットの物理的な定数は model.py） ---
+# ID通知の間隔 [s]（設定で最短間隔を変えても、これより短くはならない）
+DEFAULT_NOTIFY_INTERVAL = 0.01
+# 条件が「変化時+300msごと」のとき、変化がなくても通知する間隔 [s]
+PERIODIC_NOTIFY_INTERVAL = 0.3
+
+# 目標指定制御（キューブ内蔵の制御）の動き
+TARGET_REACH = 8           # この距離まで近づいたら到着とする
+TARGET_TURN_ANGLE = 20     # Linear のとき、向きの差がこれより大きければその場で回る
+TARGET_TURN_SPEED = 40     # その場で回るときの速さ
+TARGET_DEFAULT_TIMEOUT = 10  # timeout=0 のときの制限時間 [s]
+
+# モーターの応答の種類（ResponseMotorControlTarget / ResponseMotorControlMultipleTargets）
+RESPONSE_TARGET = 0x83
+RESPONSE_MULTIPLE_TARGETS = 0x84
+# ID通知の設定への応答（ResponseIdNotificationSettings: [種類, 予約, 結果]）
+RESPONSE_ID_NOTIFICATION = 0x98
+
+# IdInformation の生データ形式（toio-py の PositionId / PositionIdMissed と同じ）
+_POSITION_ID = struct.Struct("<BHHHHHH")
+_POSITION_ID_MISSED = bytes((POSITION_ID_MISSED,))
+
+
+class _SimCharacteristic:
+    """ 通知ハンドラの登録と呼び出しだけを持つ、キャラクタリスティックの代わり """
+
+    def __init__(self, cube):
+        self._cube = cube
+        self._handlers = []
+
+    async def register_notification_handler(self, handler, misc=None):
+        info = NotificationHandlerInfo(handler, self._cube, self._cube, misc)
+        self._handlers.append((handler, info))
+        return True
+
+    async def unregister_notification_handler(self, handler):
+        self._handlers = [(h, i) for h, i in self._handlers if h != handler]
+        return True
+
+    def _notify(self, payload):
+        for handler, info in list(self._handlers):
+            args = (payload,) if info.num_of_args == 1 else (payload, info)
+            if info.is_async:
+                asyncio.get_running_loop().create_task(handler(*args))
+            else:
+                handler(*args)
+
+
+class SimIdInformation(_SimCharacteristic):
+    async def read(self):
+        from toio import IdInformation
+        return IdInformation.is_my_data(self._cube.id_payload())
+
+
+class SimMotor(_SimCharacteristic):
+    async def motor_control(self, left, right, duration_ms=None):
+        # BLE の書き込みにかかる時間の代わり
+        if self._cube.write_latency > 0:
+            await self._cube.clock.sleep(self._cube.write_latency)
+        self._cube.set_motor(left, right, duration_ms)
+
+    async def motor_control_target(self, timeout, movement_type, speed, target):
+        if self._cube.write_latency > 0:
+            await self._cube.clock.sleep(self._cube.write_latency)
+        self._cube.start_targets(RESPONSE_TARGET, timeout, movement_type, speed, [target])
+
+    async def motor_control_multiple_targets(self, timeout, movement_type, speed, mode, target_list):
+        if self._cube.write_latency > 0:
+            await self._cube.clock.sleep(self._cube.write_latency)
+        if not self._cube.multiple_targets:
+            # 古いファームウェアの代わり（複数目標指定に対応していない）
+            self._cube.respond(RESPONSE_MULTIPLE_TARGETS, MotorResponseCode.ERROR_NOT_SUPPORTED)
+            return
+        self._cube.start_targets(RESPONSE_MULTIPLE_TARGETS, timeout, movement_type, speed, target_list)
+
+
+class SimConfiguration(_SimCharacteristic):
+    async def set_id_notification(self, interval_ms, condition):
+        if self._cube.write_latency > 0:
+            await self._cube.clock.sleep(self._cube.write_latency)
+        self._cube.set_id_notification(interval_ms, condition)
+        self._notify(bytearray((RESPONSE_ID_NOTIFICATION, 0x00, 0x00)))
+
+
+class SimIndicator:
+    def __init__(self, cube):
+        self._cube = cube
+
+    async def turn_on(self, param):
+        self._cube.indicator = param
+
+    async def turn_off_all(self):
+        self._cube.indicator = None
+
+
+class SimApi:
+    def __init__(self, cube):
+        self.id_information = SimIdInformation(cube)
+        self.motor = SimMotor(cube)
+        self.configuration = SimConfiguration(cube)
+        self.indicator = SimIndicator(cube)
+
+
+class SimulatedCube:
+    """
+    ToioCoreCube の代わりに使えるシミュレーター。
+
+    差動二輪の運動モデルで姿勢を進め、実機と同じ形式のID通知（bytearray）を
+    登録されたハンドラに送る。時間は VirtualClock で進むので実時間より速く動かせる。
+
+    >>> clock = VirtualClock()
+    >>> async with SimulatedCube(clock, x=150, y=150) as cube:
+    >>>     await cube.api.motor.motor_control(50, 50)
+    >>>     await clock.sleep(1.0)
+    """
+
+    def __init__(self, clock=None, x=250, y=250, angle=0, name=None,
+                 notify_interval=DEFAULT_NOTIFY_INTERVAL, mat_bounds=MAT_BOUNDS, write_latency=0.0,
+                 multiple_targets=True, notify_latency=0.0):
+        self.clock = clock if clock is not None else VirtualClock()
+        self.name = name
+        self.x = float(x)
+        self.y = float(y)
+        self.angle = float(angle)
+        self.notify_interval = notify_interval
+        self.mat_bounds = mat_bounds
+        self.write_latency = write_latency    # モーター指令1回の書き込みにかかる時間 [s]
+        self.notify_latency = notify_latency  # ID通知が届くまでにかかる時間 [s]
+        self.api = SimApi(self)
+        self.indicator = None
+
+        # モーターの状態（指令値 → 実際の車輪速度 [単位/s]）
+        self.command = (0, 0)
+        self.wheel_left = 0.0
+        self.wheel_right = 0.0
+        self._motor_remaining = None  # duration_ms 指定時の残り時間
+
+        # 目標指定制御の状態
+        self.multiple_targets = multiple_targets  # 複数目標指定に対応しているか
+        self._targets = []
+        self._target_response = None
+        self._target_remaining = 0.0
+        self._target_linear = False
+        self._target_speed = None
+
+        self.notify_condition = NotificationCondition.Always
+        self._since_notify = 0.0
+        self._since_sent = 0.0      # 最後にID通知を送ってからの時間
+        self._last_sent = None      # 最後に送ったID通知
+        self._connected = False
+        self.motor_writes = 0
+        self.notifications = 0
+
+    # --- ToioCoreCube と同じ接続インターフェース ---
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def connect(self):
+        self.clock.attach(self)
+        self._connected = True
+        return True
+
+    async def disconnect(self):
+        self.clock.detach(self)
+        self._connected = False
+        return True
+
+    def is_connect(self):
+        return self._connected
+
+    # --- シミュレーション本体 ---
+    def is_on_mat(self):
+        x0, y0, x1, y1 = self.mat_bounds
+        return x0 <= self.x <= x1 and y0 <= self.y <= y1
+
+    def id_payload(self):
+        """ 現在の姿勢から IdInformation の生データを作る """
+        if not self.is_on_mat():
+            return bytearray(_POSITION_ID_MISSED)
+        x, y, angle = int(round(self.x)), int(round(self.y)), int(round(self.angle)) % 360
+        return bytearray(_POSITION_ID.pack(POSITION_ID, x, y, angle, x, y, angle))
+
+    def set_id_notification(self, interval_ms, condition):
+        """ ID通知の最短間隔（10ms 刻み）と条件を変える """
+        interval = int(interval_ms) // 10 * 10 / 1000
+        self.notify_interval = max(interval, DEFAULT_NOTIFY_INTERVAL)
+        self.notify_condition = NotificationCondition(condition)
+
+    def set_motor(self, left, right, duration_ms=None):
+        # 目標指定制御の途中なら上書きされたことを知らせる
+        if self._targets:
+            self._finish_targets(MotorResponseCode.SUCCESS_WITH_OVERWRITE)
+        self.command = (left, right)
+        self._motor_remaining = duration_ms / 1000 if duration_ms else None
+        self.motor_writes += 1
+
+    # --- 目標指定制御（キューブ内蔵の制御の代わり） ---
+    def respond(self, response, code):
+        """ モーターの応答（[種類, 制御識別値, 応答コード]）を通知する """
+        self.api.motor._notify(bytearray((response, 0, code.value)))
+
+    def start_targets(self, response, timeout, movement_type, speed, targets):
+        self.motor_writes += 1
+        if self._targets:
+            self._finish_targets(MotorResponseCode.SUCCESS_WITH_OVERWRITE)
+        if not self.is_on_mat():
+            self.respond(response, MotorResponseCode.ERROR_ID_MISSED)
+            return
+        if not isinstance(speed, Speed):
+            speed = Speed.from_int(*speed)
+        points = []
+        for target in targets:
+            if not isinstance(target, TargetPosition):
+                target = TargetPosition.from_int(*target)
+            point = target.cube_location.point
+            points.append((point.x, point.y))
+        self._targets = points
+        self._target_response = response
+        self._target_remaining = timeout or TARGET_DEFAULT_TIMEOUT
+        self._target_linear = MovementType(movement_type) == MovementType.Linear
+        self._target_speed = speed
+        self._motor_remaining = None
+
+    def _finish_targets(self, code):
+        self._targets = []
+        self.command = (0, 0)
+        self.respond(self._target_response, code)
+
+    def _drive_to_target(self, dt):
+        """ 目標に向かう左右の指令値を決める（着いたら次の目標へ） """
+        self._target_remaining -= dt
+        if self._target_remaining <= 0:
+            self._finish_targets(MotorResponseCode.ERROR_TIMEOUT)
+            return
+        if not self.is_on_mat():
+            self._finish_targets(MotorResponseCode.ERROR_ID_MISSED)
+            return
+        tx, ty = self._targets[0]
+        dx, dy = tx - self.x, ty - self.y
+        distance = math.hypot(dx, dy)
+        if distance < TARGET_REACH:
+            self._targets.pop(0)
+            if not self._targets:
+                self._finish_targets(MotorResponseCode.SUCCESS)
+            return
+        error = (math.degrees(math.atan2(dy, dx)) - self.angle + 180) % 360 - 180
+        top = self._target_speed.max
+        if self._target_speed.speed_change_type in (SpeedChangeType.Deceleration,
+                                                    SpeedChangeType.AccelerationAndDeceleration):
+            # 最後の目標に近づいたら減速する
+            if len(self._targets) == 1:
+                top = min(top, max(MOTOR_DEAD_ZONE + 5, distance))
+        if self._target_linear and abs(error) > TARGET_TURN_ANGLE:
+            turn = math.copysign(TARGET_TURN_SPEED, error)
+            self.command = (int(turn), int(-turn))
+            return
+        turn = max(min(error * 0.8, top / 2), -top / 2)
+        self.command = (int(top + turn), int(top - turn))
+
+    def advance(self, dt):
+        """ 仮想時間 dt [s] だけ姿勢を進め、必要ならID通知を送る """
+        if self._targets:
+            self._drive_to_target(dt)
+        if self._motor_remaining is not None:
+            self._motor_remaining -= dt
+            if self._motor_remaining <= 0:
+                self.command = (0, 0)
+                self._motor_remaining = None
+
+        # モーターの一次遅れ
+        k = min(dt / MOTOR_TIME_CONSTANT, 1.0)
+        self.wheel_left += (speed_from_param(self.command[0]) - self.wheel_left) * k
+        self.wheel_right += (speed_from_param(self.command[1]) - self.wheel_right) * k
+
+        # 差動二輪の運動学（マット座標はy軸が下向き、角度は時計回りが正）
+        v = (self.wheel_left + self.wheel_right) / 2
+        omega = (self.wheel_left - self.wheel_right) / (WHEEL_BASE_MM * MAT_UNITS_PER_MM)
+        theta = math.radians(self.angle)
+        self.x += v * math.cos(theta) * dt
+        self.y += v * math.sin(theta) * dt
+        self.angle = math.degrees(theta + omega * dt) % 360
+
+        self._since_notify += dt
+        self._since_sent += dt
+        if self._since_notify >= self.notify_interval - 1e-9:
+            self._since_notify = 0.0
+            payload = self.id_payload()
+            if payload == self._last_sent and self.notify_condition != NotificationCondition.Always:
+                # 変化がなければ送らない（「変化時+300msごと」なら 300ms 経っていれば送る）
+                if (self.notify_condition == NotificationCondition.ChangeDetection
+                        or self._since_sent < PERIODIC_NOTIFY_INTERVAL - 1e-9):
+                    return
+            self._last_sent = payload
+            self._since_sent = 0.0
+            self.notifications += 1
+            if self.notify_latency > 0:
+                asyncio.get_running_loop().create_task(self._notify_later(payload))
+            else:
+                self.api.id_information._notify(payload)
+
+    async def _notify_later(self, payload):
+        await self.clock.sleep(self.notify_latency)
+        self.api.id_information._notify(payload)
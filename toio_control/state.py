@@ -0,0 +1,94 @@
+import asyncio
+from typing import NamedTuple, Optional
+
+from .clock import REAL_CLOCK
+from .decode import PoseRecord, decode_id
+
+
+class PoseSnapshot(NamedTuple):
+    """ ある時点の座標をまとめて写したもの（途中で書き換わらない） """
+    seq: int
+    x: int
+    y: int
+    angle: int
+    on_mat: bool
+    received_at: Optional[float]
+
+
+class CubeState(PoseRecord):
+    """
+    1台分の状態。ID通知のハンドラとして登録すると、座標を受け取るたびに自分に上書きする。
+
+    スクリプトのグローバル変数の代わりに台ごとに1つ作るので、1つのプロセスで何台でも扱える。
+    snapshot() は通し番号 seq 付きの組で座標を返す（読んでいる途中で次の通知に変わらない）。
+    最初の座標や次の座標は await で待てるので、受信したかどうかを一定間隔で確かめなくてよい。
+
+    >>> state = CubeState(clock)
+    >>> await cube.api.id_information.register_notification_handler(state)
+    >>> pose = await state.first_pose()     # 座標が届いた瞬間に起きる
+    >>> pose = await state.next_pose(pose.seq)
+    """
+
+    __slots__ = ("clock", "first_received_at", "_waiters")
+
+    def __init__(self, clock=REAL_CLOCK):
+        super().__init__()
+        self.clock = clock
+        self.first_received_at = None  # 最初に PositionId を受け取った時刻
+        self._waiters = []  # 次の座標を待っている future
+
+    def __call__(self, payload):
+        # ID通知のハンドラ（PositionId だけ自分に書き込む）
+        self.receive(payload, self.clock.now())
+
+    def receive(self, payload, now=None):
+        """ 通知を解析して書き込み、PositionId だったら待っている人を起こして True を返す """
+        if decode_id(payload, self, now) is not self:
+            return False
+        if self.first_received_at is None:
+            self.first_received_at = now
+        if self._waiters:
+            waiters, self._waiters = self._waiters, []
+            for fut in waiters:
+                if not fut.done():
+                    fut.set_result(None)
+        return True
+
+    def notification_rate(self):
+        """ 最初の座標から最後の座標までに届いた PositionId の頻度 [Hz] """
+        if self.seq < 2 or self.first_received_at is None or self.received_at <= self.first_received_at:
+            return 0.0
+        return (self.seq - 1) / (self.received_at - self.first_received_at)
+
+    def snapshot(self):
+        return PoseSnapshot(self.seq, self.x, self.y, self.angle, self.on_mat, self.received_at)
+
+    async def next_pose(self, after=None):
+        """ 通し番号が after（省略時は今の番号）より新しい座標が届くまで待ち、その写しを返す """
+        after = self.seq if after is None else after
+        while self.seq <= after:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            await fut
+        return self.snapshot()
+
+    async def first_pose(self):
+        """ 座標を一度でも受け取っていればすぐに、まだなら最初の座標が届くまで待って写しを返す """
+        return await self.next_pose(0)
+
+
+async def take_over(id_information, handler, state=None):
+    """
+    ID通知のハンドラを state から handler に入れ替える（handler が state に書き込む場合）。
+    同じ通知を2回解析しないように、入れ替えている間は state を外しておく。state が None なら登録するだけ。
+    """
+    if state is not None:
+        await id_information.unregister_notification_handler(state)
+    await id_information.register_notification_handler(handler)
+
+
+async def give_back(id_information, handler, state=None):
+    """ take_over() の逆。handler を外して state を登録し直す """
+    await id_information.unregister_notification_handler(handler)
+    if state is not None:
+        await id_information.register_notification_handler(state)
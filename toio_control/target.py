@@ -0,0 +1,136 @@
+import asyncio
+import math
+
+from toio import MotorResponseCode, MovementType, RotationOption, SpeedChangeType, WriteMode
+
+from .clock import REAL_CLOCK
+from .state import CubeState, give_back, take_over
+
+# 巡回の進め方
+HOST = "host"      # ホストのPIDで 50ms ごとにモーター指令を送る（従来の方式）
+TARGET = "target"  # キューブ内蔵の目標指定制御に経由点をまとめて渡し、完了の通知を待つ
+
+# 複数目標指定の1回の書き込みに入る目標の数（toio の仕様の上限）
+MAX_TARGETS_PER_WRITE = 29
+# 応答の種類（ResponseMotorControlTarget / ResponseMotorControlMultipleTargets）
+_RESPONSE_TARGET = 0x83
+_RESPONSE_MULTIPLE_TARGETS = 0x84
+_SUCCESS = (MotorResponseCode.SUCCESS, MotorResponseCode.SUCCESS_WITH_OVERWRITE)
+
+
+class TargetTourResult:
+    """ 目標指定制御で巡回した結果 """
+
+    def __init__(self):
+        self.reached = 0       # 到着した経由点の数（ここから先はホストで引き継ぐ）
+        self.writes = 0        # モーターへの書き込み回数
+        self.response = None   # 最後に受け取った応答コード
+        self.elapsed = 0.0     # かかった時間 [s]
+
+    def report(self, total):
+        code = self.response.name if self.response is not None else "応答なし"
+        return (f"目標指定制御: {self.reached}/{total} 地点, 書き込み {self.writes}回, "
+                f"{self.elapsed:.2f}s, 最後の応答 {code}")
+
+
+class _TourWatcher:
+    """ ID通知とモーターの応答を受け取り、どの経由点まで着いたかを数える（座標は state に書き込む） """
+
+    def __init__(self, waypoints, reach, clock, on_pose=None, state=None):
+        self.waypoints = waypoints
+        self.reach = reach
+        self.clock = clock
+        self.on_pose = on_pose
+        self.passed = 0
+        self.pose = state if state is not None else CubeState(clock)
+        self.responses = asyncio.Queue()
+
+    def on_id(self, payload):
+        now = self.clock.now()
+        if not self.pose.receive(payload, now):
+            return
+        while self.passed < len(self.waypoints):
+            x, y = self.waypoints[self.passed]
+            if math.hypot(x - self.pose.x, y - self.pose.y) >= self.reach:
+                break
+            print(f"ポイント[{self.passed}]到達")
+            self.passed += 1
+        if self.on_pose is not None:
+            self.on_pose(self.pose, self.passed, now)
+
+    def on_motor(self, payload):
+        if payload[0] in (_RESPONSE_TARGET, _RESPONSE_MULTIPLE_TARGETS):
+            self.responses.put_nowait((payload[0], MotorResponseCode(payload[2])))
+
+    async def wait_response(self, kind, limit):
+        """ kind の応答を待つ。limit [s] 待っても来なければ None """
+        get = asyncio.ensure_future(self._next(kind))
+        timer = asyncio.ensure_future(self.clock.sleep(limit))
+        await asyncio.wait((get, timer), return_when=asyncio.FIRST_COMPLETED)
+        timer.cancel()
+        if not get.done():
+            get.cancel()
+            return None
+        return get.result()
+
+    async def _next(self, kind):
+        while True:
+            response, code = await self.responses.get()
+            if response == kind:
+                return code
+
+
+async def run_target_tour(cube, waypoints, clock=REAL_CLOCK, max_speed=70, timeout_s=10,
+                          movement_type=MovementType.Linear, reach=20, on_pose=None, state=None):
+    """
+    経由点を目標指定制御でキューブに渡し、完了の通知を待つ。
+    複数目標指定（29点ずつ）に対応していないキューブでは1点ずつの目標指定に切り替える。
+    途中で失敗したら、そこまでに着いた経由点の数を result.reached に入れて返す。
+    on_pose(pose, passed, now) は座標が届くたびに呼ばれる（passed は着いた経由点の数。走行ログ用）。
+    state（ID通知に登録済みの CubeState）を渡すと、巡回の間はそのハンドラと入れ替えて state に座標を書き込む。
+    """
+    result = TargetTourResult()
+    watcher = _TourWatcher(waypoints, reach, clock, on_pose, state)
+    motor = cube.api.motor
+    speed = (max_speed, int(SpeedChangeType.AccelerationAndDeceleration))
+    # 応答が来ないときにホスト側で待つ上限（キューブ側の制限時間 + 余裕）
+    wait_limit = timeout_s + 2.0
+    started = clock.now()
+
+    await take_over(cube.api.id_information, watcher.on_id, state)
+    await motor.register_notification_handler(watcher.on_motor)
+    try:
+        use_multiple = True
+        done = 0
+        while done < len(waypoints):
+            if use_multiple:
+                chunk = waypoints[done:done + MAX_TARGETS_PER_WRITE]
+                targets = [(int(x), int(y), 0, int(RotationOption.WithoutRotation)) for x, y in chunk]
+                await motor.motor_control_multiple_targets(
+                    timeout_s, movement_type, speed, WriteMode.Overwrite, targets)
+                result.writes += 1
+                code = await watcher.wait_response(_RESPONSE_MULTIPLE_TARGETS, wait_limit * len(chunk))
+                if code == MotorResponseCode.ERROR_NOT_SUPPORTED:
+                    print("複数目標指定に対応していないため、1点ずつ送ります")
+                    use_multiple = False
+                    continue
+            else:
+                chunk = waypoints[done:done + 1]
+                x, y = chunk[0]
+                await motor.motor_control_target(
+                    timeout_s, movement_type, speed,
+                    (int(x), int(y), 0, int(RotationOption.WithoutRotation)))
+                result.writes += 1
+                code = await watcher.wait_response(_RESPONSE_TARGET, wait_limit)
+            result.response = code
+            if code not in _SUCCESS:
+                break
+            done += len(chunk)
+            # 通知の取りこぼしで数え損ねた経由点も、完了の応答が来たら到着とみなす
+            watcher.passed = max(watcher.passed, done)
+    finally:
+        await motor.unregister_notification_handler(watcher.on_motor)
+        await give_back(cube.api.id_information, watcher.on_id, state)
+    result.reached = watcher.passed
+    result.elapsed = clock.now() - started
+    return result
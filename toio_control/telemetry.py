@@ -0,0 +1,149 @@
+import asyncio
+import time
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+# 1行分の記録の形式（列ごとに型を固定する）
+TELEMETRY_DTYPE = np.dtype([
+    ("time", "f8"),
+    ("cube_id", "i2"),
+    ("distance", "f4"),
+    ("current_angle", "f4"),
+    ("target_angle", "f4"),
+    ("left_speed", "i2"),
+    ("right_speed", "i2"),
+])
+
+
+def make_run_dir(base="logs"):
+    """ base の下に実行ごとのフォルダ（例: logs/20250101-120000）を作って返す """
+    path = Path(base) / time.strftime("%Y%m%d-%H%M%S")
+    suffix = 1
+    while path.exists():
+        path = Path(base) / f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+        suffix += 1
+    path.mkdir(parents=True)
+    return path
+
+
+def iter_chunks(directory):
+    """ 保存したチャンク（.npy）を古い順に1つずつ読み込む（メモリマップなので全体は読まない） """
+    for path in sorted(Path(directory).glob("*.npy")):
+        yield np.load(path, mmap_mode="r")
+
+
+class TelemetryRecorder:
+    """
+    制御ループの記録を、決まった大きさのチャンク（NumPy配列）に貯めていく記録係。
+
+    チャンクは max_chunks 個だけ最初に確保し、いっぱいになったものから順に
+    バックグラウンドで directory へ .npy として書き出して使い回す。
+    directory=None ならディスクには書かず、最新 max_chunks 個分だけをメモリに残す。
+    書き出しが追いつかないときは、一番古い未保存のチャンクを捨てる（dropped_rows に数える）。
+    チャンクが埋まらなくても、最初の行から flush_interval [s]（記録の time で測る）たったら書き出すので、
+    途中で落ちても失うのはその間の分だけ。書き出しに失敗したらすぐ表示し、次の append() で例外を投げる。
+
+    >>> async with TelemetryRecorder("logs/run1") as telemetry:
+    >>>     telemetry.append(now, 0, distance, angle, target_deg, left, right)
+    """
+
+    def __init__(self, directory=None, chunk_rows=4096, max_chunks=8, flush_interval=5.0):
+        self.directory = Path(directory) if directory is not None else None
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self._free = deque(np.zeros(chunk_rows, TELEMETRY_DTYPE) for _ in range(max_chunks))
+        self._current = self._free.popleft()
+        self._n = 0
+        self._started_at = 0.0  # 今のチャンクの最初の行の time
+        self._pending = deque()  # いっぱいになったチャンク (配列, 行数)
+        self._wake = None
+        self._writer = None
+        self._error = None  # 書き込みタスクが失敗したときの例外
+        self._closing = False
+        self._listeners = []
+        self.rows = 0
+        self.dropped_rows = 0
+        self.written_chunks = 0
+
+    async def __aenter__(self):
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._wake = asyncio.Event()
+            self._writer = asyncio.get_running_loop().create_task(self._write_loop())
+            self._writer.add_done_callback(self._on_writer_done)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def add_listener(self, listener):
+        """ 1行追加されるたびに listener(row) を呼ぶ（ライブ表示など用） """
+        self._listeners.append(listener)
+
+    def append(self, time, cube_id, distance, current_angle, target_angle, left_speed, right_speed):
+        if self._error is not None:
+            raise RuntimeError("走行ログの書き出しに失敗しています") from self._error
+        row = (time, cube_id, distance, current_angle, target_angle, left_speed, right_speed)
+        if self._n == 0:
+            self._started_at = time
+        self._current[self._n] = row
+        for listener in self._listeners:
+            listener(row)
+        self._n += 1
+        self.rows += 1
+        if self._n == self.chunk_rows or \
+                (self._wake is not None and time - self._started_at >= self.flush_interval):
+            self._rotate()
+
+    def _on_writer_done(self, task):
+        # 書き込みタスクが例外で終わったら、その場で知らせて次の append() で投げ直す
+        if task.cancelled() or task.exception() is None:
+            return
+        self._error = task.exception()
+        print(f"走行ログの書き出しに失敗しました: {self._error!r}")
+
+    def _rotate(self):
+        self._pending.append((self._current, self._n))
+        if self._free:
+            self._current = self._free.popleft()
+        else:
+            # 空きがない → 一番古い未保存チャンクを上書きする
+            oldest, n = self._pending.popleft()
+            self.dropped_rows += n
+            self._current = oldest
+        self._n = 0
+        if self._wake is not None:
+            self._wake.set()
+
+    def snapshot(self):
+        """ メモリに残っている記録を古い順に連結して返す（directory=None のとき用） """
+        parts = [chunk[:n] for chunk, n in self._pending]
+        parts.append(self._current[:self._n])
+        return np.concatenate(parts)
+
+    async def _write_loop(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._pending:
+                chunk, n = self._pending.popleft()
+                path = self.directory / f"{self.written_chunks:06d}.npy"
+                # ファイル書き込みは別スレッドで行い、制御ループを止めない
+                await asyncio.to_thread(np.save, path, chunk[:n])
+                self.written_chunks += 1
+                self._free.append(chunk)
+            if self._closing:
+                return
+
+    async def close(self):
+        """ 書きかけのチャンクも含めてすべて書き出し、書き込みタスクを終える """
+        if self._writer is None:
+            return
+        if self._n:
+            self._rotate()
+        self._closing = True
+        self._wake.set()
+        writer, self._writer = self._writer, None
+        await writer
@@ -0,0 +1,193 @@
+import math
+
+import numpy as np
+
+from .drive import MOTOR_LIMIT
+from .geometry import get_angle_diff
+from .model import MAT_UNITS_PER_MM, MM_PER_SPEED_UNIT, MOTOR_DEAD_ZONE, WHEEL_BASE_MM
+
+# ホストで巡回するときの進み方
+PURSUIT = "pursuit"    # 経由点を滑らかな曲線でつなぎ、速度を保ったまま曲がる（pure pursuit）
+WAYPOINT = "waypoint"  # 経由点ごとに近づいてから向きを変える（距離と角度の PID）
+
+# --- 軌道の設定 ---
+SAMPLE_SPACING = 2.0     # 表（LUT）の点の間隔 [マット単位]
+MAX_SPEED = 350          # 最高速度 [単位/s]（指令値でおよそ 85。残りは曲がるための左右差に使う）
+MIN_SPEED = 60           # 最低速度 [単位/s]（これより遅いとモーターが回らないことがある）
+MAX_ACCEL = 1500         # 加速・減速の上限 [単位/s²]
+MAX_LATERAL_ACCEL = 1500 # 曲がるときの横向きの加速度の上限 [単位/s²]（曲率が大きいほど遅くなる）
+
+# --- 追従の設定 ---
+LOOKAHEAD_MIN = 20       # 先読み距離の最小値 [単位]
+LOOKAHEAD_TIME = 0.25    # 先読み距離 = 速度 × LOOKAHEAD_TIME（LOOKAHEAD_MIN 以上）[s]
+SEARCH_WINDOW = 60       # 最寄りの点を探す範囲（前回の位置から先の点の数）
+TURN_IN_PLACE = 90       # 先読み点がこれ以上後ろ [度] にあれば、その場で向きを変える
+TURN_SPEED = 40          # その場で回るときの指令値
+
+# 車輪の間隔 [単位] と、速度 [単位/s] → モーター指令値の換算
+WHEEL_BASE = WHEEL_BASE_MM * MAT_UNITS_PER_MM
+PARAM_PER_SPEED = 1 / (MM_PER_SPEED_UNIT * MAT_UNITS_PER_MM)
+
+
+def catmull_rom(points, samples_per_segment=32):
+    """
+    点の列 (n, 2) を通るセントリペタル Catmull-Rom 曲線を細かく並べた点 (m, 2) と、
+    元の各点が何番目の点になったか (n,) を返す（両端は端の点を延ばして扱う）。
+    """
+    p = np.asarray(points, dtype=float)
+    ext = np.vstack((2 * p[0] - p[1], p, 2 * p[-1] - p[-2]))
+    t = np.linspace(0.0, 1.0, samples_per_segment, endpoint=False)[:, None]
+    pieces = []
+    for k in range(len(p) - 1):
+        p0, p1, p2, p3 = ext[k:k + 4]
+        # 点の間隔の平方根でパラメータを決める（曲がり角でループや尖りができない）
+        d01 = max(np.hypot(*(p1 - p0)) ** 0.5, 1e-6)
+        d12 = max(np.hypot(*(p2 - p1)) ** 0.5, 1e-6)
+        d23 = max(np.hypot(*(p3 - p2)) ** 0.5, 1e-6)
+        m1 = (p2 - p1) + d12 * ((p1 - p0) / d01 - (p2 - p0) / (d01 + d12))
+        m2 = (p2 - p1) + d12 * ((p3 - p2) / d23 - (p3 - p1) / (d12 + d23))
+        t2, t3 = t * t, t * t * t
+        pieces.append((2 * t3 - 3 * t2 + 1) * p1 + (t3 - 2 * t2 + t) * m1
+                      + (-2 * t3 + 3 * t2) * p2 + (t3 - t2) * m2)
+    pieces.append(p[-1:])
+    knots = np.arange(len(p)) * samples_per_segment
+    return np.vstack(pieces), knots
+
+
+class Trajectory:
+    """
+    経由点を通る滑らかな軌道を、道のり s の等間隔の表（LUT）として持つ。
+
+    表の各点に座標・向き・曲率・その点での目標速度が入っている。速度は曲率から決まる上限を、
+    加速度の上限を守るように前後からならしたもの（最初と最後は 0）。
+    作るのは最初の1回だけで、走行中は表を引くだけで済む。
+
+    >>> trajectory = Trajectory.fit([(100, 100), (150, 150), (350, 150)])
+    >>> trajectory.x[k], trajectory.y[k], trajectory.speed[k]
+    """
+
+    def __init__(self, s, x, y, heading, curvature, speed, waypoint_s):
+        self.s = s                    # 始点からの道のり [単位]
+        self.x = x
+        self.y = y
+        self.heading = heading        # 進む向き [度]
+        self.curvature = curvature    # 曲率 [1/単位]（左右は向きが増える方が正）
+        self.speed = speed            # 目標速度 [単位/s]
+        self.waypoint_s = waypoint_s  # 各経由点の道のり
+        self.length = float(s[-1])
+
+    def __len__(self):
+        return len(self.s)
+
+    @classmethod
+    def fit(cls, waypoints, spacing=SAMPLE_SPACING, max_speed=MAX_SPEED, max_accel=MAX_ACCEL,
+            max_lateral_accel=MAX_LATERAL_ACCEL):
+        points = [waypoints[0]]
+        for point in waypoints[1:]:
+            if math.hypot(point[0] - points[-1][0], point[1] - points[-1][1]) > 1e-6:
+                points.append(point)  # 同じ点が続くと曲線が作れないので省く
+        if len(points) < 2:
+            points.append((points[0][0] + spacing, points[0][1]))
+        dense, knots = catmull_rom(points)
+
+        # 細かい点の道のりを求め、等間隔に並べ直す
+        step = np.hypot(*np.diff(dense, axis=0).T)
+        dense_s = np.concatenate(([0.0], np.cumsum(step)))
+        s = np.arange(0.0, dense_s[-1], spacing)
+        s = np.append(s, dense_s[-1]) if dense_s[-1] - s[-1] > 1e-6 else s
+        x = np.interp(s, dense_s, dense[:, 0])
+        y = np.interp(s, dense_s, dense[:, 1])
+
+        # 向きと曲率（向きの変化 / 道のり）
+        heading = np.degrees(np.unwrap(np.arctan2(np.gradient(y), np.gradient(x))))
+        curvature = np.gradient(np.radians(heading), s)
+
+        # 速度の上限：曲率（横向きの加速度）→ 加速の上限で前から → 減速の上限で後ろから
+        limit = np.minimum(max_speed, np.sqrt(max_lateral_accel / np.maximum(np.abs(curvature), 1e-9)))
+        speed = limit.copy()
+        speed[0] = 0.0
+        ds = np.diff(s)
+        for k in range(1, len(s)):
+            speed[k] = min(speed[k], math.sqrt(speed[k - 1] ** 2 + 2 * max_accel * ds[k - 1]))
+        speed[-1] = 0.0
+        for k in range(len(s) - 2, -1, -1):
+            speed[k] = min(speed[k], math.sqrt(speed[k + 1] ** 2 + 2 * max_accel * ds[k]))
+        return cls(s, x, y, heading % 360, curvature, speed, dense_s[knots])
+
+
+class PurePursuit:
+    """
+    Trajectory を pure pursuit でたどる。
+
+    前回の最寄りの点から先の SEARCH_WINDOW 点だけを調べて今いる所を決め（1回あたり一定の計算量）、
+    そこから先読み距離だけ先の点へ向かう円弧の曲率と、表の目標速度から左右のモーター指令を作る。
+
+    >>> follower = PurePursuit(Trajectory.fit(points))
+    >>> left, right = follower.command(x, y, angle)  # 終点に着いたら None
+    """
+
+    def __init__(self, trajectory, reach=20, lookahead_min=LOOKAHEAD_MIN, lookahead_time=LOOKAHEAD_TIME):
+        self.trajectory = trajectory
+        self.reach = reach
+        self.lookahead_min = lookahead_min
+        self.lookahead_time = lookahead_time
+        self.index = 0          # 今いる所に一番近い表の点
+        self.next_waypoint = 1  # 次に通る経由点（0 は始点）
+        self.lookahead = (trajectory.x[0], trajectory.y[0])  # 最後に向かった先読み点
+        self.cross_track = 0.0  # 軌道からのずれ [単位]
+        self.remaining = trajectory.length  # 終点までの残りの道のり [単位]
+
+    def _locate(self, x, y):
+        t = self.trajectory
+        end = min(self.index + SEARCH_WINDOW, len(t))
+        d = np.hypot(t.x[self.index:end] - x, t.y[self.index:end] - y)
+        k = int(np.argmin(d))
+        self.index += k
+        self.cross_track = float(d[k])
+
+    def passed_waypoints(self):
+        """ 前回から通り過ぎた経由点の番号を返す（「到達」の表示用） """
+        t = self.trajectory
+        passed = []
+        while (self.next_waypoint < len(t.waypoint_s)
+               and t.s[self.index] + self.reach >= t.waypoint_s[self.next_waypoint]):
+            passed.append(self.next_waypoint)
+            self.next_waypoint += 1
+        return passed
+
+    def command(self, x, y, angle, measured=None):
+        """
+        今の姿勢から (left, right) を返す。終点まで reach 以内に来たら None。
+        measured=(x, y) を渡すと、着いたかどうかは姿勢（推定器の予測など）ではなくこちらで判定する。
+        """
+        t = self.trajectory
+        self._locate(x, y)
+        self.remaining = t.length - t.s[self.index]
+        mx, my = (x, y) if measured is None else measured
+        if self.remaining < self.reach and math.hypot(t.x[-1] - mx, t.y[-1] - my) < self.reach:
+            return None
+
+        speed = max(t.speed[self.index], MIN_SPEED)
+        lookahead = max(self.lookahead_min, speed * self.lookahead_time)
+        k = min(int(np.searchsorted(t.s, t.s[self.index] + lookahead)), len(t) - 1)
+        tx, ty = t.x[k], t.y[k]
+        self.lookahead = (tx, ty)
+        distance = math.hypot(tx - x, ty - y)
+        alpha = get_angle_diff(math.degrees(math.atan2(ty - y, tx - x)), angle)
+        if abs(alpha) >= TURN_IN_PLACE:
+            # 先読み点が後ろにある（向きが大きくずれている）ときは、その場で向きを変える
+            turn = TURN_SPEED if alpha > 0 else -TURN_SPEED
+            return turn, -turn
+        # 先読み点を通る円弧の曲率 κ = 2 sin(α) / L。向きが増える方に曲がるには左を速くする
+        curvature = 2 * math.sin(math.radians(alpha)) / max(distance, 1e-6)
+        left = speed * (1 + curvature * WHEEL_BASE / 2) * PARAM_PER_SPEED
+        right = speed * (1 - curvature * WHEEL_BASE / 2) * PARAM_PER_SPEED
+        return _to_param(left), _to_param(right)
+
+
+def _to_param(value):
+    # 指令値は整数で ±MOTOR_LIMIT に収め、回らないほど小さい値は回る値まで上げる（止まる指令は 0 のまま）
+    value = int(round(max(min(value, MOTOR_LIMIT), -MOTOR_LIMIT)))
+    if 0 < abs(value) < MOTOR_DEAD_ZONE:
+        value = MOTOR_DEAD_ZONE if value > 0 else -MOTOR_DEAD_ZONE
+    return value
@@ -0,0 +1,233 @@
+import argparse
+import itertools
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from toio_control import PIDBank, get_angle_diff, mix_wheels
+from toio_control.cli import load_script
+from toio_control.estimator import PoseEstimator
+from toio_control.gains import GAIN_NAMES, GAINS_FILE, format_gains, load_gains, save_gains
+from toio_control.sim import SimulatedCube
+
+# --- 設定 ---
+# ゲインを探すスクリプト（出力制限 OUT_LIMIT と制御周期 CONTROL_PERIOD はスクリプトの値で試走する）
+SCRIPTS = ("3_pid_control.py", "4_traveling.py", "5_obstacle.py")
+# 探索する範囲（ランダム探索はこの範囲から一様に選ぶ）
+SEARCH_SPACE = {
+    "DIST_KP": (0.2, 2.0),
+    "DIST_KI": (0.0, 0.2),
+    "DIST_KD": (0.0, 0.2),
+    "ANGLE_KP": (0.2, 1.5),
+    "ANGLE_KI": (0.0, 0.05),
+    "ANGLE_KD": (0.0, 0.05),
+}
+# グリッド探索で試す値（全組み合わせ）
+GRID = {
+    "DIST_KP": (0.4, 0.8, 1.2, 1.6),
+    "DIST_KI": (0.0, 0.05),
+    "DIST_KD": (0.0, 0.04, 0.1),
+    "ANGLE_KP": (0.3, 0.6, 0.9, 1.2),
+    "ANGLE_KI": (0.0,),
+    "ANGLE_KD": (0.0, 0.01, 0.03),
+}
+
+# 試走のシナリオ（スタート地点 (x, y, 角度) と経由点。最後の点で止まる）
+SCENARIOS = {
+    "前方へ": ((100, 100, 0), [(250, 250)]),
+    "後ろへ": ((250, 250, 0), [(120, 250)]),
+    "横へ": ((150, 300, 270), [(350, 300)]),
+    "巡回": ((100, 100, 0), [(150, 150), (350, 150), (350, 350), (150, 350), (150, 150)]),
+}
+
+# 試走の条件（出力制限と制御周期はスクリプトから読む）
+REACH_THRESHOLD = 20
+NOTIFY_LATENCY = 0.02    # 試走でも座標はこれだけ遅れて届く
+SIM_DT = 0.005
+TIME_LIMIT = 15.0        # 1シナリオの制限時間 [s]（超えたら失敗）
+SETTLE_TIME = 0.3        # 止まってから最終位置を測るまでの時間 [s]
+
+# 評価の重み（かかった時間 [s] に足す。距離はマット単位）
+OVERSHOOT_WEIGHT = 0.02  # 経由点を行き過ぎた距離
+PATH_WEIGHT = 0.02       # 経由点を結ぶ線からのずれ（二乗平均）
+FAIL_WEIGHT = 0.05       # 着けなかったときの残りの距離
+
+
+def rollout(gains, scenario, out_limit, control_period, use_estimator=True):
+    """
+    シミュレーターの運動モデルで1シナリオ走らせ、
+    (かかった時間 [s], 行き過ぎ [単位], 線からのずれ [単位], 着いたか) を返す。
+    制御はスクリプトと同じ（PIDBank + mix_wheels、推定器があればD項は推定速度から）。
+    out_limit と control_period はゲインを使うスクリプトの OUT_LIMIT と CONTROL_PERIOD。
+    """
+    (sx, sy, sa), waypoints = scenario
+    cube = SimulatedCube(x=sx, y=sy, angle=sa)
+    pid = PIDBank(1,
+                  kp=(gains["DIST_KP"], gains["ANGLE_KP"]),
+                  ki=(gains["DIST_KI"], gains["ANGLE_KI"]),
+                  kd=(gains["DIST_KD"], gains["ANGLE_KD"]),
+                  out_limit=out_limit)
+    estimator = PoseEstimator(notify_latency=NOTIFY_LATENCY) if use_estimator else None
+    samples = deque()  # (測った時刻, x, y, angle)：NOTIFY_LATENCY 後に届く
+    seen = None
+    ticks_per_notify = max(1, round(cube.notify_interval / SIM_DT))
+    ticks_per_control = max(1, round(control_period / SIM_DT))
+
+    wp = 0
+    segment_start = (sx, sy)
+    overshoot = 0.0
+    path_error_sq = 0.0
+    path_samples = 0
+    last_time = 0.0
+    now = 0.0
+    tick = 0
+    while now < TIME_LIMIT:
+        tick += 1
+        cube.advance(SIM_DT)
+        now = tick * SIM_DT
+
+        # 座標の通知（遅れて届く）
+        if tick % ticks_per_notify == 0:
+            samples.append((now, round(cube.x), round(cube.y), round(cube.angle) % 360))
+        while samples and samples[0][0] + NOTIFY_LATENCY <= now + 1e-9:
+            measured_at, *seen = samples.popleft()
+            if estimator is not None:
+                estimator.measure(*seen, measured_at + NOTIFY_LATENCY)
+
+        # 今の区間から見た行き過ぎと、線からのずれ（本当の位置で測る）
+        tx, ty = waypoints[wp]
+        ax, ay = segment_start
+        length = math.hypot(tx - ax, ty - ay)
+        if length > 1e-6:
+            ux, uy = (tx - ax) / length, (ty - ay) / length
+            along = (cube.x - ax) * ux + (cube.y - ay) * uy
+            overshoot = max(overshoot, along - length)
+            path_error_sq += ((cube.x - ax) * uy - (cube.y - ay) * ux) ** 2
+            path_samples += 1
+
+        if tick % ticks_per_control or seen is None:
+            continue
+        x, y, angle = estimator.predict(now) if estimator is not None else seen
+        dx, dy = tx - x, ty - y
+        distance = math.hypot(dx, dy)
+        # 着いたかどうかは予測ではなく届いた座標で判定する（予測は少し先の位置なので手前で止まる）
+        if math.hypot(tx - seen[0], ty - seen[1]) < REACH_THRESHOLD:
+            segment_start = (tx, ty)
+            wp += 1
+            pid.reset()
+            if wp == len(waypoints):
+                cube.set_motor(0, 0)
+                for _ in range(round(SETTLE_TIME / SIM_DT)):
+                    cube.advance(SIM_DT)
+                final = math.hypot(tx - cube.x, ty - cube.y)
+                overshoot = max(overshoot, final - REACH_THRESHOLD)
+                path_rms = math.sqrt(path_error_sq / max(path_samples, 1))
+                return now, overshoot, path_rms, True
+            continue
+        angle_diff = get_angle_diff(math.degrees(math.atan2(dy, dx)), angle)
+        rates = [estimator.error_rates(tx, ty)] if estimator is not None else None
+        outputs = pid.update([[distance, angle_diff]], now - last_time, rates=rates)
+        last_time = now
+        left, right = (int(v) for v in mix_wheels(outputs)[0])
+        cube.set_motor(left, right)
+        if estimator is not None:
+            estimator.command(left, right, now)
+
+    # 時間切れ：残りの経由点までの距離を失敗の大きさにする
+    remaining = math.hypot(waypoints[wp][0] - cube.x, waypoints[wp][1] - cube.y)
+    for a, b in zip(waypoints[wp:], waypoints[wp + 1:]):
+        remaining += math.hypot(b[0] - a[0], b[1] - a[1])
+    path_rms = math.sqrt(path_error_sq / max(path_samples, 1))
+    return TIME_LIMIT + remaining * FAIL_WEIGHT, overshoot, path_rms, False
+
+
+def evaluate(gains, out_limit, control_period):
+    """ 全シナリオを走らせて (評価値, シナリオごとの結果) を返す（小さいほど良い） """
+    score = 0.0
+    details = {}
+    for name, scenario in SCENARIOS.items():
+        elapsed, overshoot, path_rms, reached = rollout(gains, scenario, out_limit, control_period)
+        score += elapsed + OVERSHOOT_WEIGHT * overshoot + PATH_WEIGHT * path_rms
+        details[name] = {"time_s": round(elapsed, 3), "overshoot": round(overshoot, 1),
+                         "path_rms": round(path_rms, 1), "reached": reached}
+    return score, details
+
+
+def _evaluate_one(gains, out_limit, control_period):
+    # プロセスプールに渡す関数（ゲインも一緒に返す）
+    score, details = evaluate(gains, out_limit, control_period)
+    return score, gains, details
+
+
+def grid_candidates():
+    for values in itertools.product(*(GRID[name] for name in GAIN_NAMES)):
+        yield dict(zip(GAIN_NAMES, values))
+
+
+def random_candidates(n, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(n):
+        yield {name: float(rng.uniform(*SEARCH_SPACE[name])) for name in GAIN_NAMES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="シミュレーターでの試走でPIDゲインを自動で探します")
+    parser.add_argument("script", choices=SCRIPTS, help="ゲインを探すスクリプト")
+    parser.add_argument("--method", choices=("grid", "random"), default="random", help="探索の方法")
+    parser.add_argument("--samples", type=int, default=400, help="ランダム探索で試す数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="並列に動かすプロセス数")
+    parser.add_argument("--top", type=int, default=5, help="表示する上位の数")
+    parser.add_argument("--dry-run", action="store_true", help=f"{GAINS_FILE.name} に書き出さない")
+    args = parser.parse_args()
+
+    if args.method == "grid":
+        candidates = list(grid_candidates())
+    else:
+        candidates = list(random_candidates(args.samples, args.seed))
+    # スクリプトの出力制限と制御周期で試走する
+    script = load_script(args.script)
+    out_limit, control_period = tuple(script.OUT_LIMIT), script.CONTROL_PERIOD
+    # 今使っているゲインも比べる（スクリプトに書いた値か、前回そのスクリプト用に保存したもの）
+    current = {name: getattr(script, name) for name in GAIN_NAMES}
+    current.update(load_gains(args.script))
+    candidates.append(current)
+
+    print(f"{args.script} のゲインを探します（出力制限 {out_limit}, 制御周期 {control_period}s）")
+    print(f"{len(candidates)}通りのゲインを {args.workers} プロセスで評価します "
+          f"({len(SCENARIOS)}シナリオ/通り)")
+    started = time.perf_counter()
+    chunksize = max(1, len(candidates) // (args.workers * 8))
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(partial(_evaluate_one, out_limit=out_limit, control_period=control_period),
+                                candidates, chunksize=chunksize))
+    elapsed = time.perf_counter() - started
+    print(f"評価にかかった時間 {elapsed:.1f}s "
+          f"({len(candidates) * len(SCENARIOS) / elapsed:.0f} 試走/s)")
+
+    current_score = results[-1][0]
+    results.sort(key=lambda r: r[0])
+    for rank, (score, gains, details) in enumerate(results[:args.top], 1):
+        print(f"[{rank}] 評価値 {score:.2f}: {format_gains(gains)}")
+    print(f"今のゲイン: 評価値 {current_score:.2f}: {format_gains(current)}")
+
+    best_score, best, details = results[0]
+    for name, d in details.items():
+        print(f"  {name}: {d['time_s']:.2f}s, 行き過ぎ {d['overshoot']:.0f}, "
+              f"線からのずれ {d['path_rms']:.1f}{'' if d['reached'] else ' (着けず)'}")
+    if args.dry_run:
+        return
+    save_gains(best, args.script, score=round(best_score, 3), method=args.method,
+               candidates=len(candidates), out_limit=list(out_limit), control_period=control_period,
+               scenarios=details, tuned_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+    print(f"{GAINS_FILE} に書き出しました（{args.script} で USE_TUNED_GAINS = True にするか、"
+          f"simulate.py {args.script} --tuned-gains で使えます）")
+
+
+if __name__ == '__main__':
+    main()